@@ -0,0 +1,6 @@
+#!/usr/bin/env bash
+set -eou pipefail
+cd "$(dirname "${0}")"
+
+# Compare against benchmarks/baseline.json, or save it with --save
+poetry run python -m benchmarks.bench "$@"
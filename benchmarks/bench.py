@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from argparse import ArgumentParser, Namespace
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+from influxdb_client.client.flux_table import FluxRecord, FluxTable, TableList
+
+from envoy_logger.config import Config
+from envoy_logger.decoder import get_decoder
+from envoy_logger.influxdb_sampling_engine import InfluxdbSink
+from envoy_logger.model import (
+    POWER_FIELDS,
+    SampleData,
+    SerialIndex,
+    filter_new_inverter_data,
+    parse_inverter_data,
+)
+from envoy_logger.prometheus_collector import SnapshotCollector
+from envoy_logger.prometheus_sampling_engine import PrometheusSink
+
+LOG = logging.getLogger("bench")
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Meter lines, and inverters, of the simulated fleets
+LINES = (1, 3, 6)
+INVERTERS = (10, 100, 1000)
+
+# A benchmark is a name, and a setup function returning the function to time
+Benchmark = Tuple[str, Callable[[], Callable[[], Any]]]
+
+
+def create_sample_data(lines: int) -> Dict[str, Any]:
+    # Same shape as tests/sample_data.py, with any number of lines
+    def eim(measurement_type: str) -> Dict[str, Any]:
+        return {
+            "type": "eim",
+            "readingTime": datetime.now(tz=timezone.utc).timestamp(),
+            "measurementType": measurement_type,
+            "lines": [
+                {name: 1.23 + line_index for name in POWER_FIELDS}
+                for line_index in range(lines)
+            ],
+        }
+
+    return {
+        "consumption": [eim("net-consumption"), eim("total-consumption")],
+        "production": [eim("production")],
+    }
+
+
+def create_inverter_data(inverters: int, ts: float = 1.7e9) -> List[Dict[str, Any]]:
+    return [
+        {
+            "serialNumber": f"{i:012d}",
+            "lastReportDate": ts,
+            "lastReportWatts": 123 + i % 100,
+        }
+        for i in range(inverters)
+    ]
+
+
+def create_config(database: str, inverters: int, **prometheus: Any) -> Config:
+    data = {
+        "enphaseenergy": {"email": "name@example.com", "password": "mypassword123"},
+        "envoy": {"serial": "123456789012"},
+        # Nothing is persisted by the benchmarked code
+        "state_dir": tempfile.gettempdir(),
+        "influxdb": {"url": "http://localhost:8086", "token": "token"},
+        "prometheus": {"listening_port": 0, **prometheus},
+        "inverters": {
+            f"{i:012d}": {"tags": {"row": i // 10, "col": i % 10}}
+            for i in range(inverters)
+        },
+    }
+    return Config(data, database)
+
+
+def benchmarks() -> Iterator[Benchmark]:
+    for lines in LINES:
+
+        def sample_data_create(lines: int = lines) -> Callable[[], Any]:
+            payload = create_sample_data(lines)
+            return lambda: SampleData.create(payload)
+
+        def decode_power_data(lines: int = lines) -> Callable[[], Any]:
+            content = json.dumps(create_sample_data(lines)).encode()
+            decoder = get_decoder()
+            return lambda: decoder.decode_power_data(content)
+
+        yield f"SampleData.create[lines={lines}]", sample_data_create
+        yield f"decode_power_data[lines={lines}]", decode_power_data
+
+    for inverters in INVERTERS:
+
+        def parse(inverters: int = inverters) -> Callable[[], Any]:
+            payload = create_inverter_data(inverters)
+            index = SerialIndex()
+            return lambda: parse_inverter_data(payload, index)
+
+        def filter_new(inverters: int = inverters) -> Callable[[], Any]:
+            inverter_data = parse_inverter_data(create_inverter_data(inverters))
+            # Half of the inverters have a new report. Copying the last reports
+            # is part of the timing, since filtering updates them
+            last_reports = {
+                serial: 1.7e9 - (i % 2)
+                for i, (serial, _, _) in enumerate(inverter_data.rows())
+            }
+            return lambda: filter_new_inverter_data(inverter_data, dict(last_reports))
+
+        def daily_summary(inverters: int = inverters) -> Callable[[], Any]:
+            sink = _create_influxdb_sink(inverters)
+            sink.influxdb_query_api.query.return_value = _create_flux_tables(inverters)
+            today = datetime.combine(date.today(), datetime.min.time())
+            return lambda: sink._compute_daily_Wh_points(today, "envoy")
+
+        yield f"parse_inverter_data[inverters={inverters}]", parse
+        yield f"filter_new_inverter_data[inverters={inverters}]", filter_new
+        yield f"_compute_daily_Wh_points[inverters={inverters}]", daily_summary
+
+    for lines in LINES:
+        for inverters in INVERTERS:
+            scale = f"lines={lines},inverters={inverters}"
+
+            def high_rate_points(
+                lines: int = lines, inverters: int = inverters
+            ) -> Callable[[], Any]:
+                sink = _create_influxdb_sink(inverters)
+                sample_data, inverter_data = _create_samples(lines, inverters)
+                return lambda: sink._get_high_rate_points(
+                    sample_data, inverter_data, "envoy"
+                )
+
+            yield f"_get_high_rate_points[{scale}]", high_rate_points
+
+            for metrics in ("legacy", "labeled"):
+
+                def prometheus_update(
+                    lines: int = lines, inverters: int = inverters, metrics=metrics
+                ) -> Callable[[], Any]:
+                    sink = _create_prometheus_sink(inverters, metrics)
+                    sample_data, inverter_data = _create_samples(lines, inverters)
+
+                    def update() -> None:
+                        sink._update_power_data_info(sample_data, "envoy")
+                        sink._update_inverter_data_info(inverter_data, "envoy")
+
+                    return update
+
+                yield f"prometheus_update[{metrics},{scale}]", prometheus_update
+
+            def snapshot_collect(
+                lines: int = lines, inverters: int = inverters
+            ) -> Callable[[], Any]:
+                collector = SnapshotCollector(
+                    create_config("prometheus", inverters), cache_seconds=0
+                )
+                collector.update("envoy", *_create_samples(lines, inverters))
+                return lambda: list(collector.collect())
+
+            yield f"prometheus_snapshot_collect[{scale}]", snapshot_collect
+
+
+def _create_samples(lines: int, inverters: int) -> Tuple[Any, Any]:
+    return (
+        SampleData.create(create_sample_data(lines)),
+        parse_inverter_data(create_inverter_data(inverters)),
+    )
+
+
+def _create_influxdb_sink(inverters: int) -> InfluxdbSink:
+    with mock.patch("envoy_logger.influxdb_sampling_engine.InfluxDBClient"):
+        return InfluxdbSink(create_config("influxdb", inverters), persist_state=False)
+
+
+def _create_prometheus_sink(inverters: int, metrics: str) -> PrometheusSink:
+    with mock.patch("envoy_logger.prometheus_sampling_engine.start_http_server"):
+        return PrometheusSink(create_config("prometheus", inverters, metrics=metrics))
+
+
+def _create_flux_tables(inverters: int) -> TableList:
+    # What the daily integral query returns: one record per line and inverter
+    records = [
+        FluxRecord(
+            {},
+            {"measurement-type": "inverter", "serial": f"{i:012d}", "_value": 123.456},
+        )
+        for i in range(inverters)
+    ]
+    for measurement_type in ("consumption", "production", "net"):
+        records.extend(
+            FluxRecord(
+                {},
+                {
+                    "measurement-type": measurement_type,
+                    "line-idx": i,
+                    "_value": 123.456,
+                },
+            )
+            for i in range(3)
+        )
+
+    table = mock.Mock(FluxTable)
+    table.records = records
+    tables = TableList()
+    tables.append(table)
+    return tables
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> float:
+    """
+    Seconds per call, from the fastest of several timed loops of func.
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / elapsed))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(args: Namespace) -> Dict[str, float]:
+    results = {}
+    for name, setup in benchmarks():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(setup(), repeat=args.repeat, min_time=args.min_time)
+        LOG.debug("%s: %.3f us", name, results[name] * 1e6)
+    return results
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], threshold: float
+) -> List[str]:
+    """
+    Print the results against the baseline, and return the names of the
+    benchmarks that regressed by more than threshold.
+    """
+    regressions = []
+    width = max(len(name) for name in results)
+    print(f"{'benchmark':<{width}}  {'time':>12}  {'baseline':>12}  {'change':>8}")
+    for name, seconds in results.items():
+        line = f"{name:<{width}}  {_format_time(seconds):>12}"
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            line += f"  {_format_time(baseline[name]):>12}  {change:>+8.1%}"
+            if change > threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {name: result["seconds"] for name, result in data["results"].items()}
+
+
+def save_baseline(path: str, results: Dict[str, float]) -> None:
+    # Benchmarks that were not run (see --filter) keep their baseline
+    if os.path.exists(path):
+        results = {**load_baseline(path), **results}
+
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "created": datetime.now(tz=timezone.utc).isoformat(),
+        "results": {name: {"seconds": seconds} for name, seconds in results.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def _format_time(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.2f} us"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> Namespace:
+    parser = ArgumentParser(description="Benchmark the per-cycle path.")
+
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help="Baseline to compare against, or to save to.",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the results as the new baseline.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Slowdown against the baseline that fails the run, e.g. 0.25 for 25%%.",
+    )
+    parser.add_argument(
+        "--filter", help="Only run the benchmarks whose name contains this."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timed loops per benchmark."
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="Minimum duration of each timed loop, in seconds.",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "WARNING").upper(),
+        format="%(asctime)s %(levelname)s [%(name)s]: %(message)s",
+    )
+    args = parse_args(argv)
+
+    results = run(args)
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(
+            f"{len(regressions)} benchmarks are more than {args.threshold:.0%} "
+            "slower than the baseline"
+        )
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from requests import ConnectTimeout, ReadTimeout
+
+from envoy_logger.envoy import Envoy
+from envoy_logger.internal_metrics import SAMPLE_RETRIES
+from envoy_logger.inverter_poller import InverterPoller
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.model import InverterData, SampleData, parse_inverter_data
+from envoy_logger.scheduler import Scheduler
+from envoy_logger.sink import Sink
+
+LOG = logging.getLogger("async_sampling_engine")
+
+
+@dataclass
+class EnvoyPoller:
+    """
+    Per-envoy sampling state.
+    """
+
+    source_tag: str
+    envoy: Envoy
+    scheduler: Scheduler
+    inverter_poller: Optional[InverterPoller] = None
+    inverter_reports: InverterReportIndex = field(default_factory=InverterReportIndex)
+    last_sample_timestamp: Optional[datetime] = None
+
+    def get_inverter_data(self) -> Optional[InverterData]:
+        """
+        Return the unfiltered inverter data, or None when no reports are expected.
+        """
+        if self.inverter_poller is not None and not self.inverter_poller.due():
+            return None
+
+        return self.envoy.get_inverter_data()
+
+    def inverter_data_collected(
+        self, inverter_data: Optional[InverterData]
+    ) -> InverterData:
+        """
+        Record the inverter data of a successful cycle, and return its new reports.
+
+        Nothing is recorded before the whole cycle succeeded, so a retried cycle
+        polls the inverters again and gets the same reports.
+        """
+        if inverter_data is None:
+            return parse_inverter_data([])
+
+        if self.inverter_poller is not None:
+            self.inverter_poller.update(inverter_data)
+        self.envoy.commit_inverter_data()
+        return self.inverter_reports.filter_new(inverter_data)
+
+
+class AsyncSamplingEngine:
+    """
+    Polls any number of envoys on a shared event loop, and publishes every
+    sample to all of the configured sinks.
+
+    The envoy and sink clients are blocking, so their calls are dispatched to a
+    shared, bounded thread pool. Memory use therefore grows with the number of
+    workers rather than with the number of envoys.
+    """
+
+    def __init__(
+        self,
+        envoys: Dict[str, Envoy],
+        sinks: List[Sink],
+        interval_seconds: int = 5,
+        max_workers: Optional[int] = None,
+        overrun_policy: str = "skip",
+        adaptive_inverter_polling: bool = False,
+        inverter_max_interval: float = 300.0,
+        inverter_reports: Optional[Dict[str, InverterReportIndex]] = None,
+    ) -> None:
+        # Each envoy keeps its own schedule, so a slow envoy only delays itself
+        self.pollers = [
+            EnvoyPoller(
+                source_tag=source_tag,
+                envoy=envoy,
+                scheduler=Scheduler(
+                    interval_seconds, overrun_policy=overrun_policy, source=source_tag
+                ),
+                inverter_poller=(
+                    InverterPoller(
+                        min_interval=interval_seconds,
+                        max_interval=inverter_max_interval,
+                    )
+                    if adaptive_inverter_polling
+                    else None
+                ),
+                inverter_reports=(inverter_reports or {}).get(
+                    source_tag, InverterReportIndex()
+                ),
+            )
+            for source_tag, envoy in envoys.items()
+        ]
+        self.sinks = sinks
+        self.interval_seconds = interval_seconds
+
+        # Two requests in flight per envoy is enough to fetch both endpoints at once
+        self.max_workers = max_workers or min(32, 2 * len(self.pollers) + 2)
+
+        self._sink_locks: List[asyncio.Lock] = []
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            print("Exiting with Ctrl-C")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(
+            ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="sampling"
+            )
+        )
+
+        LOG.info("Sampling %d envoys", len(self.pollers))
+        await asyncio.gather(*(self._poll(poller) for poller in self.pollers))
+
+    async def _poll(self, poller: EnvoyPoller) -> None:
+        while True:
+            await self._wait_for_next_cycle(poller)
+
+            try:
+                await self._poll_once(poller)
+            except TimeoutError:
+                # Keep sampling the other envoys. This one gets retried next cycle
+                LOG.error("Sample collection from %s timed out", poller.source_tag)
+            except Exception:
+                # Such as an HTTP error, a malformed payload or a failing sink. One
+                # envoy must not stop the loops of the others
+                LOG.exception("Sampling cycle of %s failed", poller.source_tag)
+
+    async def _wait_for_next_cycle(self, poller: EnvoyPoller) -> None:
+        delay = poller.scheduler.next_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        poller.scheduler.tick_started()
+
+    async def _poll_once(self, poller: EnvoyPoller) -> None:
+        power_data, inverter_data = await self._collect_samples_with_retry(poller)
+
+        # Sinks are not required to be thread-safe, so only one envoy publishes to a sink at a time
+        if not self._sink_locks:
+            self._sink_locks = [asyncio.Lock() for _ in self.sinks]
+
+        for sink, sink_lock in zip(self.sinks, self._sink_locks):
+            async with sink_lock:
+                await asyncio.to_thread(
+                    sink.publish, poller.source_tag, power_data, inverter_data
+                )
+
+    async def _collect_samples_with_retry(
+        self, poller: EnvoyPoller, retries: int = 10, wait_seconds: float = 5.0
+    ) -> Tuple[SampleData, InverterData]:
+        for retry_loop in range(retries):
+            try:
+                # Wait for both requests before raising, so a failed cycle never
+                # leaves a request running into the next retry
+                power_data, inverter_data = await asyncio.gather(
+                    asyncio.to_thread(poller.envoy.get_power_data),
+                    asyncio.to_thread(poller.get_inverter_data),
+                    return_exceptions=True,
+                )
+                for result in (power_data, inverter_data):
+                    if isinstance(result, BaseException):
+                        raise result
+            except (ReadTimeout, ConnectTimeout):
+                LOG.warning(
+                    "Envoy %s request timed out (%d/%d)",
+                    poller.source_tag,
+                    retry_loop + 1,
+                    retries,
+                )
+                SAMPLE_RETRIES.inc()
+                await asyncio.sleep(wait_seconds)
+            else:
+                inverter_data = poller.inverter_data_collected(inverter_data)
+                poller.last_sample_timestamp = datetime.now(tz=timezone.utc)
+                return power_data, inverter_data
+
+        raise TimeoutError("Sample collection timed out.")
@@ -0,0 +1,70 @@
+import logging
+import threading
+from datetime import timedelta
+from typing import List, Optional
+
+from envoy_logger.envoy import Envoy
+
+LOG = logging.getLogger("auth_refresher")
+
+
+class AuthRefresher:
+    """
+    Renews the enphaseenergy.com tokens and envoy sessions on a background
+    thread, before they expire.
+
+    The sampling path only refreshes credentials inline once they are within a
+    day (token) or past the 12h limit (session). Renewing them ahead of those
+    limits means a sampling cycle never has to wait for a login.
+    """
+
+    def __init__(
+        self,
+        envoys: List[Envoy],
+        check_interval: float = 60.0,
+        token_margin: timedelta = timedelta(days=2),
+        session_margin: timedelta = timedelta(hours=1),
+    ) -> None:
+        self.envoys = envoys
+        self.check_interval = check_interval
+        self.token_margin = token_margin
+        self.session_margin = session_margin
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="auth-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            self.refresh_due()
+
+    def refresh_due(self) -> None:
+        for envoy in self.envoys:
+            try:
+                self._refresh_envoy(envoy)
+            except Exception as e:
+                # Try again on the next check. The current credentials are still valid
+                LOG.warning("Unable to refresh credentials for %s: %s", envoy.url, e)
+
+    def _refresh_envoy(self, envoy: Envoy) -> None:
+        # Credentials that were never obtained are left to the first sample
+        if envoy.session_id is None:
+            return
+
+        if envoy.enphase_energy.token_expires_within(self.token_margin):
+            LOG.info("Refreshing enphaseenergy.com token for %s", envoy.url)
+            envoy.enphase_energy.refresh_token()
+
+        if envoy.session_expires_within(self.session_margin):
+            LOG.info("Refreshing envoy session for %s", envoy.url)
+            envoy.refresh_session()
@@ -1,19 +1,52 @@
+import atexit
 import logging
 import os
-from argparse import ArgumentParser, FileType, Namespace
-from typing import List, Optional
+from argparse import ArgumentParser, ArgumentTypeError, FileType, Namespace
+from functools import partial
+from typing import TYPE_CHECKING, List, Optional
+from urllib.parse import quote
 
-from envoy_logger.config import load_config
+from envoy_logger.auth_refresher import AuthRefresher
+from envoy_logger.config import Config, EnvoyConfig, load_config
+from envoy_logger.decoder import get_decoder
 from envoy_logger.enphase_energy import EnphaseEnergy
 from envoy_logger.envoy import Envoy
-from envoy_logger.influxdb_sampling_engine import InfluxdbSamplingEngine
-from envoy_logger.prometheus_sampling_engine import PrometheusSamplingEngine
+from envoy_logger.internal_metrics import start_internal_metrics_server
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.payload_capture import PayloadCapture
+from envoy_logger.recorder import PayloadRecorder, find_recordings, read_recordings
+from envoy_logger.replay import Replayer
+from envoy_logger.sampling_engine import SamplingEngine
+from envoy_logger.sink import QueuedSink, Sink
+from envoy_logger.startup import Startup
+from envoy_logger.token_cache import TokenCache
+
+# The database backends are only imported once selected, since their client
+# libraries take most of the startup time on small hosts
+if TYPE_CHECKING:
+    from envoy_logger.influxdb_writer import InfluxdbBatchWriter
 
 logging.basicConfig(
     level=os.environ.get("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s %(levelname)s [%(name)s]: %(message)s",
 )
 
+LOG = logging.getLogger("cli")
+
+DATABASES = ("influxdb", "prometheus")
+
+
+def _parse_databases(value: str) -> List[str]:
+    databases = [database.strip() for database in value.split(",") if database.strip()]
+    for database in databases:
+        if database not in DATABASES:
+            raise ArgumentTypeError(
+                f"invalid database: {database} (choose from {', '.join(DATABASES)})"
+            )
+    if not databases:
+        raise ArgumentTypeError("no database given")
+    return databases
+
 
 def parse_args(argv: Optional[List[str]] = None) -> Namespace:
     parser = ArgumentParser()
@@ -27,36 +60,311 @@ def parse_args(argv: Optional[List[str]] = None) -> Namespace:
 
     parser.add_argument(
         "--db",
-        type=str,
-        choices=["influxdb", "prometheus"],
+        type=_parse_databases,
         default=os.environ.get("ENVOY_LOGGER_DB", "influxdb"),
-        help="The database backend to use.",
+        help="The database backends to use, comma separated, e.g. influxdb,prometheus.",
+    )
+
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["sync", "async"],
+        default=os.environ.get("ENVOY_LOGGER_ENGINE", "sync"),
+        help="The sampling engine to use. The async engine supports multiple envoys.",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="Write recorded envoy payloads to the database backend, then exit.",
+    )
+
+    replay_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Recording files, or directories of them.",
+    )
+
+    replay_parser.add_argument(
+        "--source",
+        action="append",
+        help="Only replay the payloads of this envoy tag. May be repeated.",
+    )
+
+    replay_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Number of points written to InfluxDB at once.",
     )
 
     return parser.parse_args(argv)
 
 
 def main(argv: Optional[List[str]] = None) -> None:
+    startup = Startup()
     args = parse_args(argv)
 
-    config = load_config(path=args.config.name, database=args.db)
+    with startup.timed("config"):
+        config = load_config(path=args.config.name, database=args.db)
 
-    enphase_energy = EnphaseEnergy(
-        email=config.enphase_email,
-        password=config.enphase_password,
-        envoy_serial=config.envoy_serial,
+    if args.command == "replay":
+        _run_replay(config, args)
+        return
+
+    _serve_internal_metrics(config, args.db)
+
+    # Several backends are fed from one sampling loop, which only the async engine has
+    if args.engine == "async" or len(config.envoys) > 1 or len(args.db) > 1:
+        _run_async_engine(config, args.db, startup)
+        return
+
+    capture = _create_capture(config)
+    recorder = _create_recorder(config)
+    envoy = _create_envoy(config, config.envoys[0], capture, recorder)
+
+    # Log in to enphaseenergy.com and the envoy while the sink starts up, rather
+    # than on the first sample
+    startup.submit("envoy login", envoy.get_session_id)
+
+    # Keep credentials fresh in the background so sampling never waits on a login
+    AuthRefresher(envoys=[envoy]).start()
+
+    with startup.timed(f"{args.db[0]} sink"):
+        sampling_loop = _create_sampling_engine(config, args.db[0], envoy)
+
+    startup.finish()
+    sampling_loop.run()
+
+
+def _create_sampling_engine(
+    config: Config, database: str, envoy: Envoy
+) -> SamplingEngine:
+    match database:
+        case "influxdb":
+            from envoy_logger.influxdb_sampling_engine import InfluxdbSamplingEngine
+
+            engine_class = InfluxdbSamplingEngine
+        case "prometheus":
+            from envoy_logger.prometheus_sampling_engine import (
+                PrometheusSamplingEngine,
+            )
+
+            engine_class = PrometheusSamplingEngine
+        case _:
+            raise NotImplementedError(
+                f"Database backend not yet implemented: {database}"
+            )
+
+    return engine_class(
+        envoy=envoy,
+        config=config,
+        interval_seconds=config.sampling_interval_seconds,
+        overrun_policy=config.sampling_overrun_policy,
+        adaptive_inverter_polling=config.sampling_adaptive_inverter_polling,
+        inverter_max_interval=config.sampling_inverter_max_interval,
+        inverter_reports=_create_inverter_reports(config, config.source_tag),
     )
 
-    envoy = Envoy(url=config.envoy_url, enphase_energy=enphase_energy)
 
-    match args.db:
+def _run_async_engine(config: Config, databases: List[str], startup: Startup) -> None:
+    from envoy_logger.async_sampling_engine import AsyncSamplingEngine
+
+    capture = _create_capture(config)
+    recorder = _create_recorder(config)
+    envoys = {
+        envoy_config.tag: _create_envoy(config, envoy_config, capture, recorder)
+        for envoy_config in config.envoys
+    }
+
+    # The envoys log in, and the sinks start up, all at once
+    for tag, envoy in envoys.items():
+        startup.submit(f"{tag} login", envoy.get_session_id)
+
+    AuthRefresher(envoys=list(envoys.values())).start()
+
+    sink_futures = [
+        startup.submit(f"{database} sink", _create_sink, config, database)
+        for database in databases
+    ]
+    sinks = [future.result() for future in sink_futures]
+    if len(sinks) > 1:
+        # A slow sink must not hold up sampling, or the other sinks
+        sinks = [
+            _create_queued_sink(config, sink, database)
+            for sink, database in zip(sinks, databases)
+        ]
+
+    sampling_loop = AsyncSamplingEngine(
+        envoys=envoys,
+        sinks=sinks,
+        interval_seconds=config.sampling_interval_seconds,
+        overrun_policy=config.sampling_overrun_policy,
+        adaptive_inverter_polling=config.sampling_adaptive_inverter_polling,
+        inverter_max_interval=config.sampling_inverter_max_interval,
+        inverter_reports={
+            tag: _create_inverter_reports(config, tag) for tag in envoys.keys()
+        },
+    )
+
+    startup.finish()
+    sampling_loop.run()
+
+
+def _run_replay(config: Config, args: Namespace) -> None:
+    files = find_recordings(args.paths)
+    LOG.info("Replaying %d recordings into %s", len(files), ", ".join(args.db))
+
+    writer: Optional[InfluxdbBatchWriter] = None
+    sinks: List[Sink] = []
+    for database in args.db:
+        match database:
+            case "influxdb":
+                from envoy_logger.influxdb_sampling_engine import InfluxdbSink
+                from envoy_logger.influxdb_writer import InfluxdbBatchWriter
+
+                # Write in large batches, and wait for the database rather than dropping points
+                sink = InfluxdbSink(
+                    config=config,
+                    persist_state=False,
+                    writer_factory=partial(
+                        InfluxdbBatchWriter,
+                        batch_size=args.batch_size,
+                        backpressure="block",
+                    ),
+                )
+                writer = sink.influxdb_writer
+                sinks.append(sink)
+            case "prometheus":
+                from envoy_logger.prometheus_sampling_engine import PrometheusSink
+
+                sinks.append(PrometheusSink(config=config))
+            case _:
+                raise NotImplementedError(
+                    f"Database backend not yet implemented: {database}"
+                )
+
+    replayer = Replayer(
+        sinks=sinks,
+        decoder=get_decoder(config.envoys[0].decoder),
+        sources=args.source,
+    )
+    stats = replayer.replay(read_recordings(files))
+
+    if writer is not None:
+        writer.close()
+        if writer.stats().points_dropped:
+            LOG.error("%d points could not be written", writer.stats().points_dropped)
+
+    LOG.info(
+        "Replayed %d payloads as %d samples in %.1fs (%d skipped)",
+        stats.payloads,
+        stats.samples,
+        stats.seconds,
+        stats.skipped,
+    )
+
+
+def _create_sink(config: Config, database: str) -> Sink:
+    match database:
         case "influxdb":
-            sampling_loop = InfluxdbSamplingEngine(envoy=envoy, config=config)
-            sampling_loop.run()
+            from envoy_logger.influxdb_sampling_engine import InfluxdbSink
+
+            return InfluxdbSink(config=config)
         case "prometheus":
-            sampling_loop = PrometheusSamplingEngine(envoy=envoy, config=config)
-            sampling_loop.run()
+            from envoy_logger.prometheus_sampling_engine import PrometheusSink
+
+            return PrometheusSink(config=config)
         case _:
             raise NotImplementedError(
-                f"Database backend not yet implemented: {args.db}"
+                f"Database backend not yet implemented: {database}"
             )
+
+
+def _create_queued_sink(config: Config, sink: Sink, name: str) -> QueuedSink:
+    queued_sink = QueuedSink(
+        sink,
+        name=name,
+        max_queue_depth=config.sink_queue_depth,
+        backpressure=config.sink_backpressure,
+    )
+    atexit.register(queued_sink.close, timeout=10)
+    return queued_sink
+
+
+def _serve_internal_metrics(config: Config, databases: List[str]) -> None:
+    # The Prometheus sink already serves the internal metrics along with the samples
+    if "prometheus" not in databases and config.internal_metrics_listening_port:
+        start_internal_metrics_server(config.internal_metrics_listening_port)
+
+
+def _create_inverter_reports(config: Config, source_tag: str) -> InverterReportIndex:
+    inverter_reports = InverterReportIndex(
+        os.path.join(
+            config.state_dir, "inverter_reports", f"{quote(source_tag, safe='')}.json"
+        )
+    )
+    atexit.register(inverter_reports.save)
+    return inverter_reports
+
+
+def _create_capture(config: Config) -> Optional[PayloadCapture]:
+    if config.debug_capture is None:
+        return None
+
+    return PayloadCapture(
+        path=config.debug_capture.path,
+        every=config.debug_capture.every,
+        max_bytes=config.debug_capture.max_bytes,
+        backup_count=config.debug_capture.backup_count,
+    )
+
+
+def _create_recorder(config: Config) -> Optional[PayloadRecorder]:
+    if config.record is None:
+        return None
+
+    recorder = PayloadRecorder(
+        path=config.record.path,
+        partition=config.record.partition,
+        compress_level=config.record.compress_level,
+    )
+    atexit.register(recorder.close)
+    return recorder
+
+
+def _create_envoy(
+    config: Config,
+    envoy_config: EnvoyConfig,
+    capture: Optional[PayloadCapture] = None,
+    recorder: Optional[PayloadRecorder] = None,
+) -> Envoy:
+    cache: Optional[TokenCache] = None
+    if config.cache_tokens:
+        cache = TokenCache(
+            os.path.join(config.state_dir, "auth", f"{envoy_config.serial}.json")
+        )
+
+    # Each envoy gets its own access token, since tokens are issued per envoy serial
+    enphase_energy = EnphaseEnergy(
+        email=envoy_config.enphase_email,
+        password=envoy_config.enphase_password,
+        envoy_serial=envoy_config.serial,
+        cache=cache,
+        enlighten_url=config.enphase_enlighten_url,
+        entrez_url=config.enphase_entrez_url,
+    )
+
+    return Envoy(
+        url=envoy_config.url,
+        enphase_energy=enphase_energy,
+        verify=envoy_config.verify_ssl,
+        pool_size=envoy_config.pool_size,
+        timeouts=envoy_config.timeouts,
+        cache=cache,
+        capture=capture,
+        decoder=get_decoder(envoy_config.decoder),
+        recorder=recorder,
+        tag=envoy_config.tag,
+    )
@@ -1,36 +1,118 @@
 import logging
+import os
 import sys
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
+import appdirs
 import yaml
-from influxdb_client import Point
+
+from envoy_logger.decoder import DECODERS
+from envoy_logger.recorder import PARTITIONS
+from envoy_logger.rollup import parse_duration
+from envoy_logger.scheduler import OVERRUN_POLICIES
+
+# Only needed by the InfluxDB backend, so not imported when running another one
+if TYPE_CHECKING:
+    from influxdb_client import Point
 
 LOG = logging.getLogger("config")
 
 
 class Config:
-    def __init__(self, data: Dict[str, Any], database: str) -> None:
+    def __init__(self, data: Dict[str, Any], database: str | List[str]) -> None:
+        # Samples may be published to several database backends at once
+        self.databases: List[str] = (
+            [database] if isinstance(database, str) else list(database)
+        )
+
         try:
             self.enphase_email: str = data["enphaseenergy"]["email"]
             self.enphase_password: str = data["enphaseenergy"]["password"]
 
-            self.envoy_serial = str(data["envoy"]["serial"])
-            self.envoy_url: str = data["envoy"].get("url", "https://envoy.local")
-            self.source_tag: str = data["envoy"].get("tag", "envoy")
-
-            match database:
-                case "influxdb":
-                    self.influxdb_url: str = data["influxdb"]["url"]
-                    self.influxdb_token: str = data["influxdb"]["token"]
-                    self.influxdb_org: str = data["influxdb"].get("org", "home")
-                case "prometheus":
-                    self.prometheus_listening_port: int = data["prometheus"][
-                        "listening_port"
-                    ]
-                case _:
-                    raise NotImplementedError(
-                        f"Database backend not yet implemented: {database}"
-                    )
+            # Keep the access token and envoy session in state_dir, to skip logging in after a restart
+            self.cache_tokens: bool = data["enphaseenergy"].get("cache_tokens", True)
+
+            # Only changed to log in against a stand-in, such as the envoy simulator
+            self.enphase_enlighten_url: str = data["enphaseenergy"].get(
+                "enlighten_url", "https://enlighten.enphaseenergy.com"
+            )
+            self.enphase_entrez_url: str = data["enphaseenergy"].get(
+                "entrez_url", "https://entrez.enphaseenergy.com"
+            )
+
+            # Either a single "envoy" section, or a list of them under "envoys"
+            envoys_data = data.get("envoys") or [data["envoy"]]
+            self.envoys: List[EnvoyConfig] = [
+                EnvoyConfig(envoy_data, self.enphase_email, self.enphase_password)
+                for envoy_data in envoys_data
+            ]
+
+            tags = [envoy.tag for envoy in self.envoys]
+            if len(set(tags)) != len(tags):
+                LOG.error("Each envoy must have a unique tag: %s", tags)
+                sys.exit(1)
+
+            # The first envoy is the one used by the single-envoy sampling engines
+            primary_envoy = self.envoys[0]
+            self.envoy_serial = primary_envoy.serial
+            self.envoy_url = primary_envoy.url
+            self.source_tag = primary_envoy.tag
+
+            # Where state that must survive a restart is kept
+            self.state_dir: str = data.get(
+                "state_dir", appdirs.user_data_dir("envoy-logger")
+            )
+
+            sampling = data.get("sampling", {})
+            self.sampling_concurrent: bool = sampling.get("concurrent", False)
+            self.sampling_interval_seconds: int = sampling.get("interval_seconds", 5)
+
+            # Only poll the inverters when they are expected to have reported
+            self.sampling_adaptive_inverter_polling: bool = sampling.get(
+                "adaptive_inverter_polling", False
+            )
+            self.sampling_inverter_max_interval: float = sampling.get(
+                "inverter_max_interval_seconds", 300
+            )
+
+            # What to do with the cycles that are missed when a cycle overruns the interval
+            self.sampling_overrun_policy: str = sampling.get("overrun_policy", "skip")
+            if self.sampling_overrun_policy not in OVERRUN_POLICIES:
+                LOG.error(
+                    "Unknown sampling overrun_policy: %s (expected one of %s)",
+                    self.sampling_overrun_policy,
+                    ", ".join(OVERRUN_POLICIES),
+                )
+                sys.exit(1)
+
+            # Raw payloads are only captured when configured
+            self.debug_capture: Optional[DebugCaptureConfig] = None
+            if "capture" in data.get("debug", {}):
+                self.debug_capture = DebugCaptureConfig(
+                    data["debug"]["capture"] or {}, self.state_dir
+                )
+
+            # Metrics about envoy-logger itself
+            internal_metrics = data.get("internal_metrics") or {}
+            self.internal_metrics_listening_port: Optional[int] = internal_metrics.get(
+                "listening_port", None
+            )
+            self.internal_metrics_influxdb_interval: Optional[float] = (
+                internal_metrics.get("influxdb_interval_seconds", None)
+            )
+
+            # Raw payloads are only recorded for replay when configured
+            self.record: Optional[RecordConfig] = None
+            if "record" in data:
+                self.record = RecordConfig(data["record"] or {}, self.state_dir)
+
+            # With several backends, every sink publishes from a queue of its own
+            sinks = data.get("sinks") or {}
+            self.sink_queue_depth: int = sinks.get("queue_depth", 60)
+            self.sink_backpressure: str = sinks.get("backpressure", "drop_oldest")
+
+            for database in self.databases:
+                self._load_database(data, database)
 
             bucket: Optional[str] = data["influxdb"].get("bucket", None)
             bucket_lr: Optional[str] = data["influxdb"].get("bucket_lr", None)
@@ -47,23 +129,194 @@ class Config:
             LOG.error("Missing required config key: %s", e.args[0])
             sys.exit(1)
 
-    def apply_tags_to_inverter_point(self, p: Point, serial: str) -> None:
+    def _load_database(self, data: Dict[str, Any], database: str) -> None:
+        match database:
+            case "influxdb":
+                self.influxdb_url: str = data["influxdb"]["url"]
+                self.influxdb_token: str = data["influxdb"]["token"]
+                self.influxdb_org: str = data["influxdb"].get("org", "home")
+
+                # Points are written synchronously unless batching is configured
+                self.influxdb_batching: Optional[InfluxdbBatchingConfig] = None
+                if "batching" in data["influxdb"]:
+                    self.influxdb_batching = InfluxdbBatchingConfig(
+                        data["influxdb"]["batching"] or {}
+                    )
+
+                # How the daily energy summaries are computed:
+                #   incremental: integrated in-process as samples are collected
+                #   flux: integrated by a Flux query over the high-rate bucket
+                self.influxdb_daily_energy: str = data["influxdb"].get(
+                    "daily_energy", "incremental"
+                )
+
+                # Downsampled copies of the high rate data, each in its own bucket
+                self.influxdb_rollups: List[RollupConfig] = [
+                    RollupConfig(rollup_data)
+                    for rollup_data in data["influxdb"].get("rollups", [])
+                ]
+
+                # Points that fail to write are lost unless spooling is configured
+                self.influxdb_spool: Optional[InfluxdbSpoolConfig] = None
+                if "spool" in data["influxdb"]:
+                    self.influxdb_spool = InfluxdbSpoolConfig(
+                        data["influxdb"]["spool"] or {}, self.state_dir
+                    )
+            case "prometheus":
+                self.prometheus_listening_port: int = data["prometheus"][
+                    "listening_port"
+                ]
+
+                # How the samples are exposed:
+                #   legacy: a metric per line, measurement and inverter
+                #   labeled: a metric per measurement, with the line or inverter as labels
+                #   snapshot: the labeled metrics, rendered from the latest samples when scraped
+                self.prometheus_metrics: str = data["prometheus"].get(
+                    "metrics", "legacy"
+                )
+                if self.prometheus_metrics not in ("legacy", "labeled", "snapshot"):
+                    LOG.error(
+                        "Unknown prometheus metrics: %s (expected legacy, labeled or snapshot)",
+                        self.prometheus_metrics,
+                    )
+                    sys.exit(1)
+
+                # How long a rendered snapshot is served to scrapers
+                self.prometheus_render_cache_seconds: float = data["prometheus"].get(
+                    "render_cache_seconds", 1.0
+                )
+
+                # In snapshot mode, whether samples carry the time the envoy made them
+                self.prometheus_sample_timestamps: bool = data["prometheus"].get(
+                    "sample_timestamps", False
+                )
+
+                # In snapshot mode, drop inverters that have not reported for this long
+                self.prometheus_inverter_stale_seconds: Optional[float] = data[
+                    "prometheus"
+                ].get("inverter_stale_seconds", None)
+            case _:
+                raise NotImplementedError(
+                    f"Database backend not yet implemented: {database}"
+                )
+
+    def inverter_tag_names(self) -> List[str]:
+        """
+        Names of all of the tags given to inverters, in a stable order.
+        """
+        names = set()
+        for inverter in self.inverters.values():
+            names.update(inverter.tags.keys())
+        return sorted(names)
+
+    def inverter_tags(self, serial: str) -> Dict[str, Any]:
+        inverter = self.inverters.get(serial)
+        if inverter is None:
+            return {}
+        return inverter.tags
+
+    def apply_tags_to_inverter_point(self, p: "Point", serial: str) -> None:
         if serial in self.inverters.keys():
             self.inverters[serial].apply_tags_to_point(p)
 
 
+class EnvoyConfig:
+    def __init__(self, data, enphase_email: str, enphase_password: str) -> None:
+        self.serial = str(data["serial"])
+        self.url: str = data.get("url", "https://envoy.local")
+        self.tag: str = data.get("tag", "envoy")
+        self.verify_ssl: bool = data.get("verify_ssl", False)
+        self.pool_size: int = data.get("pool_size", 2)
+        self.timeouts: Dict[str, float] = data.get("timeouts", {})
+
+        # How the envoy responses are decoded: auto, msgspec, orjson or json
+        self.decoder: str = data.get("decoder", "auto")
+        if self.decoder not in DECODERS:
+            LOG.error(
+                "Unknown envoy decoder: %s (expected one of %s)",
+                self.decoder,
+                ", ".join(DECODERS),
+            )
+            sys.exit(1)
+
+        # Envoys registered to a different enphaseenergy.com account may override the login
+        self.enphase_email: str = data.get("email", enphase_email)
+        self.enphase_password: str = data.get("password", enphase_password)
+
+
+class InfluxdbBatchingConfig:
+    def __init__(self, data) -> None:
+        self.batch_size: int = data.get("batch_size", 500)
+        self.flush_interval: float = data.get("flush_interval", 1.0)
+        self.max_queue_depth: int = data.get("max_queue_depth", 10000)
+        self.backpressure: str = data.get("backpressure", "drop_oldest")
+        self.max_retries: int = data.get("max_retries", 5)
+        self.retry_interval: float = data.get("retry_interval", 1.0)
+        self.max_retry_interval: float = data.get("max_retry_interval", 30.0)
+
+
+class InfluxdbSpoolConfig:
+    def __init__(self, data, state_dir: str) -> None:
+        self.path: str = data.get("path", os.path.join(state_dir, "spool"))
+        self.segment_max_bytes: int = int(data.get("segment_size_mb", 4) * 1024 * 1024)
+        self.max_bytes: int = int(data.get("max_size_mb", 512) * 1024 * 1024)
+        self.fsync_interval: float = data.get("fsync_interval", 1.0)
+
+
+class DebugCaptureConfig:
+    def __init__(self, data, state_dir: str) -> None:
+        self.path: str = data.get(
+            "path", os.path.join(state_dir, "capture", "payloads.jsonl")
+        )
+        self.every: int = data.get("every", 100)
+        self.max_bytes: int = int(data.get("max_size_mb", 10) * 1024 * 1024)
+        self.backup_count: int = data.get("backup_count", 5)
+
+
+class RecordConfig:
+    def __init__(self, data, state_dir: str) -> None:
+        self.path: str = data.get("path", os.path.join(state_dir, "recordings"))
+        self.partition: str = data.get("partition", "hour")
+        if self.partition not in PARTITIONS:
+            LOG.error(
+                "Unknown record partition: %s (expected one of %s)",
+                self.partition,
+                ", ".join(PARTITIONS),
+            )
+            sys.exit(1)
+        self.compress_level: int = data.get("compress_level", 6)
+
+
+class RollupConfig:
+    def __init__(self, data) -> None:
+        self.bucket: str = data["bucket"]
+
+        try:
+            self.resolution_seconds: int = parse_duration(data["interval"])
+        except ValueError:
+            self.resolution_seconds = 0
+        if self.resolution_seconds <= 0:
+            LOG.error(
+                "Invalid rollup interval for bucket %s: %s (expected e.g. 1m or 1h)",
+                self.bucket,
+                data["interval"],
+            )
+            sys.exit(1)
+
+
 class InverterConfig:
     def __init__(self, data, serial) -> None:
         self.serial = serial
         self.tags = data.get("tags", {})
 
-    def apply_tags_to_point(self, p: Point) -> None:
+    def apply_tags_to_point(self, p: "Point") -> None:
         for k, v in self.tags.items():
             p.tag(k, v)
 
 
-def load_config(path: str, database: str):
-    LOG.info("Loading config %s for %s database", path, database)
+def load_config(path: str, database: str | List[str]):
+    databases = [database] if isinstance(database, str) else database
+    LOG.info("Loading config %s for %s database", path, ", ".join(databases))
 
     with open(path, "r", encoding="utf-8") as f:
         data = yaml.load(f.read(), Loader=yaml.FullLoader)
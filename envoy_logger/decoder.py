@@ -0,0 +1,230 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Type
+
+from envoy_logger.model import (
+    NAN,
+    POWER_FIELDS,
+    ChangedSlots,
+    EIMSample,
+    InverterData,
+    PowerSample,
+    SampleData,
+    SerialIndex,
+    parse_inverter_data,
+)
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOG = logging.getLogger("decoder")
+
+
+class Decoder(ABC):
+    """
+    Turns the bodies of envoy responses into model objects.
+    """
+
+    name: str
+
+    @abstractmethod
+    def decode(self, content: bytes) -> Any:
+        """
+        Decode a JSON document into plain Python objects.
+        """
+
+    @abstractmethod
+    def decode_power_data(self, content: bytes) -> SampleData:
+        """
+        Decode the body of /production.json.
+        """
+
+    @abstractmethod
+    def decode_inverter_data(
+        self,
+        content: bytes,
+        index: Optional[SerialIndex] = None,
+        previous: Optional[InverterData] = None,
+    ) -> InverterData:
+        """
+        Decode the body of /api/v1/production/inverters.
+
+        When the data of the previous cycle is given, the slots whose reports
+        changed since are noted on the result.
+        """
+
+
+class JsonDecoder(Decoder):
+    """
+    Decodes the whole document into dicts and lists, and builds the model
+    from them. Uses orjson when it is installed, otherwise the json module.
+    """
+
+    def __init__(self, use_orjson: bool = True) -> None:
+        if use_orjson and orjson is not None:
+            self.name = "orjson"
+            self._loads = orjson.loads
+        else:
+            self.name = "json"
+            self._loads = json.loads
+
+    def decode(self, content: bytes) -> Any:
+        return self._loads(content)
+
+    def decode_power_data(self, content: bytes) -> SampleData:
+        return SampleData.create(sample_data=self._loads(content))
+
+    def decode_inverter_data(
+        self,
+        content: bytes,
+        index: Optional[SerialIndex] = None,
+        previous: Optional[InverterData] = None,
+    ) -> InverterData:
+        return parse_inverter_data(self._loads(content), index, previous)
+
+
+class MsgspecDecoder(Decoder):
+    """
+    Decodes straight into typed structs that only declare the fields we use.
+
+    Everything else in the documents, such as the EIM totals that EIMSample
+    discards, or the device type and max power of each inverter, is skipped
+    by the parser instead of being turned into Python objects.
+    """
+
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        if msgspec is None:
+            raise ImportError("msgspec is not installed")
+
+        self._decoder = msgspec.json.Decoder()
+        self._production_decoder = msgspec.json.Decoder(_production_type())
+        self._inverters_decoder = msgspec.json.Decoder(List[_inverter_type()])
+
+    def decode(self, content: bytes) -> Any:
+        return self._decoder.decode(content)
+
+    def decode_power_data(self, content: bytes) -> SampleData:
+        production = self._production_decoder.decode(content)
+
+        eim_samples: Dict[str, EIMSample] = {}
+        for reading in production.consumption:
+            if reading.type == "eim" and reading.measurementType in (
+                "net-consumption",
+                "total-consumption",
+            ):
+                eim_samples[reading.measurementType] = _eim_sample(reading)
+        for reading in production.production:
+            if reading.type == "eim" and reading.measurementType == "production":
+                eim_samples["production"] = _eim_sample(reading)
+
+        return SampleData(
+            net_consumption=eim_samples.get("net-consumption", EIMSample([])),
+            total_consumption=eim_samples.get("total-consumption", EIMSample([])),
+            total_production=eim_samples.get("production", EIMSample([])),
+        )
+
+    def decode_inverter_data(
+        self,
+        content: bytes,
+        index: Optional[SerialIndex] = None,
+        previous: Optional[InverterData] = None,
+    ) -> InverterData:
+        if index is None:
+            index = SerialIndex()
+
+        inverters = self._inverters_decoder.decode(content)
+        slots = [index.slot(inverter.serialNumber) for inverter in inverters]
+
+        ts = array("d", [NAN]) * len(index)
+        watts = array("d", bytes(ts.itemsize * len(index)))
+        changed = ChangedSlots(previous)
+        for slot, inverter in zip(slots, inverters):
+            ts[slot] = inverter.lastReportDate
+            watts[slot] = inverter.lastReportWatts
+            changed.check(slot, ts[slot])
+
+        return InverterData(index, ts, watts, changed=changed.slots)
+
+
+def _eim_sample(reading) -> EIMSample:
+    ts = datetime.fromtimestamp(reading.readingTime, tz=timezone.utc)
+    return EIMSample(
+        eim_line_samples=[
+            PowerSample(ts=ts, values=array("d", msgspec.structs.astuple(line)))
+            for line in reading.lines
+        ]
+    )
+
+
+def _production_type() -> Type:
+    # The line fields are declared in POWER_FIELDS order, so a decoded line is
+    # already laid out like PowerSample.values
+    line = msgspec.defstruct("Line", [(name, float) for name in POWER_FIELDS])
+    reading = msgspec.defstruct(
+        "Reading",
+        [
+            ("type", str),
+            # Required, like the json decoder, so a reading without it is rejected
+            ("readingTime", float),
+            ("measurementType", str, ""),
+            ("lines", List[line], []),
+        ],
+    )
+    return msgspec.defstruct(
+        "Production",
+        [
+            ("production", List[reading], []),
+            ("consumption", List[reading], []),
+        ],
+    )
+
+
+def _inverter_type() -> Type:
+    return msgspec.defstruct(
+        "Inverter",
+        [
+            ("serialNumber", str),
+            ("lastReportDate", float),
+            ("lastReportWatts", float),
+        ],
+    )
+
+
+DECODERS = ("auto", "msgspec", "orjson", "json")
+
+
+def get_decoder(name: str = "auto") -> Decoder:
+    """
+    Return the named decoder. "auto" picks the fastest one that is installed.
+    """
+    match name:
+        case "auto":
+            if msgspec is not None:
+                decoder = MsgspecDecoder()
+            else:
+                decoder = JsonDecoder()
+        case "msgspec":
+            decoder = MsgspecDecoder()
+        case "orjson":
+            if orjson is None:
+                raise ImportError("orjson is not installed")
+            decoder = JsonDecoder()
+        case "json":
+            decoder = JsonDecoder(use_orjson=False)
+        case _:
+            raise ValueError(f"Unknown decoder: {name}")
+
+    LOG.debug("Decoding envoy responses with %s", decoder.name)
+    return decoder
@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+LOG = logging.getLogger("energy")
+
+# Samples further apart than this are not interpolated between, since nothing
+# is known about the power in between, e.g. during an outage. Inverters report
+# every 5 minutes, so this allows for a couple of missed reports
+MAX_GAP_SECONDS = 900.0
+
+
+@dataclass
+class EnergyAccumulator:
+    """
+    Integrates power samples into energy using the trapezoidal rule.
+    """
+
+    Wh: float = 0.0
+    last_ts: Optional[float] = None
+    last_watts: Optional[float] = None
+    max_gap: float = MAX_GAP_SECONDS
+
+    def add(self, ts: float, watts: float) -> None:
+        if self.last_ts is not None:
+            if ts <= self.last_ts:
+                # Already integrated (inverters repeat their last report)
+                return
+            if ts - self.last_ts <= self.max_gap:
+                hours = (ts - self.last_ts) / 3600
+                self.Wh += (watts + self.last_watts) / 2 * hours
+
+        self.last_ts = ts
+        self.last_watts = watts
+
+    def carry_over(self) -> "EnergyAccumulator":
+        """
+        Start a new accumulator from the last sample, so the interval spanning
+        the day boundary is not lost.
+        """
+        return EnergyAccumulator(
+            last_ts=self.last_ts, last_watts=self.last_watts, max_gap=self.max_gap
+        )
+
+
+class DailyEnergyIntegrator:
+    """
+    Keeps a running Wh total per series for the current (local) day.
+
+    Series are identified by a (measurement_type, id) key, where id is the line
+    index for EIM lines and the serial number for inverters.
+
+    The state is periodically saved to a JSON file so a restart does not lose
+    the day's totals. A day is only considered complete if the accumulators were
+    already running when it started, and no samples were missing for more than
+    max_gap seconds during the day. Otherwise the totals cover part of the day.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        save_interval: float = 60.0,
+        max_gap: float = MAX_GAP_SECONDS,
+    ) -> None:
+        self.path = path
+        self.save_interval = save_interval
+        self.max_gap = max_gap
+
+        self.day: Optional[date] = None
+        self.complete = False
+        self.accumulators: Dict[Tuple[str, str], EnergyAccumulator] = {}
+        # Latest sample of any series
+        self.last_ts: Optional[float] = None
+        self._last_save = 0.0
+
+        if path is not None:
+            self._load()
+
+    def add(
+        self, measurement_type: str, series_id: str, ts: float, watts: float
+    ) -> None:
+        """
+        Integrate one sample, timestamped in epoch seconds.
+        """
+        if self.last_ts is not None and ts - self.last_ts > self.max_gap:
+            # No series had any samples in between, so some energy went unseen
+            if self.complete:
+                LOG.warning(
+                    "No samples for %.0fs. Energy totals for %s are incomplete",
+                    ts - self.last_ts,
+                    self.day,
+                )
+            self.complete = False
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+
+        key = (measurement_type, str(series_id))
+        accumulator = self.accumulators.get(key)
+        if accumulator is None:
+            accumulator = self.accumulators[key] = EnergyAccumulator(
+                max_gap=self.max_gap
+            )
+        accumulator.add(ts, watts)
+
+    def roll_over(self, new_day: date) -> Optional[Dict[Tuple[str, str], float]]:
+        """
+        Start a new day and return the Wh totals of the day that just ended, or
+        None if that day was not fully observed.
+        """
+        totals = None
+        if self.complete and self._observed_until_end_of_day():
+            totals = {key: acc.Wh for key, acc in self.accumulators.items()}
+
+        # Only a day that followed straight on from the previous one was fully observed
+        self.complete = self.day is not None and (new_day - self.day).days == 1
+        self.day = new_day
+        self.accumulators = {
+            key: acc.carry_over() for key, acc in self.accumulators.items()
+        }
+
+        self.save()
+        return totals
+
+    def _observed_until_end_of_day(self) -> bool:
+        # The samples may have stopped before midnight, and only resumed on a later day
+        if self.day is None or self.last_ts is None:
+            return False
+        end_of_day = datetime.combine(self.day + timedelta(days=1), datetime.min.time())
+        return end_of_day.timestamp() - self.last_ts <= self.max_gap
+
+    def maybe_save(self) -> None:
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        self._last_save = time.monotonic()
+        if self.path is None:
+            return
+
+        state = {
+            "day": self.day.isoformat() if self.day else None,
+            "complete": self.complete,
+            "series": {
+                f"{measurement_type}:{series_id}": [acc.Wh, acc.last_ts, acc.last_watts]
+                for (measurement_type, series_id), acc in self.accumulators.items()
+            },
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+
+            # Write to a temporary file first so a crash never leaves a truncated state file
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # At worst, the totals of the day are incomplete after a restart
+            LOG.warning("Unable to write energy state %s: %s", self.path, e)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOG.warning("Ignoring unreadable energy state %s: %s", self.path, e)
+            return
+
+        try:
+            day = date.fromisoformat(state["day"]) if state["day"] else None
+            accumulators = {}
+            for key, (Wh, last_ts, last_watts) in state["series"].items():
+                measurement_type, series_id = key.split(":", 1)
+                accumulators[(measurement_type, series_id)] = EnergyAccumulator(
+                    Wh=Wh, last_ts=last_ts, last_watts=last_watts, max_gap=self.max_gap
+                )
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            LOG.warning("Ignoring malformed energy state %s: %s", self.path, e)
+            return
+
+        self.day = day
+        self.complete = state.get("complete", False)
+        self.accumulators = accumulators
+        for accumulator in accumulators.values():
+            last_ts = accumulator.last_ts
+            if last_ts is not None and (self.last_ts is None or last_ts > self.last_ts):
+                self.last_ts = last_ts
+
+        LOG.info("Loaded energy totals for %s from %s", self.day, self.path)
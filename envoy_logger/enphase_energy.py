@@ -1,12 +1,16 @@
 import base64
 import json
 import logging
+import threading
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 import requests
 
+from envoy_logger.internal_metrics import AUTH_REFRESHES
+from envoy_logger.token_cache import TokenCache
+
 LOG = logging.getLogger("enphaseenergy")
 
 
@@ -16,17 +20,66 @@ class EnphaseEnergy:
     password: str
     envoy_serial: str
     token: Optional[str] = None
+    cache: Optional[TokenCache] = None
+
+    # Only changed to log in against a stand-in, such as the envoy simulator
+    enlighten_url: str = "https://enlighten.enphaseenergy.com"
+    entrez_url: str = "https://entrez.enphaseenergy.com"
+
+    def __post_init__(self) -> None:
+        self._token_lock = threading.Lock()
+
+        if self.token is None and self.cache is not None:
+            self.token = self._load_cached_token()
 
     def get_token(self) -> str:
+        with self._token_lock:
+            if self.token is None:
+                self._set_token(self._get_new_token())
+
+            if self.token_expires_within(timedelta(days=1)):
+                LOG.info("Token will expire soon. Getting a new one")
+                self._set_token(self._get_new_token())
+
+            return self.token
+
+    def token_expires_within(self, margin: timedelta) -> bool:
         if self.token is None:
-            self.token = self._get_new_token()
+            return False
+        return self._token_expiration_date() - datetime.now() < margin
 
-        exp = self._token_expiration_date()
-        time_left = exp - datetime.now()
-        if time_left < timedelta(days=1):
-            LOG.info("Token will expire soon. Getting a new one")
-            self.token = self._get_new_token()
+    def refresh_token(self) -> None:
+        """
+        Download a new token, and swap it in once it has been received. Callers of
+        get_token() keep using the current token in the meantime.
+        """
+        token = self._get_new_token()
+        with self._token_lock:
+            self._set_token(token)
+
+    def _set_token(self, token: str) -> None:
+        self.token = token
+        if self.cache is not None:
+            self.cache.set_token(token)
+
+    def _load_cached_token(self) -> Optional[str]:
+        self.token = self.cache.get_token()
+        if self.token is None:
+            return None
 
+        try:
+            exp = self._token_expiration_date()
+        except (ValueError, KeyError) as e:
+            LOG.warning("Ignoring invalid cached token: %s", e)
+            return None
+
+        if exp - datetime.now() < timedelta(days=1):
+            LOG.info("Cached token expires soon. Ignoring it")
+            return None
+
+        LOG.info(
+            "Using cached token for envoy S/N: %s (expires %s)", self.envoy_serial, exp
+        )
         return self.token
 
     def _get_new_token(self) -> str:
@@ -44,12 +97,13 @@ class EnphaseEnergy:
         }
 
         response = requests.post(
-            "https://entrez.enphaseenergy.com/tokens",
+            f"{self.entrez_url}/tokens",
             json=json_data,
             timeout=30,
         )
 
         response.raise_for_status()
+        AUTH_REFRESHES.labels(kind="token").inc()
         return response.text
 
     def _login_enphaseenergy(self) -> str:
@@ -59,7 +113,7 @@ class EnphaseEnergy:
             "user[email]": (None, self.email),
             "user[password]": (None, self.password),
         }
-        url = "https://enlighten.enphaseenergy.com/login/login.json?"
+        url = f"{self.enlighten_url}/login/login.json?"
 
         response = requests.post(
             url,
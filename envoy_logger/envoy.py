@@ -1,19 +1,43 @@
+import hashlib
 import logging
-from dataclasses import dataclass
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, Iterator, Optional
 
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 
+from envoy_logger.decoder import Decoder, get_decoder
 from envoy_logger.enphase_energy import EnphaseEnergy
-from envoy_logger.model import InverterSample, SampleData, parse_inverter_data
+from envoy_logger.internal_metrics import (
+    AUTH_REFRESHES,
+    DECODE_SECONDS,
+    ENVOY_REQUEST_SECONDS,
+    ENVOY_TIMEOUTS,
+    timed,
+)
+from envoy_logger.model import (
+    InverterData,
+    SampleData,
+    SerialIndex,
+    parse_inverter_data,
+)
+from envoy_logger.payload_capture import PayloadCapture
+from envoy_logger.recorder import PayloadRecorder
+from envoy_logger.token_cache import TokenCache
 
 # Local envoy access uses self-signed certificate. Ignore the warning
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 LOG = logging.getLogger("envoy")
 
+DEFAULT_TIMEOUT_SECONDS = 30.0
+
+SESSION_MAX_AGE = timedelta(hours=12)
+
 
 @dataclass
 class Envoy:
@@ -22,17 +46,117 @@ class Envoy:
     session_id: Optional[str] = None
     session_id_last_update: datetime = datetime.now()
 
+    # Local envoy access uses self-signed certificate, so verification is off by default
+    verify: bool = False
+
+    # Number of keep-alive connections held open to the envoy
+    pool_size: int = 2
+
+    # Per-endpoint request timeouts in seconds, keyed by: login, production, inverters, inventory
+    timeouts: Dict[str, float] = field(default_factory=dict)
+
+    # Persists the session across restarts
+    cache: Optional[TokenCache] = None
+
+    # Keeps a sample of the raw payloads for debugging
+    capture: Optional[PayloadCapture] = None
+
+    # Decodes the response bodies. Defaults to the fastest one installed
+    decoder: Optional[Decoder] = None
+
+    # Records the production and inverter payloads, under the given source tag, for replay
+    recorder: Optional[PayloadRecorder] = None
+    tag: str = "envoy"
+
+    def __post_init__(self) -> None:
+        # Keeps each inverter at the same position of the inverter data across cycles
+        self.inverter_index = SerialIndex()
+
+        # Digest of the last inverters payload, to skip decoding it again when unchanged.
+        # A fetched payload only counts once its sampling cycle has succeeded
+        self._inverters_digest: Optional[bytes] = None
+        self._fetched_inverters_digest: Optional[bytes] = None
+        # The last inverter data, so the next one notes which reports changed
+        self._inverter_data: Optional[InverterData] = None
+        self._fetched_inverter_data: Optional[InverterData] = None
+
+        if self.decoder is None:
+            self.decoder = get_decoder()
+
+        # Guards the login so concurrent requests do not each start a new session
+        self._login_lock = threading.Lock()
+
+        # A single pooled session keeps the TCP/TLS connection to the envoy alive
+        # between sampling cycles, and carries the sessionId cookie once logged in.
+        self.session = requests.Session()
+        self.session.verify = self.verify
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        if self.session_id is None and self.cache is not None:
+            self._load_cached_session()
+
+    def close(self) -> None:
+        self.session.close()
+
     def get_session_id(self) -> str:
+        with self._login_lock:
+            now = datetime.now()
+
+            if self.session_expires_within(timedelta(0)):
+                self._set_session(self._login(), now)
+
+            return self.session_id
+
+    def session_expires_within(self, margin: timedelta) -> bool:
+        if not self.session_id:
+            return True
+        elapsed = datetime.now() - self.session_id_last_update
+        return elapsed > SESSION_MAX_AGE - margin
+
+    def refresh_session(self) -> None:
+        """
+        Log in to a new session, and swap it in once it has been established.
+        Requests keep using the current session in the meantime.
+        """
         now = datetime.now()
-        elapsed = now - self.session_id_last_update
+        session_id = self._login()
+        with self._login_lock:
+            self._set_session(session_id, now)
+
+    def _set_session(self, session_id: str, now: datetime) -> None:
+        self.session_id = session_id
+        self.session_id_last_update = now
+        self.session.cookies.set("sessionId", session_id)
+        if self.cache is not None:
+            self.cache.set_session(session_id, now)
+
+    def invalidate_session(self) -> None:
+        with self._login_lock:
+            self.session_id = None
+            if self.cache is not None:
+                self.cache.clear_session()
+
+    def _load_cached_session(self) -> None:
+        cached_session = self.cache.get_session()
+        if cached_session is None:
+            return
 
-        if not self.session_id or elapsed > timedelta(hours=12):
-            self._login()
-            self.session_id_last_update = now
+        session_id, last_update = cached_session
+        if datetime.now() - last_update > SESSION_MAX_AGE:
+            return
 
-        return self.session_id
+        LOG.info("Using cached envoy session from %s", last_update)
+        self.session_id = session_id
+        self.session_id_last_update = last_update
+        self.session.cookies.set("sessionId", session_id)
 
-    def _login(self) -> None:
+    def _login(self) -> str:
         """
         Login to local envoy and return the session id
         """
@@ -41,66 +165,108 @@ class Envoy:
             "Authorization": f"Bearer {enphase_token}",
         }
 
-        response = requests.get(
-            f"{self.url}/auth/check_jwt",
-            headers=headers,
-            verify=False,
-            timeout=30,
-        )
+        with self._timed_request("login"):
+            response = self.session.get(
+                f"{self.url}/auth/check_jwt",
+                headers=headers,
+                timeout=self._timeout("login"),
+            )
 
         response.raise_for_status()
-        self.session_id = response.cookies["sessionId"]
-        LOG.info("Logged into envoy. SessionID: %s", self.session_id)
+        session_id = response.cookies["sessionId"]
+        AUTH_REFRESHES.labels(kind="session").inc()
+        LOG.info("Logged into envoy. SessionID: %s", session_id)
+        return session_id
 
-    def get_power_data(self) -> SampleData:
-        LOG.debug("Fetching power data")
-        cookies = {
-            "sessionId": self.get_session_id(),
-        }
+    @contextmanager
+    def _timed_request(self, endpoint: str) -> Iterator[None]:
+        with timed(ENVOY_REQUEST_SECONDS.labels(endpoint=endpoint)):
+            try:
+                yield
+            except requests.Timeout:
+                ENVOY_TIMEOUTS.labels(endpoint=endpoint).inc()
+                raise
 
-        response = requests.get(
-            f"{self.url}/production.json?details=1",
-            cookies=cookies,
-            verify=False,
-            timeout=30,
-        )
+    def _timeout(self, endpoint: str) -> float:
+        return self.timeouts.get(endpoint, DEFAULT_TIMEOUT_SECONDS)
+
+    def _get(self, path: str, endpoint: str) -> bytes:
+        """
+        Return the raw body of a response, so it can be decoded straight into the model.
+        """
+        # Make sure the session cookie is current before reusing the pooled session
+        self.get_session_id()
+
+        with self._timed_request(endpoint):
+            response = self.session.get(
+                f"{self.url}{path}",
+                timeout=self._timeout(endpoint),
+            )
+
+        if response.status_code == 401:
+            # The session was dropped by the envoy (e.g. it rebooted), so log in again
+            LOG.info("Envoy session was rejected. Logging in again")
+            self.invalidate_session()
+            self.get_session_id()
+            with self._timed_request(endpoint):
+                response = self.session.get(
+                    f"{self.url}{path}",
+                    timeout=self._timeout(endpoint),
+                )
 
         response.raise_for_status()
-        json_data = response.json()
-        return SampleData.create(sample_data=json_data)
+        content = response.content
+
+        if self.capture is not None:
+            self.capture.record(self.url, endpoint, content)
+
+        return content
+
+    def get_power_data(self) -> SampleData:
+        LOG.debug("Fetching power data")
+        content = self._get("/production.json?details=1", "production")
+        if self.recorder is not None:
+            self.recorder.record(self.tag, "production", content)
+        with timed(DECODE_SECONDS.labels(endpoint="production")):
+            return self.decoder.decode_power_data(content)
 
-    def get_inverter_data(self) -> Dict[str, InverterSample]:
+    def get_inverter_data(self) -> InverterData:
         LOG.debug("Fetching inverter data")
-        cookies = {
-            "sessionId": self.get_session_id(),
-        }
+        content = self._get("/api/v1/production/inverters", "inverters")
 
-        response = requests.get(
-            f"{self.url}/api/v1/production/inverters",
-            cookies=cookies,
-            verify=False,
-            timeout=30,
-        )
+        # Inverters only report every few minutes, so the payload is usually the same
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        if digest == self._inverters_digest:
+            LOG.debug("Inverter data is unchanged")
+            self._fetched_inverters_digest = self._inverters_digest
+            self._fetched_inverter_data = self._inverter_data
+            return parse_inverter_data([], self.inverter_index)
 
-        response.raise_for_status()
-        json_data = response.json()
-        data = parse_inverter_data(json_data)
-        return data
+        # Unchanged payloads would not add anything to a replay, so only new ones are recorded
+        if self.recorder is not None and digest != self._fetched_inverters_digest:
+            self.recorder.record(self.tag, "inverters", content)
+        self._fetched_inverters_digest = digest
+
+        with timed(DECODE_SECONDS.labels(endpoint="inverters")):
+            inverter_data = self.decoder.decode_inverter_data(
+                content, self.inverter_index, self._inverter_data
+            )
+        self._fetched_inverter_data = inverter_data
+        return inverter_data
+
+    def commit_inverter_data(self) -> None:
+        """
+        Skip the last fetched inverters payload from now on, for as long as it is
+        unchanged. Called once its sampling cycle succeeded, so a cycle that is
+        retried decodes the same reports again rather than losing them.
+        """
+        self._inverters_digest = self._fetched_inverters_digest
+        self._inverter_data = self._fetched_inverter_data
 
     def get_inventory(self):
         LOG.debug("Fetching inventory")
-        cookies = {
-            "sessionId": self.get_session_id(),
-        }
-
-        response = requests.get(
-            f"{self.url}/inventory.json?deleted=1",
-            cookies=cookies,
-            verify=False,
-            timeout=30,
+        json_data = self.decoder.decode(
+            self._get("/inventory.json?deleted=1", "inventory")
         )
-
-        response.raise_for_status()
-        json_data = response.json()
         # TODO: Convert to objects
         return json_data
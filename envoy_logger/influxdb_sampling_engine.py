@@ -1,24 +1,50 @@
+import atexit
 import logging
-from datetime import date, datetime
-from typing import Dict, List
+import os
+import time
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
 
 from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.client.write_api import SYNCHRONOUS, WriteApi
 
 from envoy_logger.config import Config
+from envoy_logger.energy import DailyEnergyIntegrator
 from envoy_logger.envoy import Envoy
-from envoy_logger.model import InverterSample, PowerSample, SampleData
+from envoy_logger.influxdb_writer import InfluxdbBatchWriter, InfluxdbSpoolingWriter
+from envoy_logger.internal_metrics import (
+    POINT_BUILD_SECONDS,
+    SINK_WRITE_SECONDS,
+    internal_metrics_fields,
+    observe_freshness,
+    timed,
+)
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.line_protocol import LineProtocolEncoder
+from envoy_logger.model import InverterData, PowerSample, SampleData
+from envoy_logger.rollup import RollupResult, RollupStage
 from envoy_logger.sampling_engine import SamplingEngine
+from envoy_logger.sink import Sink
+from envoy_logger.spool import Spool
 
 LOG = logging.getLogger("influxdb_sampling_engine")
 
 
-class InfluxdbSamplingEngine(SamplingEngine):
-    def __init__(self, envoy: Envoy, config: Config, interval_seconds: int = 5) -> None:
-        super().__init__(envoy=envoy, interval_seconds=interval_seconds)
-
+class InfluxdbSink(Sink):
+    def __init__(
+        self,
+        config: Config,
+        persist_state: bool = True,
+        writer_factory: Optional[Callable[[WriteApi], InfluxdbBatchWriter]] = None,
+    ) -> None:
         self.config = config
 
+        # Replays keep their running totals in memory, so the live state is untouched.
+        # They also never query InfluxDB for the daily totals, since those queries
+        # cover the 24h before now rather than the replayed day
+        self.persist_state = persist_state
+
         influxdb_client = InfluxDBClient(
             url=config.influxdb_url,
             token=config.influxdb_token,
@@ -28,103 +54,305 @@ class InfluxdbSamplingEngine(SamplingEngine):
         self.influxdb_write_api = influxdb_client.write_api(write_options=SYNCHRONOUS)
         self.influxdb_query_api = influxdb_client.query_api()
 
-        # Used to track the transition to the next day for daily measurements
-        self.todays_date = date.today()
+        # Either write synchronously from the sampling loop, or hand points off to a
+        # background writer so a slow database does not delay the next sample.
+        # A writer factory (used by replays) replaces the configured spool and batching
+        self.influxdb_writer: (
+            WriteApi | InfluxdbSpoolingWriter | InfluxdbBatchWriter
+        ) = self.influxdb_write_api
+        if writer_factory is not None:
+            self.influxdb_writer = writer_factory(self.influxdb_write_api)
+        else:
+            self._create_configured_writer(config)
+
+        # The high rate points are encoded directly, from series keys computed up front
+        self.line_protocol = LineProtocolEncoder(config)
+        self.line_protocol.warm(envoy.tag for envoy in config.envoys)
+
+        # Used to track the transition to the next day for daily measurements, per source
+        self.todays_date: Dict[str, date] = {}
+
+        # Running daily energy totals, per source
+        self.energy_integrators: Dict[str, DailyEnergyIntegrator] = {}
+
+        # Streaming downsamplers, per source
+        self.rollup_stages: Dict[str, List[RollupStage]] = {}
+
+        # The internal metrics are periodically written along with the samples
+        self.internal_metrics_interval = config.internal_metrics_influxdb_interval
+        self._internal_metrics_last_write = time.monotonic()
+
+    def _create_configured_writer(self, config: Config) -> None:
+        spool: Optional[Spool] = None
+        if config.influxdb_spool is not None:
+            spool = Spool(
+                config.influxdb_spool.path,
+                segment_max_bytes=config.influxdb_spool.segment_max_bytes,
+                max_bytes=config.influxdb_spool.max_bytes,
+                fsync_interval=config.influxdb_spool.fsync_interval,
+            )
+            atexit.register(spool.close)
 
-    def run(self) -> None:
-        while True:
-            self.wait_for_next_cycle()
-            self._collect_samples()
+        if spool is not None:
+            self.influxdb_writer = InfluxdbSpoolingWriter(
+                self.influxdb_write_api, spool
+            )
 
-    def _collect_samples(self) -> None:
-        power_data, inverter_data = self.collect_samples_with_retry()
-        self._write_to_influxdb(power_data, inverter_data)
+        batching = config.influxdb_batching
+        if batching is not None:
+            self.influxdb_writer = InfluxdbBatchWriter(
+                self.influxdb_write_api,
+                batch_size=batching.batch_size,
+                flush_interval=batching.flush_interval,
+                max_queue_depth=batching.max_queue_depth,
+                backpressure=batching.backpressure,
+                max_retries=batching.max_retries,
+                retry_interval=batching.retry_interval,
+                max_retry_interval=batching.max_retry_interval,
+                spool=spool,
+            )
+            atexit.register(self.influxdb_writer.close)
+
+    def publish(
+        self,
+        source_tag: str,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+    ) -> None:
+        self._write_to_influxdb(sample_data, inverter_data, source_tag)
 
     def _write_to_influxdb(
-        self, sample_data: SampleData, inverter_data: Dict[str, InverterSample]
+        self,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+        source_tag: Optional[str] = None,
     ) -> None:
-        hr_points = self._get_high_rate_points(sample_data, inverter_data)
-        lr_points = self._low_rate_points(sample_data)
-        self.influxdb_write_api.write(
+        source_tag = source_tag or self.config.source_tag
+        with timed(POINT_BUILD_SECONDS.labels(sink="influxdb")):
+            hr_points = self._get_high_rate_points(
+                sample_data, inverter_data, source_tag
+            )
+            lr_points = (
+                self._low_rate_points(sample_data, inverter_data, source_tag)
+                + self._internal_metrics_points()
+            )
+            rollup_points = self._rollup_points(sample_data, inverter_data, source_tag)
+
+        # The batch writer times its own writes, and reports the sample as fresh,
+        # once InfluxDB has accepted them rather than once they are queued
+        if isinstance(self.influxdb_writer, InfluxdbBatchWriter):
+            self._write_points(hr_points, lr_points, rollup_points)
+            self.influxdb_writer.on_written(
+                lambda: observe_freshness("influxdb", sample_data)
+            )
+        else:
+            with timed(SINK_WRITE_SECONDS.labels(sink="influxdb")):
+                self._write_points(hr_points, lr_points, rollup_points)
+            observe_freshness("influxdb", sample_data)
+
+    def _write_points(
+        self,
+        hr_points: bytes,
+        lr_points: List[Point],
+        rollup_points: Dict[str, List[Point]],
+    ) -> None:
+        self.influxdb_writer.write(
             bucket=self.config.influxdb_bucket_hr, record=hr_points
         )
         if lr_points:
-            self.influxdb_write_api.write(
+            self.influxdb_writer.write(
                 bucket=self.config.influxdb_bucket_lr, record=lr_points
             )
+        for bucket, points in rollup_points.items():
+            self.influxdb_writer.write(bucket=bucket, record=points)
+
+    def _internal_metrics_points(self) -> List[Point]:
+        if self.internal_metrics_interval is None:
+            return []
+
+        now = time.monotonic()
+        if now - self._internal_metrics_last_write < self.internal_metrics_interval:
+            return []
+        self._internal_metrics_last_write = now
+
+        # Not tagged with a source, since the metrics cover every envoy of the process
+        p = Point("envoy_logger_internal")
+        p.time(datetime.now(tz=timezone.utc), WritePrecision.S)
+        for name, value in internal_metrics_fields().items():
+            p.field(name, value)
+
+        return [p]
 
     def _get_high_rate_points(
-        self, sample_data: SampleData, inverter_data: Dict[str, InverterSample]
-    ) -> List[Point]:
-        points = []
-        for line_index, line_sample in enumerate(
-            sample_data.total_consumption.eim_line_samples
-        ):
-            p = self._idb_point_from_line("consumption", line_index, line_sample)
-            points.append(p)
-        for line_index, line_sample in enumerate(
-            sample_data.total_production.eim_line_samples
-        ):
-            p = self._idb_point_from_line("production", line_index, line_sample)
-            points.append(p)
-        for line_index, line_sample in enumerate(
-            sample_data.net_consumption.eim_line_samples
-        ):
-            p = self._idb_point_from_line("net", line_index, line_sample)
-            points.append(p)
-
-        for inverter in inverter_data.values():
-            p = self._point_from_inverter(inverter)
-            points.append(p)
+        self,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+        source_tag: Optional[str] = None,
+    ) -> bytes:
+        source_tag = source_tag or self.config.source_tag
+        return self.line_protocol.encode(sample_data, inverter_data, source_tag)
+
+    def _rollup_points(
+        self,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+        source_tag: str,
+    ) -> Dict[str, List[Point]]:
+        if not self.config.influxdb_rollups:
+            return {}
+
+        stages = self.rollup_stages.get(source_tag)
+        if stages is None:
+            stages = self.rollup_stages[source_tag] = [
+                RollupStage(rollup.resolution_seconds, rollup.bucket)
+                for rollup in self.config.influxdb_rollups
+            ]
+
+        results: List[Tuple[RollupStage, RollupResult]] = []
+        for stage in stages:
+            for measurement_type, idx, line_sample in _iter_line_samples(sample_data):
+                result = stage.add(
+                    measurement_type,
+                    idx,
+                    line_sample.ts.timestamp(),
+                    _line_fields(line_sample),
+                )
+                if result is not None:
+                    results.append((stage, result))
+
+            for serial, ts, watts in inverter_data.rows():
+                result = stage.add("inverter", serial, ts, {"P": watts})
+                if result is not None:
+                    results.append((stage, result))
+
+        points: Dict[str, List[Point]] = {}
+        for stage, result in results:
+            p = self._point_from_rollup(stage, result, source_tag)
+            points.setdefault(stage.bucket, []).append(p)
 
         return points
 
-    def _idb_point_from_line(
-        self, measurement_type: str, idx: int, data: PowerSample
+    def _point_from_rollup(
+        self, stage: RollupStage, result: RollupResult, source_tag: str
     ) -> Point:
-        p = Point(f"{measurement_type}-line{idx}")
-        p.time(data.ts, WritePrecision.S)
-        p.tag("source", self.config.source_tag)
-        p.tag("measurement-type", measurement_type)
-        p.tag("line-idx", idx)
+        # Same measurement and tags as the high rate series, so queries only need a
+        # different bucket and field names
+        if result.measurement_type == "inverter":
+            p = Point(f"inverter-production-{result.id}")
+            p.tag("serial", result.id)
+            self.config.apply_tags_to_inverter_point(p, result.id)
+        else:
+            p = Point(f"{result.measurement_type}-line{result.id}")
+            p.tag("line-idx", result.id)
+
+        p.time(result.window.start, WritePrecision.S)
+        p.tag("source", source_tag)
+        p.tag("measurement-type", result.measurement_type)
+        p.tag("interval", stage.interval_tag)
+
+        for name, stats in result.window.fields.items():
+            p.field(f"{name}_min", stats.min)
+            p.field(f"{name}_max", stats.max)
+            p.field(f"{name}_mean", stats.mean)
+            p.field(f"{name}_last", stats.last)
+        p.field("Wh", result.window.energy.Wh)
 
-        p.field("P", data.wNow)
-        p.field("Q", data.reactPwr)
-        p.field("S", data.apprntPwr)
+        return p
 
-        p.field("I_rms", data.rmsCurrent)
-        p.field("V_rms", data.rmsVoltage)
+    def _low_rate_points(
+        self,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+        source_tag: str,
+    ) -> List[Point]:
+        ts = _cycle_timestamp(sample_data)
+        new_date = ts.astimezone().date()
 
-        return p
+        if self.config.influxdb_daily_energy == "flux" and self.persist_state:
+            # First check if the day rolled over
+            todays_date = self.todays_date.setdefault(source_tag, new_date)
+            if todays_date == new_date:
+                # still the same date. No summary
+                return []
 
-    def _point_from_inverter(self, inverter: InverterSample) -> Point:
-        p = Point(f"inverter-production-{inverter.serial}")
-        p.time(inverter.ts, WritePrecision.S)
-        p.tag("source", self.config.source_tag)
-        p.tag("measurement-type", "inverter")
-        p.tag("serial", inverter.serial)
-        self.config.apply_tags_to_inverter_point(p, inverter.serial)
+            # it is a new day!
+            self.todays_date[source_tag] = new_date
 
-        p.field("P", inverter.watts)
+            # Collect points that summarize prior day
+            return self._compute_daily_Wh_points(ts, source_tag)
 
-        return p
+        integrator = self._get_energy_integrator(source_tag)
 
-    def _low_rate_points(self, sample_data: SampleData) -> List[Point]:
-        # First check if the day rolled over
-        new_date = date.today()
-        if self.todays_date == new_date:
-            # still the same date. No summary
-            return []
+        points = []
+        if integrator.day != new_date:
+            ended_day = integrator.day
+            totals = integrator.roll_over(new_date)
+            if totals is not None:
+                points = self._daily_Wh_points_from_totals(totals, ts, source_tag)
+            elif ended_day is not None and not self.persist_state:
+                LOG.info(
+                    "Energy totals for %s are incomplete. Skipping its summary",
+                    ended_day,
+                )
+            elif ended_day is not None:
+                # Not running for all of the day, so let InfluxDB integrate what it has
+                LOG.info(
+                    "Energy totals for %s are incomplete. Querying InfluxDB instead",
+                    ended_day,
+                )
+                points = self._compute_daily_Wh_points(ts, source_tag)
+
+        for measurement_type, idx, line_sample in _iter_line_samples(sample_data):
+            integrator.add(
+                measurement_type, idx, line_sample.ts.timestamp(), line_sample.wNow
+            )
+        for serial, ts, watts in inverter_data.rows():
+            integrator.add("inverter", serial, ts, watts)
+        integrator.maybe_save()
 
-        # it is a new day!
-        self.todays_date = new_date
+        return points
 
-        # Collect points that summarize prior day
-        points = self._compute_daily_Wh_points(sample_data.ts)
+    def _get_energy_integrator(self, source_tag: str) -> DailyEnergyIntegrator:
+        integrator = self.energy_integrators.get(source_tag)
+        if integrator is None:
+            path: Optional[str] = None
+            if self.persist_state:
+                path = os.path.join(
+                    self.config.state_dir,
+                    "daily_energy",
+                    f"{quote(source_tag, safe='')}.json",
+                )
+            integrator = DailyEnergyIntegrator(path)
+            atexit.register(integrator.save)
+            self.energy_integrators[source_tag] = integrator
+
+        return integrator
+
+    def _daily_Wh_points_from_totals(
+        self, totals: Dict[Tuple[str, str], float], ts: datetime, source_tag: str
+    ) -> List[Point]:
+        unreported_inverters = set(self.config.inverters.keys())
+        points = []
+        for (measurement_type, id), Wh in totals.items():
+            if measurement_type == "inverter":
+                unreported_inverters.discard(id)
+            points.append(
+                self._daily_summary_point(measurement_type, id, Wh, ts, source_tag)
+            )
+
+        # If any inverters did not report in for the day, fill in a 0wh measurement
+        for serial in unreported_inverters:
+            points.append(
+                self._daily_summary_point("inverter", serial, 0.0, ts, source_tag)
+            )
 
         return points
 
-    def _compute_daily_Wh_points(self, ts: datetime) -> List[Point]:
+    def _compute_daily_Wh_points(
+        self, ts: datetime, source_tag: Optional[str] = None
+    ) -> List[Point]:
+        source_tag = source_tag or self.config.source_tag
+
         # Not using integral(interpolate:"linear") since it does not do what you
         # think it would mean. Without the "interoplation" arg, it still does
         # linear interpolation correctly.
@@ -132,7 +360,7 @@ class InfluxdbSamplingEngine(SamplingEngine):
         query = f"""
         from(bucket: "{self.config.influxdb_bucket_hr}")
             |> range(start: -24h, stop: 0h)
-            |> filter(fn: (r) => r["source"] == "{self.config.source_tag}")
+            |> filter(fn: (r) => r["source"] == "{source_tag}")
             |> filter(fn: (r) => r["_field"] == "P")
             |> integral(unit: 1h)
             |> keep(columns: ["_value", "line-idx", "measurement-type", "serial"])
@@ -146,34 +374,104 @@ class InfluxdbSamplingEngine(SamplingEngine):
             for record in table.records:
                 measurement_type = record["measurement-type"]
                 if measurement_type == "inverter":
-                    serial = record["serial"]
-                    unreported_inverters.discard(serial)
-                    p = Point(f"inverter-daily-summary-{serial}")
-                    p.tag("serial", serial)
-                    self.config.apply_tags_to_inverter_point(p, serial)
+                    id = record["serial"]
+                    unreported_inverters.discard(id)
                 else:
-                    idx = record["line-idx"]
-                    p = Point(f"{measurement_type}-daily-summary-line{idx}")
-                    p.tag("line-idx", idx)
+                    id = record["line-idx"]
 
-                p.time(ts, WritePrecision.S)
-                p.tag("source", self.config.source_tag)
-                p.tag("measurement-type", measurement_type)
-                p.tag("interval", "24h")
-
-                p.field("Wh", record.get_value())
-                points.append(p)
+                points.append(
+                    self._daily_summary_point(
+                        measurement_type, id, record.get_value(), ts, source_tag
+                    )
+                )
 
         # If any inverters did not report in for the day, fill in a 0wh measurement
         for serial in unreported_inverters:
-            p = Point(f"inverter-daily-summary-{serial}")
-            p.tag("serial", serial)
-            self.config.apply_tags_to_inverter_point(p, serial)
-            p.time(ts, WritePrecision.S)
-            p.tag("source", self.config.source_tag)
-            p.tag("measurement-type", measurement_type)
-            p.tag("interval", "24h")
-            p.field("Wh", 0.0)
-            points.append(p)
+            points.append(
+                self._daily_summary_point("inverter", serial, 0.0, ts, source_tag)
+            )
 
         return points
+
+    def _daily_summary_point(
+        self, measurement_type: str, id: str, Wh: float, ts: datetime, source_tag: str
+    ) -> Point:
+        if measurement_type == "inverter":
+            p = Point(f"inverter-daily-summary-{id}")
+            p.tag("serial", id)
+            self.config.apply_tags_to_inverter_point(p, id)
+        else:
+            p = Point(f"{measurement_type}-daily-summary-line{id}")
+            p.tag("line-idx", id)
+
+        p.time(ts, WritePrecision.S)
+        p.tag("source", source_tag)
+        p.tag("measurement-type", measurement_type)
+        p.tag("interval", "24h")
+
+        p.field("Wh", Wh)
+        return p
+
+
+def _iter_line_samples(
+    sample_data: SampleData,
+) -> Iterator[Tuple[str, int, PowerSample]]:
+    for measurement_type, eim_sample in (
+        ("consumption", sample_data.total_consumption),
+        ("production", sample_data.total_production),
+        ("net", sample_data.net_consumption),
+    ):
+        if eim_sample is None:
+            continue
+        for line_index, line_sample in enumerate(eim_sample.eim_line_samples):
+            yield measurement_type, line_index, line_sample
+
+
+def _line_fields(line_sample: PowerSample) -> Dict[str, float]:
+    return {
+        "P": line_sample.wNow,
+        "Q": line_sample.reactPwr,
+        "S": line_sample.apprntPwr,
+        "I_rms": line_sample.rmsCurrent,
+        "V_rms": line_sample.rmsVoltage,
+    }
+
+
+def _cycle_timestamp(sample_data: SampleData) -> datetime:
+    # Use the envoy's own reading time, so the day boundary follows the samples
+    for _, _, line_sample in _iter_line_samples(sample_data):
+        return line_sample.ts
+    return datetime.now(tz=timezone.utc)
+
+
+class InfluxdbSamplingEngine(SamplingEngine, InfluxdbSink):
+    def __init__(
+        self,
+        envoy: Envoy,
+        config: Config,
+        interval_seconds: int = 5,
+        overrun_policy: str = "skip",
+        adaptive_inverter_polling: bool = False,
+        inverter_max_interval: float = 300.0,
+        inverter_reports: Optional[InverterReportIndex] = None,
+    ) -> None:
+        SamplingEngine.__init__(
+            self,
+            envoy=envoy,
+            interval_seconds=interval_seconds,
+            concurrent=config.sampling_concurrent,
+            overrun_policy=overrun_policy,
+            adaptive_inverter_polling=adaptive_inverter_polling,
+            inverter_max_interval=inverter_max_interval,
+            inverter_reports=inverter_reports,
+        )
+        InfluxdbSink.__init__(self, config=config)
+
+    def run(self) -> None:
+        while True:
+            self.wait_for_next_cycle()
+            self._collect_samples()
+
+    def _collect_samples(self) -> None:
+        power_data, inverter_data = self.collect_samples_with_retry()
+        self._write_to_influxdb(power_data, inverter_data)
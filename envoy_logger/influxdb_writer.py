@@ -0,0 +1,359 @@
+import logging
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from influxdb_client import Point, WritePrecision
+from influxdb_client.client.write_api import WriteApi
+
+from envoy_logger.internal_metrics import (
+    INFLUXDB_POINTS,
+    INFLUXDB_QUEUE_DEPTH,
+    INFLUXDB_WRITE_RETRIES,
+    SINK_WRITE_SECONDS,
+)
+from envoy_logger.sink import BACKPRESSURE_POLICIES
+from envoy_logger.spool import Spool
+
+LOG = logging.getLogger("influxdb_writer")
+
+NS_PER_UNIT = {
+    WritePrecision.S: 1_000_000_000,
+    WritePrecision.MS: 1_000_000,
+    WritePrecision.US: 1_000,
+    WritePrecision.NS: 1,
+}
+
+# Points, or lines of line protocol already encoded at nanosecond precision
+Records = List[Point] | bytes
+
+# A point and its bucket, or a callback (with no bucket) to run once the points
+# queued before it are written
+QueueItem = Tuple[Optional[str], Point | bytes | Callable[[], None]]
+
+
+@dataclass
+class WriterStats:
+    queue_depth: int = 0
+    points_written: int = 0
+    points_dropped: int = 0
+    write_retries: int = 0
+    last_write_latency_seconds: float = 0.0
+    max_write_latency_seconds: float = 0.0
+
+
+class InfluxdbSpoolingWriter:
+    """
+    Writes points synchronously, and spools them to disk if the write fails.
+
+    Spooled points are replayed, oldest first, after each successful write. Only
+    one segment is replayed per write, so after a long outage the backlog drains
+    over the following cycles instead of stalling the sampling loop.
+    """
+
+    def __init__(self, write_api: WriteApi, spool: Spool) -> None:
+        self.write_api = write_api
+        self.spool = spool
+
+    def write(self, bucket: str, record: Records) -> None:
+        try:
+            self.write_api.write(bucket=bucket, record=record)
+        except Exception as e:
+            LOG.warning(
+                "InfluxDB write failed, spooling %d points: %s", _count(record), e
+            )
+            spool_points(self.spool, bucket, record)
+            return
+
+        if self.spool.pending():
+            replay_spool(self.write_api, self.spool)
+
+
+class InfluxdbBatchWriter:
+    """
+    Decouples sampling from writing to InfluxDB.
+
+    Points are put on a bounded in-memory queue, and a background thread writes
+    them in batches of up to batch_size points, or whatever has accumulated
+    after flush_interval seconds. Failed writes are retried with exponential
+    backoff and full jitter. If a spool is given, points that still fail are
+    spooled to disk instead of being dropped, and replayed one segment after
+    each successful batch.
+
+    When the queue is full the backpressure policy decides what happens:
+      - block: the caller waits until there is room
+      - drop_oldest: the oldest queued point is discarded
+      - drop_newest: the point being written is discarded
+    """
+
+    def __init__(
+        self,
+        write_api: WriteApi,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_depth: int = 10000,
+        backpressure: str = "drop_oldest",
+        max_retries: int = 5,
+        retry_interval: float = 1.0,
+        max_retry_interval: float = 30.0,
+        spool: Optional[Spool] = None,
+    ) -> None:
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+
+        self.write_api = write_api
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.spool = spool
+
+        self._queue: queue.Queue[QueueItem] = queue.Queue(maxsize=max_queue_depth)
+        self._put_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = WriterStats()
+        self._stats_lock = threading.Lock()
+        # Whether points were spooled or dropped since the last on_written() callbacks
+        self._unwritten = False
+
+        # The stats are also exported along with the internal metrics
+        INFLUXDB_QUEUE_DEPTH.set_function(self._queue.qsize)
+        self._points_written = INFLUXDB_POINTS.labels(outcome="written")
+        self._points_dropped = INFLUXDB_POINTS.labels(outcome="dropped")
+        self._write_seconds = SINK_WRITE_SECONDS.labels(sink="influxdb")
+
+        self._thread = threading.Thread(
+            target=self._run, name="influxdb-writer", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> WriterStats:
+        with self._stats_lock:
+            return WriterStats(
+                queue_depth=self.queue_depth,
+                points_written=self._stats.points_written,
+                points_dropped=self._stats.points_dropped,
+                write_retries=self._stats.write_retries,
+                last_write_latency_seconds=self._stats.last_write_latency_seconds,
+                max_write_latency_seconds=self._stats.max_write_latency_seconds,
+            )
+
+    def write(self, bucket: str, record: Records) -> None:
+        """
+        Queue points to be written to a bucket. Has the same call signature as
+        WriteApi.write() so the two can be used interchangeably.
+        """
+        # Encoded points are queued line by line, so batch_size still counts points
+        points = record.splitlines() if isinstance(record, bytes) else record
+        for point in points:
+            self._put((bucket, point))
+
+    def on_written(self, callback: Callable[[], None]) -> None:
+        """
+        Call callback from the writer thread once every point queued so far has
+        been written. It is not called if any of them are spooled or dropped.
+        """
+        self._put((None, callback))
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the writer thread after it has written everything left in the queue.
+        """
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+
+    def _put(self, item: QueueItem) -> None:
+        if self.backpressure == "block":
+            self._queue.put(item)
+            return
+
+        with self._put_lock:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+            dropped = True
+            if self.backpressure == "drop_oldest":
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    # The writer emptied the queue in the meantime
+                    dropped = False
+                self._queue.put_nowait(item)
+
+        if dropped and item[0] is not None:
+            self._count_dropped(1)
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _next_batch(self) -> List[QueueItem]:
+        batch: List[QueueItem] = []
+        points = 0
+        deadline = time.monotonic() + self.flush_interval
+
+        while points < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item[0] is not None:
+                points += 1
+
+        return batch
+
+    def _write_batch(self, batch: List[QueueItem]) -> None:
+        points_by_bucket: Dict[str, List[Point | bytes]] = {}
+        callbacks: List[Callable[[], None]] = []
+        for bucket, point in batch:
+            if bucket is None:
+                callbacks.append(point)
+            else:
+                points_by_bucket.setdefault(bucket, []).append(point)
+
+        for bucket, points in points_by_bucket.items():
+            if self._write_with_retry(bucket, points):
+                with self._stats_lock:
+                    self._stats.points_written += len(points)
+                self._points_written.inc(len(points))
+                if self.spool is not None and self.spool.pending():
+                    replay_spool(self.write_api, self.spool)
+            elif self.spool is not None:
+                LOG.error(
+                    "Spooling %d points for bucket %s after %d retries",
+                    len(points),
+                    bucket,
+                    self.max_retries,
+                )
+                spool_points(self.spool, bucket, points)
+                self._unwritten = True
+            else:
+                LOG.error(
+                    "Dropping %d points for bucket %s after %d retries",
+                    len(points),
+                    bucket,
+                    self.max_retries,
+                )
+                self._count_dropped(len(points))
+
+        # Everything queued before a callback was in this batch, or an earlier one
+        if callbacks:
+            if not self._unwritten:
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        LOG.exception("Write callback failed")
+            self._unwritten = False
+
+        LOG.debug(
+            "Wrote batch of %d points. Queue depth: %d, write latency: %.3fs",
+            len(batch),
+            self.queue_depth,
+            self._stats.last_write_latency_seconds,
+        )
+
+    def _write_with_retry(self, bucket: str, points: List[Point | bytes]) -> bool:
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                with self._stats_lock:
+                    self._stats.write_retries += 1
+                INFLUXDB_WRITE_RETRIES.inc()
+                time.sleep(self._retry_delay(attempt))
+
+            start = time.monotonic()
+            try:
+                self.write_api.write(bucket=bucket, record=points)
+            except Exception as e:
+                LOG.warning(
+                    "InfluxDB write failed (%d/%d): %s",
+                    attempt + 1,
+                    self.max_retries + 1,
+                    e,
+                )
+                continue
+
+            latency = time.monotonic() - start
+            self._write_seconds.observe(latency)
+            with self._stats_lock:
+                self._stats.last_write_latency_seconds = latency
+                self._stats.max_write_latency_seconds = max(
+                    self._stats.max_write_latency_seconds, latency
+                )
+            return True
+
+        return False
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Exponential backoff with full jitter, so several writers do not retry in lockstep
+        backoff = min(self.max_retry_interval, self.retry_interval * 2 ** (attempt - 1))
+        return random.uniform(0, backoff)
+
+    def _count_dropped(self, count: int) -> None:
+        self._unwritten = True
+        with self._stats_lock:
+            self._stats.points_dropped += count
+        self._points_dropped.inc(count)
+
+
+def spool_points(
+    spool: Spool, bucket: str, points: List[Point | bytes] | bytes
+) -> None:
+    # Spooled at nanosecond precision so points of any precision can share a segment
+    if isinstance(points, bytes):
+        points = points.splitlines()
+    lines = [
+        point.decode() if isinstance(point, bytes) else _to_line_protocol_ns(point)
+        for point in points
+    ]
+    spool.append(bucket, [line for line in lines if line])
+
+
+def _to_line_protocol_ns(point: Point) -> str:
+    # to_line_protocol(NS) leaves integer times unscaled, so a time given in
+    # seconds would land in 1970. Serialize at the point's own precision instead,
+    # and scale its timestamp
+    line = point.to_line_protocol()
+    scale = NS_PER_UNIT[point.write_precision]
+    if not line or point._time is None or scale == 1:
+        return line
+
+    head, ts = line.rsplit(" ", 1)
+    return f"{head} {int(ts) * scale}"
+
+
+def _count(record: Records) -> int:
+    if isinstance(record, bytes):
+        return record.count(b"\n")
+    return len(record)
+
+
+def replay_spool(
+    write_api: WriteApi, spool: Spool, max_segments: Optional[int] = 1
+) -> None:
+    def write(bucket: str, lines: List[str]) -> None:
+        write_api.write(bucket=bucket, record=lines, write_precision=WritePrecision.NS)
+
+    try:
+        spool.replay(write, max_segments=max_segments)
+    except Exception as e:
+        LOG.warning("Replaying spooled points failed: %s", e)
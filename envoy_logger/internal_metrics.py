@@ -0,0 +1,189 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import Metric
+
+from envoy_logger.model import SampleData
+
+LOG = logging.getLogger("internal_metrics")
+
+# Measures how envoy-logger itself performs. The metrics are registered with the
+# default registry, so they are exposed wherever /metrics is served.
+
+# Most of the stages take milliseconds, while envoy requests can take tens of seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+ENVOY_REQUEST_SECONDS = Histogram(
+    "envoy_logger_envoy_request_seconds",
+    "Duration of the requests to the envoy, per endpoint",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+ENVOY_TIMEOUTS = Counter(
+    "envoy_logger_envoy_timeouts",
+    "Requests to the envoy that timed out, per endpoint",
+    ["endpoint"],
+)
+DECODE_SECONDS = Histogram(
+    "envoy_logger_decode_seconds",
+    "Time spent decoding envoy responses, per endpoint",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+SAMPLE_RETRIES = Counter(
+    "envoy_logger_sample_retries",
+    "Sampling cycles that were retried after a timeout",
+)
+AUTH_REFRESHES = Counter(
+    "envoy_logger_auth_refreshes",
+    "New enphaseenergy.com tokens (token) and envoy sessions (session)",
+    ["kind"],
+)
+POINT_BUILD_SECONDS = Histogram(
+    "envoy_logger_point_build_seconds",
+    "Time spent turning a sample into points or metrics, per sink",
+    ["sink"],
+    buckets=LATENCY_BUCKETS,
+)
+SINK_WRITE_SECONDS = Histogram(
+    "envoy_logger_sink_write_seconds",
+    "Duration of the writes to a sink",
+    ["sink"],
+    buckets=LATENCY_BUCKETS,
+)
+FRESHNESS_SECONDS = Histogram(
+    "envoy_logger_freshness_lag_seconds",
+    "Time from the envoy reading a sample to the sink accepting it",
+    ["sink"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+INFLUXDB_QUEUE_DEPTH = Gauge(
+    "envoy_logger_influxdb_queue_depth",
+    "Points waiting in the queue of the InfluxDB batch writer",
+)
+INFLUXDB_POINTS = Counter(
+    "envoy_logger_influxdb_points",
+    "Points handled by the InfluxDB batch writer, per outcome (written or dropped)",
+    ["outcome"],
+)
+INFLUXDB_WRITE_RETRIES = Counter(
+    "envoy_logger_influxdb_write_retries",
+    "Retried InfluxDB batch writes",
+)
+SINK_DROPPED_SAMPLES = Counter(
+    "envoy_logger_sink_dropped_samples",
+    "Samples discarded because a sink fell behind, per sink",
+    ["sink"],
+)
+SCHEDULER_LATE_TICKS = Counter(
+    "envoy_logger_scheduler_late_ticks",
+    "Sampling cycles that started late, per envoy",
+    ["source"],
+)
+SCHEDULER_SKIPPED_TICKS = Counter(
+    "envoy_logger_scheduler_skipped_ticks",
+    "Sampling cycles that were never run because a cycle overran, per envoy",
+    ["source"],
+)
+SCHEDULER_OVERRUNS = Counter(
+    "envoy_logger_scheduler_overruns",
+    "Sampling cycles still running when the next one was due, per envoy",
+    ["source"],
+)
+
+INTERNAL_METRICS = (
+    ENVOY_REQUEST_SECONDS,
+    ENVOY_TIMEOUTS,
+    DECODE_SECONDS,
+    SAMPLE_RETRIES,
+    AUTH_REFRESHES,
+    POINT_BUILD_SECONDS,
+    SINK_WRITE_SECONDS,
+    FRESHNESS_SECONDS,
+    INFLUXDB_QUEUE_DEPTH,
+    INFLUXDB_POINTS,
+    INFLUXDB_WRITE_RETRIES,
+    SINK_DROPPED_SAMPLES,
+    SCHEDULER_LATE_TICKS,
+    SCHEDULER_SKIPPED_TICKS,
+    SCHEDULER_OVERRUNS,
+)
+
+
+@contextmanager
+def timed(histogram: Histogram) -> Iterator[None]:
+    # Like Histogram.time(), for a child looked up once by the caller
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def observe_freshness(sink: str, sample_data: SampleData) -> None:
+    reading_time = _reading_time(sample_data)
+    if reading_time is not None:
+        FRESHNESS_SECONDS.labels(sink=sink).observe(
+            max(0.0, time.time() - reading_time)
+        )
+
+
+def _reading_time(sample_data: SampleData) -> Optional[float]:
+    for eim_sample in (
+        sample_data.total_production,
+        sample_data.total_consumption,
+        sample_data.net_consumption,
+    ):
+        if eim_sample is not None and eim_sample.eim_line_samples:
+            return eim_sample.eim_line_samples[0].ts.timestamp()
+    return None
+
+
+def start_internal_metrics_server(port: int) -> None:
+    # Only needed when the Prometheus sink does not already serve /metrics
+    start_http_server(port)
+    LOG.info("Serving internal metrics on port %d", port)
+
+
+def internal_metrics_fields() -> Dict[str, float]:
+    """
+    Flatten the internal metrics into fields of one InfluxDB point, such as
+    envoy_request_seconds_sum_production or sample_retries_total.
+    """
+    fields: Dict[str, float] = {}
+    for metric in _collect():
+        for sample in metric.samples:
+            # Bucket counts would add dozens of fields for little use
+            if sample.name.endswith("_bucket") or sample.name.endswith("_created"):
+                continue
+            name = sample.name.removeprefix("envoy_logger_")
+            for label in sorted(sample.labels.values()):
+                name += f"_{label}"
+            fields[name] = float(sample.value)
+    return fields
+
+
+def _collect() -> List[Metric]:
+    metrics: List[Metric] = []
+    for collector in INTERNAL_METRICS:
+        metrics.extend(collector.collect())
+    return metrics
@@ -0,0 +1,121 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from envoy_logger.model import InverterData
+
+LOG = logging.getLogger("inverter_poller")
+
+
+@dataclass
+class InverterCadence:
+    # Last lastReportDate of the inverter, on the envoy's clock
+    last_report: float
+    # When that report was first seen, on the local monotonic clock
+    seen_at: float
+    # Learned time between reports, in seconds
+    interval: Optional[float] = None
+
+
+class InverterPoller:
+    """
+    Decides when the inverters endpoint is worth polling.
+
+    Inverters only report every few minutes, so polling them every sampling
+    cycle mostly downloads reports that were already seen. The time between
+    reports of each inverter is learned from its lastReportDate, and the
+    endpoint is next polled when the earliest inverter is expected to report.
+
+    Only differences between report dates are used, so the envoy and local
+    clocks do not need to agree. The report is expected up to min_interval
+    earlier than the cadence suggests, since it may have been made just after
+    the previous poll.
+
+    If the expected reports do not arrive, the poll interval backs off from
+    min_interval, but never beyond the shortest learned cadence, so an
+    inverter cannot report twice between two polls and no report is lost.
+    Inverters that missed two reports in a row (e.g. at night) no longer
+    drive the schedule until they report again. Likewise, an inverter whose
+    cadence could not be learned within max_interval of first seeing it stops
+    the endpoint from being polled every cycle.
+    """
+
+    def __init__(
+        self, min_interval: float, max_interval: float = 300.0, smoothing: float = 0.2
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+
+        self.polls = 0
+        self.skipped = 0
+
+        self._inverters: Dict[str, InverterCadence] = {}
+        self._next_poll = 0.0
+        self._backoff = min_interval
+
+    def due(self) -> bool:
+        if time.monotonic() >= self._next_poll:
+            self.polls += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def update(self, inverter_data: InverterData) -> None:
+        """
+        Learn from the (unfiltered) reports of a poll, and schedule the next one.
+        """
+        now = time.monotonic()
+
+        new_reports = False
+        for serial, ts, _ in inverter_data.rows():
+            inverter = self._inverters.get(serial)
+            if inverter is None:
+                self._inverters[serial] = InverterCadence(last_report=ts, seen_at=now)
+                new_reports = True
+            elif ts > inverter.last_report:
+                interval = ts - inverter.last_report
+                if inverter.interval is None:
+                    inverter.interval = interval
+                else:
+                    inverter.interval += self.smoothing * (interval - inverter.interval)
+                inverter.last_report = ts
+                inverter.seen_at = now
+                new_reports = True
+
+        self._next_poll = self._schedule(now, new_reports)
+
+    def _schedule(self, now: float, new_reports: bool) -> float:
+        learning = any(
+            inverter.interval is None and now - inverter.seen_at < self.max_interval
+            for inverter in self._inverters.values()
+        )
+        if learning:
+            # Still learning the cadence of some inverters
+            return now
+
+        intervals = [
+            inverter.interval
+            for inverter in self._inverters.values()
+            if inverter.interval is not None
+        ]
+        max_wait = min(min(intervals, default=self.max_interval), self.max_interval)
+
+        expected = [
+            inverter.seen_at + inverter.interval - self.min_interval
+            for inverter in self._inverters.values()
+            if inverter.interval is not None
+            and now - inverter.seen_at < 2 * inverter.interval
+        ]
+        if expected and min(expected) > now:
+            self._backoff = self.min_interval
+            return min(min(expected), now + max_wait)
+
+        # A report is overdue. Keep checking, less often the longer it takes
+        if new_reports:
+            self._backoff = self.min_interval
+        else:
+            self._backoff = min(self._backoff * 2, max_wait)
+        return now + self._backoff
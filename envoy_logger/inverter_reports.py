@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from envoy_logger.model import InverterData, filter_new_inverter_data
+
+LOG = logging.getLogger("inverter_reports")
+
+
+class InverterReportIndex:
+    """
+    Remembers the lastReportDate of the last report emitted by each inverter
+    of one envoy, so every report is emitted exactly once.
+
+    The index is periodically saved to a JSON file, so reports that were
+    already emitted before a restart are not emitted again.
+    """
+
+    def __init__(self, path: Optional[str] = None, save_interval: float = 60.0) -> None:
+        self.path = path
+        self.save_interval = save_interval
+
+        self.last_reports: Dict[str, float] = {}
+        self._last_save = 0.0
+        self._dirty = False
+
+        if path is not None:
+            self._load()
+
+    def filter_new(self, inverter_data: InverterData) -> InverterData:
+        new_inverter_data = filter_new_inverter_data(inverter_data, self.last_reports)
+        if new_inverter_data.slots:
+            self._dirty = True
+        self.maybe_save()
+        return new_inverter_data
+
+    def maybe_save(self) -> None:
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        self._last_save = time.monotonic()
+        if self.path is None or not self._dirty:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+
+            # Write to a temporary file first so a crash never leaves a truncated index
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.last_reports, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # At worst, the reports since the last save are emitted again after a restart
+            LOG.warning("Unable to write inverter reports %s: %s", self.path, e)
+            return
+
+        self._dirty = False
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.last_reports = {
+                    str(serial): float(ts) for serial, ts in json.load(f).items()
+                }
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, AttributeError) as e:
+            LOG.warning("Ignoring unreadable inverter reports %s: %s", self.path, e)
+            return
+
+        LOG.info(
+            "Loaded last reports of %d inverters from %s",
+            len(self.last_reports),
+            self.path,
+        )
@@ -2,72 +2,80 @@ from __future__ import annotations
 
 import json
 import logging
+import math
+from array import array
+from collections.abc import Mapping
 from dataclasses import asdict, dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 LOG = logging.getLogger("model")
 
+NAN = float("nan")
+
+
+# Layout of the values array of a PowerSample
+POWER_FIELDS = (
+    # Instantaneous measurements
+    "wNow",
+    "rmsCurrent",
+    "rmsVoltage",
+    "reactPwr",
+    "apprntPwr",
+    # Historical measurements (Today)
+    "whToday",
+    "vahToday",
+    "varhLagToday",
+    "varhLeadToday",
+    # Historical measurements (Lifetime)
+    "whLifetime",
+    "vahLifetime",
+    "varhLagLifetime",
+    "varhLeadLifetime",
+    # Historical measurements (Other)
+    "whLastSevenDays",
+)
+
 
-@dataclass(frozen=True)
 class PowerSample:
     """
     A generic power sample
-    """
 
-    ts: datetime
-
-    # Instantaneous measurements
-    wNow: float
-    rmsCurrent: float
-    rmsVoltage: float
-    reactPwr: float
-    apprntPwr: float
-
-    # Historical measurements (Today)
-    whToday: float
-    vahToday: float
-    varhLagToday: float
-    varhLeadToday: float
+    The measurements are held in a single fixed-layout float array (see
+    POWER_FIELDS) rather than one attribute each. They are still readable by
+    name, e.g. sample.wNow, and the array itself is exposed as values so that
+    sinks and history buffers can use it without copying.
+    """
 
-    # Historical measurements (Lifetime)
-    whLifetime: float
-    vahLifetime: float
-    varhLagLifetime: float
-    varhLeadLifetime: float
+    __slots__ = ("ts", "values")
 
-    # Historical measurements (Other)
-    whLastSevenDays: float
+    def __init__(self, ts: datetime, values: array) -> None:
+        self.ts = ts
+        self.values = values
 
     @staticmethod
     def create(power_data: Dict[str, float], ts: datetime) -> PowerSample:
         return PowerSample(
-            ts=ts,
-            # Instantaneous measurements
-            wNow=power_data["wNow"],
-            rmsCurrent=power_data["rmsCurrent"],
-            rmsVoltage=power_data["rmsVoltage"],
-            reactPwr=power_data["reactPwr"],
-            apprntPwr=power_data["apprntPwr"],
-            # Historical measurements (Today)
-            whToday=power_data["whToday"],
-            vahToday=power_data["vahToday"],
-            varhLagToday=power_data["varhLagToday"],
-            varhLeadToday=power_data["varhLeadToday"],
-            # Historical measurements (Lifetime)
-            whLifetime=power_data["whLifetime"],
-            vahLifetime=power_data["vahLifetime"],
-            varhLagLifetime=power_data["varhLagLifetime"],
-            varhLeadLifetime=power_data["varhLeadLifetime"],
-            # Historical measurements (Other)
-            whLastSevenDays=power_data["whLastSevenDays"],
+            ts=ts, values=array("d", map(power_data.__getitem__, POWER_FIELDS))
         )
 
+    def items(self) -> Iterator[Tuple[str, float]]:
+        return zip(POWER_FIELDS, self.values)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PowerSample):
+            return NotImplemented
+        return self.ts == other.ts and self.values == other.values
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={value}" for name, value in self.items())
+        return f"PowerSample(ts={self.ts!r}, {fields})"
+
     def __str__(self) -> str:
-        return json.dumps(asdict(self), indent=1, default=str)
+        return json.dumps(self.asdict(), indent=1, default=str)
 
     def asdict(self) -> Dict[str, Any]:
-        return asdict(self)
+        return {"ts": self.ts, **dict(self.items())}
 
     @property
     def pwrFactor(self) -> float:
@@ -77,7 +85,15 @@ class PowerSample:
         return self.wNow / self.apprntPwr
 
 
-@dataclass(frozen=True)
+def _power_field(index: int) -> property:
+    return property(lambda self: self.values[index])
+
+
+for _index, _name in enumerate(POWER_FIELDS):
+    setattr(PowerSample, _name, _power_field(_index))
+
+
+@dataclass(frozen=True, slots=True)
 class SampleData:
     net_consumption: Optional[EIMSample]
     total_consumption: Optional[EIMSample]
@@ -89,7 +105,10 @@ class SampleData:
         total_consumption: Optional[EIMSample] = EIMSample.create()
         total_production: Optional[EIMSample] = EIMSample.create()
 
-        LOG.debug(f"Creating sample data from: {json.dumps(sample_data, indent=2)}")
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug(
+                "Creating sample data from: %s", json.dumps(sample_data, indent=2)
+            )
 
         if "consumption" in sample_data:
             for consumption_data in sample_data["consumption"]:
@@ -115,10 +134,20 @@ class SampleData:
         )
 
     def __str__(self) -> str:
-        return json.dumps(asdict(self), indent=1, default=str)
+        return json.dumps(self.asdict(), indent=1, default=str)
+
+    def asdict(self) -> Dict[str, Any]:
+        return {
+            name: eim_sample.asdict() if eim_sample is not None else None
+            for name, eim_sample in (
+                ("net_consumption", self.net_consumption),
+                ("total_consumption", self.total_consumption),
+                ("total_production", self.total_production),
+            )
+        }
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class EIMSample:
     """
     "EIM" measurement.
@@ -149,10 +178,17 @@ class EIMSample:
         )
 
     def __str__(self) -> str:
-        return json.dumps(asdict(self), indent=1, default=str)
+        return json.dumps(self.asdict(), indent=1, default=str)
+
+    def asdict(self) -> Dict[str, Any]:
+        return {
+            "eim_line_samples": [
+                line_sample.asdict() for line_sample in self.eim_line_samples
+            ]
+        }
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class InverterSample:
     ts: datetime
     serial: str
@@ -173,29 +209,190 @@ class InverterSample:
         return asdict(self)
 
 
-def parse_inverter_data(data) -> Dict[str, InverterSample]:
+class SerialIndex:
     """
-    Parse inverter JSON list and return a dictionary of inverter samples, keyed
-    by their serial number.
+    Assigns every inverter serial number a stable slot, in the order they were
+    first seen. The slot is the position of the inverter in the arrays of an
+    InverterData.
     """
-    inverters = {}
+
+    __slots__ = ("serials", "_slots")
+
+    def __init__(self) -> None:
+        self.serials: List[str] = []
+        self._slots: Dict[str, int] = {}
+
+    def slot(self, serial: str) -> int:
+        slot = self._slots.get(serial)
+        if slot is None:
+            slot = self._slots[serial] = len(self.serials)
+            self.serials.append(serial)
+        return slot
+
+    def get(self, serial: str) -> Optional[int]:
+        return self._slots.get(serial)
+
+    def __len__(self) -> int:
+        return len(self.serials)
+
+
+class InverterData(Mapping):
+    """
+    The inverter reports of one sampling cycle, as a struct of arrays.
+
+    ts (report time in epoch seconds) and watts are indexed by the slot of each
+    serial in a SerialIndex that is shared between cycles, so an inverter keeps
+    its position from one cycle to the next. Inverters without a report in this
+    cycle have a NaN ts.
+
+    When slots is set, only the inverters in those slots are part of the data.
+    This lets a subset share the arrays of the full data, and be iterated
+    without walking every inverter.
+
+    When changed is set, it holds the slots whose report differs from that of
+    the previous cycle. Only those can hold new reports, so filtering them does
+    not walk every inverter either.
+
+    rows() is the zero-copy way to read the reports. The mapping interface,
+    keyed by serial, builds an InverterSample per lookup and is meant for
+    convenience only.
+    """
+
+    __slots__ = ("index", "ts", "watts", "slots", "changed")
+
+    def __init__(
+        self,
+        index: SerialIndex,
+        ts: array,
+        watts: array,
+        slots: Optional[List[int]] = None,
+        changed: Optional[List[int]] = None,
+    ) -> None:
+        self.index = index
+        self.ts = ts
+        self.watts = watts
+        self.slots = slots
+        self.changed = changed
+
+    def iter_slots(self) -> Iterator[int]:
+        """
+        Iterate the slots of every inverter that reported.
+        """
+        if self.slots is not None:
+            return iter(self.slots)
+        return (slot for slot, ts in enumerate(self.ts) if ts == ts)  # Not NaN
+
+    def rows(self) -> Iterator[Tuple[str, float, float]]:
+        """
+        Iterate the (serial, ts, watts) of every inverter that reported.
+        """
+        serials = self.index.serials
+        ts = self.ts
+        watts = self.watts
+        for slot in self.iter_slots():
+            yield serials[slot], ts[slot], watts[slot]
+
+    def __getitem__(self, serial: str) -> InverterSample:
+        slot = self.index.get(serial)
+        if slot is None or slot >= len(self.ts) or math.isnan(self.ts[slot]):
+            raise KeyError(serial)
+        if self.slots is not None and slot not in self.slots:
+            raise KeyError(serial)
+        return InverterSample(
+            ts=datetime.fromtimestamp(self.ts[slot], tz=timezone.utc),
+            serial=serial,
+            watts=self.watts[slot],
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        for serial, _, _ in self.rows():
+            yield serial
+
+    def __len__(self) -> int:
+        if self.slots is not None:
+            return len(self.slots)
+        return sum(1 for ts in self.ts if ts == ts)
+
+    def __repr__(self) -> str:
+        return f"InverterData({dict(self)!r})"
+
+
+def parse_inverter_data(
+    data,
+    index: Optional[SerialIndex] = None,
+    previous: Optional[InverterData] = None,
+) -> InverterData:
+    """
+    Parse inverter JSON list and return the inverter samples as an InverterData.
+
+    Pass the index of the previous cycles so that serials keep their slots, and
+    the data of the previous cycle to have the changed slots noted.
+    """
+    if index is None:
+        index = SerialIndex()
 
     for inverter_data in data:
-        inverter = InverterSample.create(inverter_data)
-        inverters[inverter.serial] = inverter
+        index.slot(inverter_data["serialNumber"])
+
+    ts = array("d", [NAN]) * len(index)
+    watts = array("d", bytes(ts.itemsize * len(index)))
+    changed = ChangedSlots(previous)
+    for inverter_data in data:
+        slot = index.slot(inverter_data["serialNumber"])
+        ts[slot] = inverter_data["lastReportDate"]
+        watts[slot] = inverter_data["lastReportWatts"]
+        changed.check(slot, ts[slot])
+
+    return InverterData(index, ts, watts, changed=changed.slots)
+
 
-    return inverters
+class ChangedSlots:
+    """
+    Notes the slots whose report differs from that of the previous cycle, while
+    a payload is decoded.
+    """
+
+    __slots__ = ("_previous_ts", "slots")
+
+    def __init__(self, previous: Optional[InverterData]) -> None:
+        self._previous_ts = previous.ts if previous is not None else None
+        self.slots: Optional[List[int]] = [] if previous is not None else None
+
+    def check(self, slot: int, report_ts: float) -> None:
+        previous_ts = self._previous_ts
+        if previous_ts is None:
+            return
+        # Inverters that were not known yet are new
+        if slot >= len(previous_ts) or previous_ts[slot] != report_ts:
+            self.slots.append(slot)
 
 
 def filter_new_inverter_data(
-    inverter_data: Dict[str, InverterSample], last_sample_timestamp: Optional[datetime]
-) -> Dict[str, InverterSample]:
+    inverter_data: InverterData, last_reports: Dict[str, float]
+) -> InverterData:
     """
     Inverter measurements only update if inverter actually sends a reported value.
-    """
-    filtered_inverter_data: Dict[str, InverterSample] = {}
-    for serial, inverter_sample in inverter_data.items():
-        if last_sample_timestamp and inverter_sample.ts > last_sample_timestamp:
-            filtered_inverter_data[serial] = inverter_sample
 
-    return filtered_inverter_data
+    last_reports holds the lastReportDate of the last report that was kept for
+    each serial, and is updated with the new reports. Only the envoy's own
+    timestamps are compared, so every report is kept exactly once regardless of
+    the local clock. The result shares the arrays of inverter_data.
+
+    When the changed slots of inverter_data are known, only those are checked.
+    """
+    serials = inverter_data.index.serials
+    ts = inverter_data.ts
+
+    slots = inverter_data.changed
+    if slots is None:
+        slots = inverter_data.iter_slots()
+
+    new_slots = []
+    for slot in slots:
+        serial = serials[slot]
+        report_ts = ts[slot]
+        if report_ts > last_reports.get(serial, -math.inf):
+            last_reports[serial] = report_ts
+            new_slots.append(slot)
+
+    return InverterData(inverter_data.index, ts, inverter_data.watts, new_slots)
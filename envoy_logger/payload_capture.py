@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Dict
+
+LOG = logging.getLogger("payload_capture")
+
+
+class PayloadCapture:
+    """
+    Writes every Nth raw payload received from an envoy endpoint to a rotating
+    file, one JSON document per line.
+
+    This gives visibility into what the envoy sends without the cost of
+    serializing every payload, which is what DEBUG logging would do.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        every: int = 100,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+    ) -> None:
+        self.path = path
+        self.every = max(1, every)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._handler = RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+
+        # Counted per envoy and endpoint, so each of them gets captured at the same rate
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def record(self, source: str, endpoint: str, content: bytes) -> None:
+        key = f"{source} {endpoint}"
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every != 0:
+            return
+
+        line = json.dumps(
+            {
+                "ts": time.time(),
+                "source": source,
+                "endpoint": endpoint,
+                # Only the captured payloads are decoded
+                "payload": json.loads(content),
+            },
+            separators=(",", ":"),
+        )
+
+        # The handler takes care of rotation. handle() holds its lock while writing,
+        # so captures from several envoys neither interleave nor race a rollover
+        self._handler.handle(
+            logging.LogRecord(LOG.name, logging.DEBUG, "", 0, line, None, None)
+        )
+
+    def close(self) -> None:
+        self._handler.close()
@@ -0,0 +1,190 @@
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from envoy_logger.config import Config
+from envoy_logger.model import POWER_FIELDS, InverterData, SampleData
+
+# Labeled metric families of the EIM lines: (name, documentation, PowerSample field)
+LINE_METRICS = (
+    ("envoy_line_power_watts", "True power of an envoy line", "wNow"),
+    ("envoy_line_current_amps", "RMS current of an envoy line", "rmsCurrent"),
+    ("envoy_line_voltage_volts", "RMS voltage of an envoy line", "rmsVoltage"),
+    ("envoy_line_reactive_power_var", "Reactive power of an envoy line", "reactPwr"),
+    ("envoy_line_apparent_power_va", "Apparent power of an envoy line", "apprntPwr"),
+)
+LINE_LABELS = ["type", "line", "source"]
+
+INVERTER_POWER_METRIC = (
+    "envoy_inverter_power_watts",
+    "Power reported by an envoy inverter",
+)
+
+LAST_SAMPLE_METRIC = (
+    "envoy_last_successful_sample_timestamp_seconds",
+    "When the last sample of an envoy was successfully collected",
+)
+
+
+class InverterLabels:
+    """
+    Labels of the inverter series: serial, source, and the tags of the inverter
+    from the config.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.tag_names = [
+            name
+            for name in config.inverter_tag_names()
+            if label_name(name) not in ("serial", "source")
+        ]
+        self.names = ["serial", "source"] + [
+            label_name(name) for name in self.tag_names
+        ]
+
+    def values(self, serial: str, source_tag: str) -> List[str]:
+        inverter = self.config.inverters.get(serial)
+        tags = inverter.tags if inverter is not None else {}
+        return [serial, source_tag] + [
+            str(tags.get(name, "")) for name in self.tag_names
+        ]
+
+
+class SnapshotCollector:
+    """
+    Holds the latest samples of every envoy, and only turns them into metrics
+    when /metrics is scraped.
+
+    Updating the snapshot every cycle is cheap, and nothing is rendered while
+    nobody scrapes. The rendered metrics are cached for cache_seconds, so
+    concurrent scrapers (e.g. several Prometheus replicas) share one render.
+
+    With timestamps, the samples carry the readingTime of the line or the
+    lastReportDate of the inverter, so Prometheus stops returning them once
+    the envoy stops answering. Inverters that have not reported for
+    inverter_stale_seconds are dropped from the snapshot.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        cache_seconds: float = 1.0,
+        timestamps: bool = False,
+        inverter_stale_seconds: Optional[float] = None,
+    ) -> None:
+        self.cache_seconds = cache_seconds
+        self.timestamps = timestamps
+        self.inverter_stale_seconds = inverter_stale_seconds
+        self.inverter_labels = InverterLabels(config)
+
+        # Guards the snapshot
+        self._lock = threading.Lock()
+        self._power_data: Dict[str, SampleData] = {}
+        self._inverter_data: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        self._last_success: Dict[str, float] = {}
+
+        # Guards the render cache, so only one scraper renders at a time
+        self._render_lock = threading.Lock()
+        self._rendered: Optional[List[Metric]] = None
+        self._rendered_at = 0.0
+
+    def update(
+        self, source_tag: str, sample_data: SampleData, inverter_data: InverterData
+    ) -> None:
+        # Only the inverters that reported this cycle are in inverter_data
+        reports = {serial: (ts, watts) for serial, ts, watts in inverter_data.rows()}
+
+        with self._lock:
+            self._power_data[source_tag] = sample_data
+            self._inverter_data.setdefault(source_tag, {}).update(reports)
+            self._last_success[source_tag] = time.time()
+
+    def describe(self) -> List[Metric]:
+        # The series depend on the samples, so there is nothing to describe up front.
+        # This also keeps the registry from rendering the snapshot on registration.
+        return []
+
+    def collect(self) -> Iterator[Metric]:
+        with self._render_lock:
+            now = time.monotonic()
+            if self._rendered is None or now - self._rendered_at >= self.cache_seconds:
+                self._rendered = self._render()
+                self._rendered_at = now
+            rendered = self._rendered
+
+        return iter(rendered)
+
+    def _render(self) -> List[Metric]:
+        with self._lock:
+            if self.inverter_stale_seconds is not None:
+                self._drop_stale_inverters(time.time() - self.inverter_stale_seconds)
+            power_data = dict(self._power_data)
+            last_success = dict(self._last_success)
+            inverter_data = {
+                source_tag: dict(reports)
+                for source_tag, reports in self._inverter_data.items()
+            }
+
+        line_families = [
+            (
+                GaugeMetricFamily(name, documentation, labels=LINE_LABELS),
+                POWER_FIELDS.index(field),
+            )
+            for name, documentation, field in LINE_METRICS
+        ]
+        for source_tag, sample_data in power_data.items():
+            for measurement_type, eim_sample in (
+                ("net_consumption", sample_data.net_consumption),
+                ("total_consumption", sample_data.total_consumption),
+                ("total_production", sample_data.total_production),
+            ):
+                if eim_sample is None:
+                    continue
+                for line_index, line_sample in enumerate(eim_sample.eim_line_samples):
+                    labels = [measurement_type, str(line_index), source_tag]
+                    timestamp = line_sample.ts.timestamp() if self.timestamps else None
+                    for family, field_index in line_families:
+                        family.add_metric(
+                            labels, line_sample.values[field_index], timestamp
+                        )
+
+        inverter_family = GaugeMetricFamily(
+            *INVERTER_POWER_METRIC, labels=self.inverter_labels.names
+        )
+        for source_tag, reports in inverter_data.items():
+            for serial, (ts, watts) in reports.items():
+                inverter_family.add_metric(
+                    self.inverter_labels.values(serial, source_tag),
+                    watts,
+                    ts if self.timestamps else None,
+                )
+
+        last_sample_family = GaugeMetricFamily(*LAST_SAMPLE_METRIC, labels=["source"])
+        for source_tag, ts in last_success.items():
+            last_sample_family.add_metric([source_tag], ts)
+
+        return [family for family, _ in line_families] + [
+            inverter_family,
+            last_sample_family,
+        ]
+
+    def _drop_stale_inverters(self, oldest: float) -> None:
+        # Called with the snapshot lock held
+        for reports in self._inverter_data.values():
+            for serial in [
+                serial for serial, (ts, _) in reports.items() if ts < oldest
+            ]:
+                del reports[serial]
+
+
+def label_name(name: str) -> str:
+    # Prometheus label names may only contain letters, digits and underscores, and
+    # may not start with a digit
+    name = re.sub(r"[^a-zA-Z0-9_]", "_", str(name))
+    if name[:1].isdigit():
+        name = f"_{name}"
+    return name
@@ -1,70 +1,135 @@
 import logging
-from typing import Any, Dict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple, Union
 
-from prometheus_client import Gauge, Info, start_http_server
+from prometheus_client import REGISTRY, Gauge, Info, start_http_server
 
 from envoy_logger.config import Config
 from envoy_logger.envoy import Envoy
-from envoy_logger.model import InverterSample, PowerSample, SampleData
+from envoy_logger.internal_metrics import (
+    POINT_BUILD_SECONDS,
+    observe_freshness,
+    timed,
+)
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.model import POWER_FIELDS, InverterData, PowerSample, SampleData
+from envoy_logger.prometheus_collector import (
+    INVERTER_POWER_METRIC,
+    LAST_SAMPLE_METRIC,
+    LINE_LABELS,
+    LINE_METRICS,
+    InverterLabels,
+    SnapshotCollector,
+)
 from envoy_logger.sampling_engine import SamplingEngine
+from envoy_logger.sink import Sink
 
 LOG = logging.getLogger("prometheus_sampling_engine")
 
 
-class PrometheusSamplingEngine(SamplingEngine):
+class PrometheusSink(Sink):
     prometheus_info: Dict[str, Info] = {}
     prometheus_gauges: Dict[str, Gauge] = {}
+    prometheus_collector: Optional[SnapshotCollector] = None
 
-    def __init__(self, envoy: Envoy, config: Config, interval_seconds: int = 5) -> None:
-        super().__init__(envoy=envoy, interval_seconds=interval_seconds)
-
+    def __init__(self, config: Config) -> None:
         self.config = config
 
-        start_http_server(config.prometheus_listening_port)
-        LOG.info(f"Listening on port {config.prometheus_listening_port}")
+        # In labeled mode, the gauge of each series is looked up once and then reused
+        self.labeled = config.prometheus_metrics == "labeled"
+        self._line_children: Dict[Tuple[str, int, str], List[Tuple[Gauge, int]]] = {}
+        self._inverter_children: Dict[Tuple[str, str], Gauge] = {}
+        if self.labeled:
+            self._inverter_labels = InverterLabels(config)
 
-    def run(self) -> None:
-        while True:
-            self.wait_for_next_cycle()
+        # The legacy metrics of a single envoy keep their original, unlabeled series
+        self._legacy_labelnames = ["source"] if len(config.envoys) > 1 else []
 
-            power_data, inverter_data = self.collect_samples_with_retry()
+        # In snapshot mode, samples are only kept, and rendered when scraped
+        self.collector: Optional[SnapshotCollector] = None
+        if config.prometheus_metrics == "snapshot":
+            self.collector = self._get_prometheus_collector(config)
 
-            self._update_power_data_info(sample_data=power_data)
-            self._update_inverter_data_info(inverter_data=inverter_data)
+        start_http_server(config.prometheus_listening_port)
+        LOG.info(f"Listening on port {config.prometheus_listening_port}")
+
+    def publish(
+        self,
+        source_tag: str,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+    ) -> None:
+        with timed(POINT_BUILD_SECONDS.labels(sink="prometheus")):
+            if self.collector is not None:
+                self.collector.update(source_tag, sample_data, inverter_data)
+            else:
+                self._update_power_data_info(
+                    sample_data=sample_data, source_tag=source_tag
+                )
+                self._update_inverter_data_info(
+                    inverter_data=inverter_data, source_tag=source_tag
+                )
+                self._get_prometheus_gauge(
+                    *LAST_SAMPLE_METRIC, labelnames=["source"]
+                ).labels(source=source_tag).set_to_current_time()
+
+        observe_freshness("prometheus", sample_data)
+
+    def _update_power_data_info(
+        self, sample_data: SampleData, source_tag: Optional[str] = None
+    ) -> None:
+        source_tag = source_tag or self.config.source_tag
 
-    def _update_power_data_info(self, sample_data: SampleData) -> None:
         if sample_data.net_consumption:
             for line_index, line_sample in enumerate(
                 sample_data.net_consumption.eim_line_samples
             ):
-                self._update_line_sample("net_consumption", line_index, line_sample)
+                self._update_line_sample(
+                    "net_consumption", line_index, line_sample, source_tag
+                )
 
         if sample_data.total_consumption:
             for line_index, line_sample in enumerate(
                 sample_data.total_consumption.eim_line_samples
             ):
-                self._update_line_sample("total_consumption", line_index, line_sample)
+                self._update_line_sample(
+                    "total_consumption", line_index, line_sample, source_tag
+                )
 
         if sample_data.total_production:
             for line_index, line_sample in enumerate(
                 sample_data.total_production.eim_line_samples
             ):
-                self._update_line_sample("total_production", line_index, line_sample)
+                self._update_line_sample(
+                    "total_production", line_index, line_sample, source_tag
+                )
 
     def _update_line_sample(
-        self, measurement_type: str, line_index: int, line_sample: PowerSample
+        self,
+        measurement_type: str,
+        line_index: int,
+        line_sample: PowerSample,
+        source_tag: str,
     ) -> None:
+        if self.labeled:
+            self._update_labeled_line_sample(
+                measurement_type, line_index, line_sample, source_tag
+            )
+            return
+
         prometheus_info = self._get_prometheus_info(
             f"envoy_{measurement_type}", f"Envoy {measurement_type} samples."
         )
 
-        prometheus_info.info(
-            _convert_to_info_dict({"line": line_index} | line_sample.asdict())
-        )
+        info = {"line": str(line_index), "ts": str(line_sample.ts)}
+        for name, value in line_sample.items():
+            info[name] = str(value)
+        self._legacy_child(prometheus_info, source_tag).info(info)
 
         self._update_prometheus_line_sample_gauge(
             measurement_type=measurement_type,
             line_index=line_index,
+            source_tag=source_tag,
             measurement_name="true_power",
             value=line_sample.wNow,
         )
@@ -72,6 +137,7 @@ class PrometheusSamplingEngine(SamplingEngine):
         self._update_prometheus_line_sample_gauge(
             measurement_type=measurement_type,
             line_index=line_index,
+            source_tag=source_tag,
             measurement_name="rms_current",
             value=line_sample.rmsCurrent,
         )
@@ -79,6 +145,7 @@ class PrometheusSamplingEngine(SamplingEngine):
         self._update_prometheus_line_sample_gauge(
             measurement_type=measurement_type,
             line_index=line_index,
+            source_tag=source_tag,
             measurement_name="rms_voltage",
             value=line_sample.rmsVoltage,
         )
@@ -86,6 +153,7 @@ class PrometheusSamplingEngine(SamplingEngine):
         self._update_prometheus_line_sample_gauge(
             measurement_type=measurement_type,
             line_index=line_index,
+            source_tag=source_tag,
             measurement_name="reactive_power",
             value=line_sample.reactPwr,
         )
@@ -93,6 +161,7 @@ class PrometheusSamplingEngine(SamplingEngine):
         self._update_prometheus_line_sample_gauge(
             measurement_type=measurement_type,
             line_index=line_index,
+            source_tag=source_tag,
             measurement_name="apparent_power",
             value=line_sample.apprntPwr,
         )
@@ -103,6 +172,7 @@ class PrometheusSamplingEngine(SamplingEngine):
             prometheus_info = Info(
                 name=name,
                 documentation=documentation,
+                labelnames=self._legacy_labelnames,
             )
 
         self.prometheus_info[name] = prometheus_info
@@ -113,6 +183,7 @@ class PrometheusSamplingEngine(SamplingEngine):
         self,
         measurement_type: str,
         line_index: int,
+        source_tag: str,
         measurement_name: str,
         value: float,
     ) -> None:
@@ -121,14 +192,45 @@ class PrometheusSamplingEngine(SamplingEngine):
             documentation=f"Envoy {measurement_type} {measurement_name} samples for line{line_index}",
         )
 
-        prometheus_gauge.set(value)
+        self._legacy_child(prometheus_gauge, source_tag).set(value)
 
-    def _get_prometheus_gauge(self, name: str, documentation: str) -> Gauge:
+    def _update_labeled_line_sample(
+        self,
+        measurement_type: str,
+        line_index: int,
+        line_sample: PowerSample,
+        source_tag: str,
+    ) -> None:
+        key = (measurement_type, line_index, source_tag)
+        children = self._line_children.get(key)
+        if children is None:
+            children = self._line_children[key] = [
+                (
+                    self._get_prometheus_gauge(
+                        name, documentation, labelnames=LINE_LABELS
+                    ).labels(
+                        type=measurement_type, line=str(line_index), source=source_tag
+                    ),
+                    POWER_FIELDS.index(field),
+                )
+                for name, documentation, field in LINE_METRICS
+            ]
+
+        values = line_sample.values
+        for child, field_index in children:
+            child.set(values[field_index])
+
+    def _get_prometheus_gauge(
+        self, name: str, documentation: str, labelnames: Optional[List[str]] = None
+    ) -> Gauge:
         prometheus_gauge = self.prometheus_gauges.get(name)
         if not prometheus_gauge:
             prometheus_gauge = Gauge(
                 name=name,
                 documentation=documentation,
+                labelnames=(
+                    self._legacy_labelnames if labelnames is None else labelnames
+                ),
             )
 
         self.prometheus_gauges[name] = prometheus_gauge
@@ -136,30 +238,75 @@ class PrometheusSamplingEngine(SamplingEngine):
         return prometheus_gauge
 
     def _update_inverter_data_info(
-        self, inverter_data: Dict[str, InverterSample]
+        self,
+        inverter_data: InverterData,
+        source_tag: Optional[str] = None,
     ) -> None:
-        for serial, inverter_sample in inverter_data.items():
-            self._update_inverter_sample(serial, inverter_sample)
+        source_tag = source_tag or self.config.source_tag
+
+        for serial, ts, watts in inverter_data.rows():
+            self._update_inverter_sample(serial, ts, watts, source_tag)
 
     def _update_inverter_sample(
-        self, serial: str, inverter_sample: InverterSample
+        self, serial: str, ts: float, watts: float, source_tag: str
     ) -> None:
+        if self.labeled:
+            self._update_labeled_inverter_sample(serial, watts, source_tag)
+            return
+
         prometheus_info = self._get_prometheus_info(
             "envoy_inverter_sample", "Envoy inverter data."
         )
 
-        prometheus_info.info(_convert_to_info_dict(inverter_sample.asdict()))
+        self._legacy_child(prometheus_info, source_tag).info(
+            {
+                "ts": str(datetime.fromtimestamp(ts, tz=timezone.utc)),
+                "serial": serial,
+                "watts": str(watts),
+            }
+        )
 
         self._update_prometheus_inverter_gauge(
             measurement_name="power",
-            serial=inverter_sample.serial,
-            value=inverter_sample.watts,
+            serial=serial,
+            source_tag=source_tag,
+            value=watts,
         )
 
+    def _update_labeled_inverter_sample(
+        self, serial: str, watts: float, source_tag: str
+    ) -> None:
+        key = (serial, source_tag)
+        child = self._inverter_children.get(key)
+        if child is None:
+            gauge = self._get_prometheus_gauge(
+                *INVERTER_POWER_METRIC, labelnames=self._inverter_labels.names
+            )
+            child = self._inverter_children[key] = gauge.labels(
+                *self._inverter_labels.values(serial, source_tag)
+            )
+
+        child.set(watts)
+
+    @classmethod
+    def _get_prometheus_collector(cls, config: Config) -> SnapshotCollector:
+        # Like the gauges, the collector is registered once per process
+        if cls.prometheus_collector is None:
+            cls.prometheus_collector = SnapshotCollector(
+                config,
+                cache_seconds=config.prometheus_render_cache_seconds,
+                timestamps=config.prometheus_sample_timestamps,
+                inverter_stale_seconds=config.prometheus_inverter_stale_seconds,
+            )
+            REGISTRY.register(cls.prometheus_collector)
+
+        return cls.prometheus_collector
+
     def _update_prometheus_inverter_gauge(
         self,
         measurement_name: str,
         serial: str,
+        source_tag: str,
         value: float,
     ) -> None:
         prometheus_gauge = self._get_prometheus_gauge(
@@ -167,8 +314,43 @@ class PrometheusSamplingEngine(SamplingEngine):
             documentation=f"Envoy inverter {measurement_name} for SN#{serial} samples",
         )
 
-        prometheus_gauge.set(value)
+        self._legacy_child(prometheus_gauge, source_tag).set(value)
 
+    def _legacy_child(
+        self, metric: Union[Gauge, Info], source_tag: str
+    ) -> Union[Gauge, Info]:
+        if self._legacy_labelnames:
+            return metric.labels(source=source_tag)
+        return metric
+
+
+class PrometheusSamplingEngine(SamplingEngine, PrometheusSink):
+    def __init__(
+        self,
+        envoy: Envoy,
+        config: Config,
+        interval_seconds: int = 5,
+        overrun_policy: str = "skip",
+        adaptive_inverter_polling: bool = False,
+        inverter_max_interval: float = 300.0,
+        inverter_reports: Optional[InverterReportIndex] = None,
+    ) -> None:
+        SamplingEngine.__init__(
+            self,
+            envoy=envoy,
+            interval_seconds=interval_seconds,
+            concurrent=config.sampling_concurrent,
+            overrun_policy=overrun_policy,
+            adaptive_inverter_polling=adaptive_inverter_polling,
+            inverter_max_interval=inverter_max_interval,
+            inverter_reports=inverter_reports,
+        )
+        PrometheusSink.__init__(self, config=config)
+
+    def run(self) -> None:
+        while True:
+            self.wait_for_next_cycle()
+
+            power_data, inverter_data = self.collect_samples_with_retry()
 
-def _convert_to_info_dict(any_dict: Dict[str, Any]) -> Dict[str, str]:
-    return {key: str(val) for key, val in any_dict.items()}
+            self.publish(self.config.source_tag, power_data, inverter_data)
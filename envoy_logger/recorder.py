@@ -0,0 +1,176 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+LOG = logging.getLogger("recorder")
+
+RECORDING_SUFFIX = ".jsonl.gz"
+
+# strftime patterns of the recording files, relative to the recordings directory
+PARTITIONS = {
+    "hour": os.path.join("%Y-%m-%d", "%H.jsonl.gz"),
+    "day": "%Y-%m-%d.jsonl.gz",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Recording:
+    # When the payload was received, in epoch seconds
+    ts: float
+    # Tag of the envoy the payload was received from
+    source: str
+    # production or inverters
+    endpoint: str
+    # Raw response body
+    payload: bytes
+
+
+class PayloadRecorder:
+    """
+    Appends every raw payload received from the envoys to gzip compressed
+    files, partitioned by the hour (or day) it was received in, in UTC.
+
+    Each line holds a small JSON header and the raw payload, separated by a
+    tab, so replaying a recording decodes the payload exactly like a live
+    response.
+
+    Existing files are never appended to, since their last gzip member has no
+    trailer if the recorder was not stopped cleanly. A restart within the same
+    partition writes to a numbered file next to it instead, e.g. 13.1.jsonl.gz.
+    """
+
+    def __init__(
+        self, path: str, partition: str = "hour", compress_level: int = 6
+    ) -> None:
+        if partition not in PARTITIONS:
+            raise ValueError(f"Unknown recording partition: {partition}")
+
+        self.path = path
+        self.pattern = PARTITIONS[partition]
+        self.compress_level = compress_level
+
+        # Shared by every envoy, so writes are serialized
+        self._lock = threading.Lock()
+        self._file: Optional[IO[bytes]] = None
+        # Path of the partition the open file belongs to, without any restart number
+        self._file_path: Optional[str] = None
+
+    def record(self, source: str, endpoint: str, content: bytes) -> None:
+        ts = time.time()
+        header = json.dumps(
+            {"ts": ts, "source": source, "endpoint": endpoint}, separators=(",", ":")
+        )
+        # Valid JSON never has a newline inside a string, so this keeps one payload per line
+        line = b"%s\t%s\n" % (header.encode(), content.replace(b"\n", b" "))
+
+        file_path = os.path.join(
+            self.path,
+            datetime.fromtimestamp(ts, tz=timezone.utc).strftime(self.pattern),
+        )
+        with self._lock:
+            try:
+                f = self._open(file_path)
+                f.write(line)
+                # Complete the gzip block, so a crash loses at most the payload being written
+                f.flush()
+            except OSError as e:
+                LOG.warning("Unable to record payload to %s: %s", file_path, e)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._file_path = None
+
+    def _open(self, file_path: str) -> IO[bytes]:
+        if file_path != self._file_path:
+            if self._file is not None:
+                self._file.close()
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            self._file = gzip.open(
+                _unused_path(file_path), "wb", compresslevel=self.compress_level
+            )
+            self._file_path = file_path
+
+        return self._file
+
+
+def _unused_path(file_path: str) -> str:
+    base = file_path[: -len(RECORDING_SUFFIX)]
+    restart = 0
+    while os.path.exists(file_path):
+        restart += 1
+        file_path = f"{base}.{restart}{RECORDING_SUFFIX}"
+    return file_path
+
+
+def find_recordings(paths: Iterable[str]) -> List[str]:
+    """
+    Expand directories into the recording files they contain, oldest first.
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+
+        # The partitions are named after their UTC time, so paths sort chronologically
+        files.extend(
+            sorted(
+                (
+                    os.path.join(dirpath, filename)
+                    for dirpath, _, filenames in os.walk(path)
+                    for filename in filenames
+                    if filename.endswith(RECORDING_SUFFIX)
+                ),
+                key=_recording_sort_key,
+            )
+        )
+
+    return files
+
+
+def _recording_sort_key(file: str) -> Tuple[str, str, int]:
+    # Files written after a restart follow the file of the same partition
+    directory, filename = os.path.split(file)
+    partition, _, restart = filename[: -len(RECORDING_SUFFIX)].partition(".")
+    return directory, partition, int(restart) if restart.isdigit() else 0
+
+
+def read_recordings(files: Iterable[str]) -> Iterator[Recording]:
+    for file in files:
+        try:
+            with gzip.open(file, "rb") as f:
+                for line in f:
+                    recording = _parse_line(file, line)
+                    if recording is not None:
+                        yield recording
+        except EOFError:
+            # The recorder was stopped in the middle of writing the last payload
+            LOG.warning("Recording %s is truncated", file)
+        except (OSError, zlib.error) as e:
+            # Such as a corrupt gzip member. The payloads before it were replayed
+            LOG.warning("Unable to read recording %s: %s", file, e)
+
+
+def _parse_line(file: str, line: bytes) -> Optional[Recording]:
+    try:
+        header, payload = line.rstrip(b"\n").split(b"\t", 1)
+        data = json.loads(header)
+        return Recording(
+            ts=float(data["ts"]),
+            source=data["source"],
+            endpoint=data["endpoint"],
+            payload=payload,
+        )
+    except (ValueError, KeyError) as e:
+        LOG.warning("Skipping malformed line of recording %s: %s", file, e)
+        return None
@@ -0,0 +1,154 @@
+import logging
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from envoy_logger.decoder import Decoder
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.model import (
+    InverterData,
+    SampleData,
+    SerialIndex,
+    parse_inverter_data,
+)
+from envoy_logger.recorder import Recording
+from envoy_logger.sink import Sink
+
+LOG = logging.getLogger("replay")
+
+
+@dataclass
+class ReplayStats:
+    payloads: int = 0
+    samples: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+
+
+class Replayer:
+    """
+    Streams recorded payloads through the model and into sinks, as fast as
+    the sinks accept them.
+
+    Each production payload is published as one sampling cycle, together with
+    the inverter reports recorded after it and before the next one, since the
+    sampling engines record a cycle in that order. Reports recorded before the
+    first production payload go with it. Like the sampling engines, every
+    inverter report is only published once, and a cycle holds one report per
+    inverter, so only the latest report of an inverter within a cycle is kept.
+    """
+
+    def __init__(
+        self,
+        sinks: List[Sink],
+        decoder: Decoder,
+        sources: Optional[Iterable[str]] = None,
+    ) -> None:
+        self.sinks = sinks
+        self.decoder = decoder
+        self.sources = set(sources) if sources else None
+
+        self.stats = ReplayStats()
+
+        # Per source
+        self._inverter_index: Dict[str, SerialIndex] = {}
+        self._inverter_reports: Dict[str, InverterReportIndex] = {}
+        # The cycle being assembled: its production sample and inverter reports
+        self._pending_sample_data: Dict[str, SampleData] = {}
+        self._pending_inverter_data: Dict[str, InverterData] = {}
+
+    def replay(self, recordings: Iterable[Recording]) -> ReplayStats:
+        start = time.monotonic()
+
+        for recording in recordings:
+            if recording.endpoint not in ("production", "inverters"):
+                continue
+            if self.sources is not None and recording.source not in self.sources:
+                continue
+
+            self.stats.payloads += 1
+            try:
+                self._replay_one(recording)
+            except Exception as e:
+                LOG.warning(
+                    "Skipping %s payload of %s recorded at %s: %s",
+                    recording.endpoint,
+                    recording.source,
+                    recording.ts,
+                    e,
+                )
+                self.stats.skipped += 1
+
+            if self.stats.payloads % 10000 == 0:
+                LOG.info("Replayed %d payloads", self.stats.payloads)
+
+        # The last cycle of each source
+        for source_tag in list(self._pending_sample_data):
+            self._publish_pending(source_tag)
+        self._pending_inverter_data.clear()
+
+        self.stats.seconds = time.monotonic() - start
+        return self.stats
+
+    def _replay_one(self, recording: Recording) -> None:
+        source_tag = recording.source
+
+        if recording.endpoint == "production":
+            sample_data = self.decoder.decode_power_data(recording.payload)
+            self._publish_pending(source_tag)
+            self._pending_sample_data[source_tag] = sample_data
+            return
+
+        inverter_data = self.decoder.decode_inverter_data(
+            recording.payload, self._get_inverter_index(source_tag)
+        )
+        inverter_data = self._get_inverter_reports(source_tag).filter_new(inverter_data)
+        if not inverter_data:
+            return
+
+        pending = self._pending_inverter_data.get(source_tag)
+        if pending is not None:
+            # Two inverter polls without a production payload in between
+            inverter_data = _merge_inverter_data(pending, inverter_data)
+        self._pending_inverter_data[source_tag] = inverter_data
+
+    def _publish_pending(self, source_tag: str) -> None:
+        sample_data = self._pending_sample_data.pop(source_tag, None)
+        if sample_data is None:
+            # Inverter reports before the first production payload wait for it
+            return
+
+        inverter_data = self._pending_inverter_data.pop(source_tag, None)
+        if inverter_data is None:
+            inverter_data = parse_inverter_data(
+                [], self._get_inverter_index(source_tag)
+            )
+        self._publish(source_tag, sample_data, inverter_data)
+
+    def _publish(
+        self, source_tag: str, sample_data: SampleData, inverter_data: InverterData
+    ) -> None:
+        for sink in self.sinks:
+            sink.publish(source_tag, sample_data, inverter_data)
+        self.stats.samples += 1
+
+    def _get_inverter_index(self, source_tag: str) -> SerialIndex:
+        return self._inverter_index.setdefault(source_tag, SerialIndex())
+
+    def _get_inverter_reports(self, source_tag: str) -> InverterReportIndex:
+        # Only kept in memory, so a replay does not affect the live sampling engines
+        return self._inverter_reports.setdefault(source_tag, InverterReportIndex())
+
+
+def _merge_inverter_data(older: InverterData, newer: InverterData) -> InverterData:
+    # Only one report per inverter fits in a cycle, so the newer one wins
+    ts = array("d", newer.ts)
+    watts = array("d", newer.watts)
+    slots = set(newer.iter_slots())
+    for slot in older.iter_slots():
+        if slot not in slots:
+            ts[slot] = older.ts[slot]
+            watts[slot] = older.watts[slot]
+            slots.add(slot)
+    return InverterData(newer.index, ts, watts, sorted(slots))
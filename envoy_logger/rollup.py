@@ -0,0 +1,133 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from envoy_logger.energy import MAX_GAP_SECONDS, EnergyAccumulator
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@dataclass
+class FieldStats:
+    min: float
+    max: float
+    sum: float
+    count: int
+    last: float
+
+    def add(self, value: float) -> None:
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count
+
+
+@dataclass
+class RollupWindow:
+    """
+    Aggregates of one series over one window of time.
+    """
+
+    start: int
+    fields: Dict[str, FieldStats] = field(default_factory=dict)
+    energy: EnergyAccumulator = field(default_factory=EnergyAccumulator)
+
+    def add(self, ts: float, values: Dict[str, float], power_field: str) -> None:
+        for name, value in values.items():
+            stats = self.fields.get(name)
+            if stats is None:
+                self.fields[name] = FieldStats(value, value, value, 1, value)
+            else:
+                stats.add(value)
+
+        if power_field in values:
+            self.energy.add(ts, values[power_field])
+
+
+@dataclass
+class RollupResult:
+    measurement_type: str
+    id: str
+    window: RollupWindow
+
+
+class RollupStage:
+    """
+    Streaming downsampler for one resolution.
+
+    Samples are aggregated in memory into fixed windows aligned to the epoch.
+    A window is complete once a sample for the same series arrives after the
+    window ends, at which point its min, max, mean, last and energy are
+    returned to be written.
+
+    Energy is not interpolated across gaps longer than max_gap seconds, such as
+    an outage, so the window after the gap is not credited with it.
+    """
+
+    def __init__(
+        self,
+        resolution_seconds: int,
+        bucket: str,
+        power_field: str = "P",
+        max_gap: float = MAX_GAP_SECONDS,
+    ):
+        self.resolution_seconds = resolution_seconds
+        self.bucket = bucket
+        self.power_field = power_field
+        self.max_gap = max_gap
+
+        self.interval_tag = format_duration(resolution_seconds)
+        self._windows: Dict[Tuple[str, str], RollupWindow] = {}
+
+    def add(
+        self, measurement_type: str, id: str, ts: float, values: Dict[str, float]
+    ) -> Optional[RollupResult]:
+        key = (measurement_type, str(id))
+        start = int(ts // self.resolution_seconds) * self.resolution_seconds
+
+        result = None
+        window = self._windows.get(key)
+        if window is None or start > window.start:
+            if window is not None:
+                result = RollupResult(measurement_type, str(id), window)
+                # Energy between the last sample and this one belongs to the new window
+                energy = window.energy.carry_over()
+            else:
+                energy = EnergyAccumulator(max_gap=self.max_gap)
+            new_window = RollupWindow(start=start, energy=energy)
+            window = self._windows[key] = new_window
+        elif start < window.start:
+            # Late sample for a window that has already been written
+            return None
+
+        window.add(ts, values, self.power_field)
+        return result
+
+
+def parse_duration(duration: str | int) -> int:
+    """
+    Parse a duration such as "30s", "1m", "15m" or "1h" into seconds.
+    """
+    if isinstance(duration, int):
+        return duration
+
+    match = re.fullmatch(r"(\d+)([smhd])", duration.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {duration}")
+
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def format_duration(seconds: int) -> str:
+    for unit, unit_seconds in sorted(
+        DURATION_UNITS.items(), key=lambda item: item[1], reverse=True
+    ):
+        if seconds % unit_seconds == 0:
+            return f"{seconds // unit_seconds}{unit}"
+
+    raise ValueError(f"Invalid duration: {seconds}")
@@ -2,13 +2,18 @@ import logging
 import sys
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, Optional
+from typing import Optional, Tuple
 
 from requests import ConnectTimeout, ReadTimeout
 
 from envoy_logger.envoy import Envoy
-from envoy_logger.model import InverterSample, SampleData, filter_new_inverter_data
+from envoy_logger.internal_metrics import SAMPLE_RETRIES
+from envoy_logger.inverter_poller import InverterPoller
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.model import InverterData, SampleData, parse_inverter_data
+from envoy_logger.scheduler import Scheduler
 
 LOG = logging.getLogger("sampling_engine")
 
@@ -16,43 +21,70 @@ LOG = logging.getLogger("sampling_engine")
 class SamplingEngine(ABC):
     last_sample_timestamp: Optional[datetime] = None
 
-    def __init__(self, envoy: Envoy, interval_seconds: int = 5) -> None:
+    def __init__(
+        self,
+        envoy: Envoy,
+        interval_seconds: int = 5,
+        concurrent: bool = False,
+        overrun_policy: str = "skip",
+        adaptive_inverter_polling: bool = False,
+        inverter_max_interval: float = 300.0,
+        inverter_reports: Optional[InverterReportIndex] = None,
+    ) -> None:
         self.envoy = envoy
         self.interval_seconds = interval_seconds
+        self.scheduler = Scheduler(
+            interval_seconds, overrun_policy=overrun_policy, source=str(envoy.tag)
+        )
+
+        # The last report emitted by each inverter
+        self.inverter_reports = inverter_reports or InverterReportIndex()
+
+        # When enabled, the inverters endpoint is only polled when reports are expected
+        self.inverter_poller: Optional[InverterPoller] = None
+        if adaptive_inverter_polling:
+            self.inverter_poller = InverterPoller(
+                min_interval=interval_seconds, max_interval=inverter_max_interval
+            )
+
+        # When enabled, the production and inverter endpoints are fetched in parallel
+        self.concurrent = concurrent
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if concurrent:
+            self._executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="sampling"
+            )
 
     @abstractmethod
     def run(self) -> None:
         pass
 
     def wait_for_next_cycle(self) -> None:
-        # Determine how long until the next sample needs to be taken
-        now = datetime.now(tz=timezone.utc)
-
-        time_to_next = self.interval_seconds - (now.timestamp() % self.interval_seconds)
-
         try:
-            time.sleep(time_to_next)
+            self.scheduler.wait()
         except KeyboardInterrupt:
             print("Exiting with Ctrl-C")
             sys.exit(0)
 
     def collect_samples_with_retry(
         self, retries: int = 10, wait_seconds: float = 5.0
-    ) -> SampleData | Dict[str, InverterSample]:
+    ) -> SampleData | InverterData:
         for retry_loop in range(retries):
             try:
-                power_data = self.get_power_data()
-                inverter_data = self.get_inverter_data()
+                power_data, inverter_data = self._collect_samples_once()
+                inverter_data = self._inverter_data_collected(inverter_data)
 
                 self.last_sample_timestamp = datetime.now(tz=timezone.utc)
 
-                LOG.debug(f"Sampled power data:\n{power_data}")
-                LOG.debug(f"Sampled inverter data:\n{inverter_data}")
+                # Formatted by the logger, so the samples are only serialized at DEBUG level
+                LOG.debug("Sampled power data:\n%s", power_data)
+                LOG.debug("Sampled inverter data:\n%s", inverter_data)
             except (ReadTimeout, ConnectTimeout):
                 # Envoy gets REALLY MAD if you block it's access to enphaseenergy.com using a VLAN.
                 # Its software gets hung up for some reason, and some requests will stall.
                 # Allow envoy requests to timeout (and skip this sample iteration)
                 LOG.warning("Envoy request timed out (%d/%d)", retry_loop + 1, retries)
+                SAMPLE_RETRIES.inc()
                 time.sleep(wait_seconds)
             else:
                 return power_data, inverter_data
@@ -60,9 +92,45 @@ class SamplingEngine(ABC):
         # If we got this far it means we've timed out, raise an exception
         raise TimeoutError("Sample collection timed out.")
 
+    def _collect_samples_once(self) -> Tuple[SampleData, Optional[InverterData]]:
+        if self._executor is None:
+            return self.get_power_data(), self.get_inverter_data()
+
+        power_future = self._executor.submit(self.get_power_data)
+        inverter_future = self._executor.submit(self.get_inverter_data)
+
+        # Wait for both requests before raising, so a failed cycle never leaves a
+        # request running into the next retry
+        power_exception = power_future.exception()
+        inverter_exception = inverter_future.exception()
+        if power_exception is not None:
+            raise power_exception
+        if inverter_exception is not None:
+            raise inverter_exception
+
+        return power_future.result(), inverter_future.result()
+
     def get_power_data(self) -> SampleData:
         return self.envoy.get_power_data()
 
-    def get_inverter_data(self) -> Dict[str, InverterSample]:
-        inverter_data = self.envoy.get_inverter_data()
-        return filter_new_inverter_data(inverter_data, self.last_sample_timestamp)
+    def get_inverter_data(self) -> Optional[InverterData]:
+        """
+        Return the unfiltered inverter data, or None when no reports are expected.
+        """
+        if self.inverter_poller is not None and not self.inverter_poller.due():
+            return None
+
+        return self.envoy.get_inverter_data()
+
+    def _inverter_data_collected(
+        self, inverter_data: Optional[InverterData]
+    ) -> InverterData:
+        # Only once both requests succeeded, so a retried cycle polls the inverters
+        # again and gets the same reports rather than losing them
+        if inverter_data is None:
+            return parse_inverter_data([])
+
+        if self.inverter_poller is not None:
+            self.inverter_poller.update(inverter_data)
+        self.envoy.commit_inverter_data()
+        return self.inverter_reports.filter_new(inverter_data)
@@ -0,0 +1,156 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from envoy_logger.internal_metrics import (
+    SCHEDULER_LATE_TICKS,
+    SCHEDULER_OVERRUNS,
+    SCHEDULER_SKIPPED_TICKS,
+)
+
+LOG = logging.getLogger("scheduler")
+
+OVERRUN_POLICIES = ("skip", "catch_up", "coalesce")
+
+
+@dataclass
+class SchedulerStats:
+    # Ticks that were run
+    ticks: int = 0
+    # Ticks that started more than late_tolerance seconds after their deadline,
+    # other than those run back to back to catch up after an overrun
+    late: int = 0
+    # Ticks that were never run because a cycle overran
+    skipped: int = 0
+    # Cycles that were still running when the next tick was due
+    overruns: int = 0
+
+
+class Scheduler:
+    """
+    Schedules sampling cycles every interval_seconds on the monotonic clock.
+
+    The first tick is aligned to a multiple of the interval on the wall clock,
+    after which wall clock adjustments no longer affect the cadence.
+
+    When a cycle runs past the next tick, the overrun policy decides what
+    happens to the ticks that were missed:
+      - skip: drop them, and wait for the next tick that is still in the future
+      - catch_up: run each of them back to back until the schedule is caught up
+        (at most max_backlog of them, any more are dropped)
+      - coalesce: run a single cycle straight away in place of all of them
+
+    The late, skipped and overrun counts are also exported as internal metrics,
+    labeled by source.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float,
+        overrun_policy: str = "skip",
+        late_tolerance: float = 0.5,
+        max_backlog: int = 10,
+        source: str = "envoy",
+    ) -> None:
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy: {overrun_policy}")
+
+        self.interval_seconds = interval_seconds
+        self.overrun_policy = overrun_policy
+        self.late_tolerance = late_tolerance
+        self.max_backlog = max_backlog
+
+        self.stats = SchedulerStats()
+        self._late = SCHEDULER_LATE_TICKS.labels(source=source)
+        self._skipped = SCHEDULER_SKIPPED_TICKS.labels(source=source)
+        self._overruns = SCHEDULER_OVERRUNS.labels(source=source)
+
+        # Monotonic deadline of the tick that was last handed out
+        self._current: Optional[float] = None
+        # Whether the ticks handed out are a backlog being caught up on
+        self._catching_up = False
+
+    def wait(self) -> None:
+        delay = self.next_delay()
+        if delay > 0:
+            time.sleep(delay)
+        self.tick_started()
+
+    def next_delay(self) -> float:
+        """
+        Advance to the next tick, and return how long to wait until it is due.
+        """
+        now = time.monotonic()
+
+        if self._current is None:
+            wall_offset = self.interval_seconds - (time.time() % self.interval_seconds)
+            self._current = now + wall_offset
+            self.stats.ticks += 1
+            return wall_offset
+
+        due = self._current + self.interval_seconds
+        if now < due:
+            self._current = due
+            self._catching_up = False
+            self.stats.ticks += 1
+            return due - now
+
+        # The previous cycle ran past this tick. Count every tick that is now due
+        overrun = now - due
+        missed = int(overrun // self.interval_seconds) + 1
+
+        if self._catching_up:
+            # Still working through the backlog of an overrun that was already counted
+            if missed > self.max_backlog:
+                dropped = missed - self.max_backlog
+                self._count_skipped(dropped)
+                due += dropped * self.interval_seconds
+            self._current = due
+            self.stats.ticks += 1
+            return 0.0
+
+        self.stats.overruns += 1
+        self._overruns.inc()
+
+        match self.overrun_policy:
+            case "skip":
+                self._count_skipped(missed)
+                self._current = due + missed * self.interval_seconds
+                delay = self._current - now
+            case "catch_up":
+                if missed > self.max_backlog:
+                    dropped = missed - self.max_backlog
+                    self._count_skipped(dropped)
+                    due += dropped * self.interval_seconds
+                self._current = due
+                self._catching_up = True
+                delay = 0.0
+            case "coalesce":
+                self._count_skipped(missed - 1)
+                self._current = due + (missed - 1) * self.interval_seconds
+                delay = 0.0
+
+        LOG.warning(
+            "Sampling cycle overran by %.1fs (%d ticks missed, policy: %s)",
+            overrun,
+            missed,
+            self.overrun_policy,
+        )
+
+        self.stats.ticks += 1
+        return delay
+
+    def tick_started(self) -> None:
+        """
+        Record that the cycle for the current tick has started.
+        """
+        lateness = time.monotonic() - self._current
+        if lateness > self.late_tolerance and not self._catching_up:
+            self.stats.late += 1
+            self._late.inc()
+            LOG.debug("Sampling cycle started %.1fs late", lateness)
+
+    def _count_skipped(self, count: int) -> None:
+        self.stats.skipped += count
+        self._skipped.inc(count)
@@ -0,0 +1,453 @@
+import base64
+import json
+import logging
+import math
+import os
+import random
+import secrets
+import ssl
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+LOG = logging.getLogger("simulator")
+
+# Peak power of a simulated inverter, in watts
+INVERTER_PEAK_WATTS = 300
+
+# Base load of the simulated house, in watts
+BASE_LOAD_WATTS = 500.0
+
+LINE_VOLTAGE = 120.0
+
+
+class EnvoySimulator:
+    """
+    Generates envoy payloads, and decides how each request misbehaves.
+
+    The inverters report every report_interval seconds, staggered so the
+    reports are spread over the interval, and the inverters payload stays
+    byte for byte the same between reports, like a real envoy. Production
+    follows the sun of the local time of day.
+    """
+
+    def __init__(
+        self,
+        serial: str = "123456789012",
+        inverters: int = 16,
+        lines: int = 2,
+        report_interval: float = 300.0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_seconds: float = 60.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.serial = serial
+        self.inverter_serials = [f"{serial}{i:04d}" for i in range(inverters)]
+        self.lines = lines
+        self.report_interval = report_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions: Set[str] = set()
+        self.requests: Dict[str, int] = {}
+
+    def count(self, path: str) -> None:
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def delay(self) -> float:
+        """
+        How long to wait before answering a request.
+        """
+        with self._lock:
+            if self._random.random() < self.timeout_rate:
+                return self.timeout_seconds
+            return max(0.0, self.latency + self._random.uniform(-1, 1) * self.jitter)
+
+    def fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def new_session(self) -> str:
+        session_id = secrets.token_hex(16)
+        with self._lock:
+            self._sessions.add(session_id)
+        return session_id
+
+    def valid_session(self, session_id: Optional[str]) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def sun(self, now: float) -> float:
+        """
+        Fraction of the peak power produced at the given time.
+        """
+        local_time = time.localtime(now)
+        hour = local_time.tm_hour + local_time.tm_min / 60 + local_time.tm_sec / 3600
+        return max(0.0, math.sin((hour - 6) / 12 * math.pi))
+
+    def production(self, now: float) -> Dict[str, Any]:
+        # The meter agrees with the last reports of the inverters
+        production = float(sum(watts for _, _, watts in self._inverter_reports(now)))
+        consumption = BASE_LOAD_WATTS * (1 + 0.2 * math.sin(now / 600))
+
+        return {
+            "production": [
+                {
+                    "type": "inverters",
+                    "activeCount": len(self.inverter_serials),
+                    "readingTime": int(now),
+                    "wNow": production,
+                },
+                self._eim("production", now, production),
+            ],
+            "consumption": [
+                self._eim("total-consumption", now, consumption),
+                self._eim("net-consumption", now, consumption - production),
+            ],
+            "storage": [],
+        }
+
+    def inverters(self, now: float) -> List[Dict[str, Any]]:
+        return [
+            {
+                "serialNumber": serial,
+                "lastReportDate": report_date,
+                "devType": 1,
+                "lastReportWatts": watts,
+                "maxReportWatts": INVERTER_PEAK_WATTS,
+            }
+            for serial, report_date, watts in self._inverter_reports(now)
+        ]
+
+    def inventory(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "type": "PCU",
+                "devices": [
+                    {
+                        "part_num": "800-01391-r03",
+                        "serial_num": serial,
+                        "device_status": ["envoy.global.ok"],
+                        "producing": True,
+                        "communicating": True,
+                    }
+                    for serial in self.inverter_serials
+                ],
+            }
+        ]
+
+    def _inverter_reports(self, now: float) -> List[Tuple[str, int, int]]:
+        reports = []
+        count = len(self.inverter_serials)
+        for i, serial in enumerate(self.inverter_serials):
+            offset = self.report_interval * i / count
+            report_date = (
+                math.floor((now - offset) / self.report_interval) * self.report_interval
+                + offset
+            )
+            report_date = int(report_date)
+
+            # Derived from the report, so the payload only changes with a new report
+            noise = random.Random(f"{serial}{report_date}").uniform(0.9, 1.0)
+            watts = round(INVERTER_PEAK_WATTS * self.sun(report_date) * noise)
+            reports.append((serial, report_date, watts))
+
+        return reports
+
+    def _eim(self, measurement_type: str, now: float, watts: float) -> Dict[str, Any]:
+        line_watts = watts / self.lines
+        return {
+            "type": "eim",
+            "activeCount": 1,
+            "measurementType": measurement_type,
+            "readingTime": int(now),
+            "wNow": watts,
+            "lines": [
+                self._line(line_watts, now, line_index)
+                for line_index in range(self.lines)
+            ],
+        }
+
+    def _line(self, watts: float, now: float, line_index: int) -> Dict[str, float]:
+        voltage = LINE_VOLTAGE + math.sin(now / 60 + line_index)
+        apparent_power = abs(watts) * 1.02
+        reactive_power = math.sqrt(max(0.0, apparent_power**2 - watts**2))
+        return {
+            "wNow": watts,
+            "rmsCurrent": apparent_power / voltage,
+            "rmsVoltage": voltage,
+            "reactPwr": reactive_power,
+            "apprntPwr": apparent_power,
+            "whToday": 0.0,
+            "vahToday": 0.0,
+            "varhLagToday": 0.0,
+            "varhLeadToday": 0.0,
+            "whLifetime": 0.0,
+            "vahLifetime": 0.0,
+            "varhLagLifetime": 0.0,
+            "varhLeadLifetime": 0.0,
+            "whLastSevenDays": 0.0,
+        }
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    server: "SimulatorServer"
+
+    def do_GET(self) -> None:
+        path = urlsplit(self.path).path
+        simulator = self.server.simulator
+        simulator.count(path)
+
+        if not self._misbehave():
+            return
+
+        if path == "/auth/check_jwt":
+            if not self.headers.get("Authorization", "").startswith("Bearer "):
+                self._send_error(401)
+                return
+            session_id = simulator.new_session()
+            self._send_json(
+                "<!DOCTYPE html><h2>Valid token.</h2>",
+                cookie=f"sessionId={session_id}; Path=/",
+            )
+            return
+
+        payloads = {
+            "/production.json": simulator.production,
+            "/api/v1/production/inverters": simulator.inverters,
+            "/inventory.json": lambda now: simulator.inventory(),
+        }
+        if path not in payloads:
+            self._send_error(404)
+            return
+
+        if not simulator.valid_session(self._session_id()):
+            self._send_error(401)
+            return
+
+        self._send_json(payloads[path](time.time()))
+
+    def do_POST(self) -> None:
+        path = urlsplit(self.path).path
+        self.server.simulator.count(path)
+
+        # Drain the body, the fake enphaseenergy.com accepts any login
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if path == "/login/login.json":
+            self._send_json({"session_id": secrets.token_hex(16)})
+        elif path == "/tokens":
+            self._send_json(_fake_token(), content_type="text/plain")
+        else:
+            self._send_error(404)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        LOG.debug("%s %s", self.address_string(), format % args)
+
+    def _misbehave(self) -> bool:
+        """
+        Apply the latency and error rate. Returns whether to answer normally.
+        """
+        simulator = self.server.simulator
+
+        delay = simulator.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+        if simulator.fails():
+            self._send_error(503)
+            return False
+
+        return True
+
+    def _session_id(self) -> Optional[str]:
+        for cookie in self.headers.get("Cookie", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == "sessionId":
+                return value
+        return None
+
+    def _send_json(
+        self,
+        data: Any,
+        cookie: Optional[str] = None,
+        content_type: str = "application/json",
+    ) -> None:
+        body = data.encode() if isinstance(data, str) else json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Any, simulator: EnvoySimulator) -> None:
+        super().__init__(address, SimulatorRequestHandler)
+        self.simulator = simulator
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        scheme = "https" if isinstance(self.socket, ssl.SSLSocket) else "http"
+        return f"{scheme}://{host}:{port}"
+
+
+def start_simulator(
+    simulator: EnvoySimulator,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    ssl_context: Optional[ssl.SSLContext] = None,
+) -> SimulatorServer:
+    """
+    Serve the simulator from a background thread. Port 0 picks a free port.
+    """
+    server = SimulatorServer((host, port), simulator)
+    if ssl_context is not None:
+        server.socket = ssl_context.wrap_socket(server.socket, server_side=True)
+
+    threading.Thread(
+        target=server.serve_forever, name=f"simulator-{port}", daemon=True
+    ).start()
+    return server
+
+
+def _fake_token() -> str:
+    # Only the claims are read by envoy-logger, so the signature is made up
+    def segment(data: Dict[str, Any]) -> str:
+        return base64.b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    now = int(time.time())
+    return ".".join(
+        [
+            segment({"kid": "simulator", "typ": "JWT", "alg": "ES256"}),
+            segment({"iss": "Entrez", "iat": now, "exp": now + 365 * 24 * 3600}),
+            "signature",
+        ]
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> Namespace:
+    parser = ArgumentParser(description="Serve simulated envoys.")
+
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument(
+        "--port", type=int, default=8080, help="Port of the first envoy."
+    )
+    parser.add_argument(
+        "--gateways",
+        type=int,
+        default=1,
+        help="Number of envoys, each listening on the next port.",
+    )
+    parser.add_argument(
+        "--inverters", type=int, default=16, help="Number of inverters per envoy."
+    )
+    parser.add_argument(
+        "--lines", type=int, default=2, help="Number of lines of each meter."
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=300.0,
+        help="Seconds between two reports of an inverter.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds before each response."
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Seconds by which the latency randomly varies.",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the requests answered with an error.",
+    )
+    parser.add_argument(
+        "--timeout-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the requests answered after --timeout-seconds.",
+    )
+    parser.add_argument(
+        "--timeout-seconds",
+        type=float,
+        default=60.0,
+        help="How long requests that time out take.",
+    )
+    parser.add_argument("--seed", type=int, help="Seed of the random faults.")
+    parser.add_argument("--certfile", help="Serve HTTPS with this certificate.")
+    parser.add_argument("--keyfile", help="Private key of the certificate.")
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s [%(name)s]: %(message)s",
+    )
+    args = parse_args(argv)
+
+    ssl_context: Optional[ssl.SSLContext] = None
+    if args.certfile is not None:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(args.certfile, args.keyfile)
+
+    servers = []
+    for i in range(args.gateways):
+        simulator = EnvoySimulator(
+            serial=f"{123456789000 + i}",
+            inverters=args.inverters,
+            lines=args.lines,
+            report_interval=args.report_interval,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            timeout_rate=args.timeout_rate,
+            timeout_seconds=args.timeout_seconds,
+            seed=None if args.seed is None else args.seed + i,
+        )
+        server = start_simulator(simulator, args.host, args.port + i, ssl_context)
+        servers.append(server)
+        LOG.info(
+            "Envoy S/N %s with %d inverters at %s",
+            simulator.serial,
+            args.inverters,
+            server.url,
+        )
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+from envoy_logger.internal_metrics import SINK_DROPPED_SAMPLES
+from envoy_logger.model import InverterData, SampleData
+
+LOG = logging.getLogger("sink")
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class Sink(ABC):
+    """
+    A destination for samples collected from one or more envoys.
+    """
+
+    @abstractmethod
+    def publish(
+        self,
+        source_tag: str,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+    ) -> None:
+        """
+        Write one sampling cycle from the envoy identified by source_tag.
+        """
+
+
+class QueuedSink(Sink):
+    """
+    Publishes to another sink from a worker thread of its own.
+
+    Samples are put on a bounded queue, so a slow sink delays neither the
+    sampling nor the other sinks. Failures of the sink are logged, and the
+    worker moves on to the next sample.
+
+    The wrapped sink publishes from the worker, so the freshness it observes
+    once its write is accepted includes the time a sample spent in the queue,
+    and its write latency is that of the write alone.
+
+    When the queue is full the backpressure policy decides what happens:
+      - block: the caller waits until there is room
+      - drop_oldest: the oldest queued sample is discarded
+      - drop_newest: the sample being published is discarded
+    """
+
+    def __init__(
+        self,
+        sink: Sink,
+        name: str,
+        max_queue_depth: int = 60,
+        backpressure: str = "drop_oldest",
+    ) -> None:
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+
+        self.sink = sink
+        self.name = name
+        self.backpressure = backpressure
+
+        # None tells the worker to stop
+        self._queue: queue.Queue[Optional[Tuple[str, SampleData, InverterData]]] = (
+            queue.Queue(maxsize=max_queue_depth)
+        )
+        self._put_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._dropped = SINK_DROPPED_SAMPLES.labels(sink=name)
+
+        self._thread = threading.Thread(
+            target=self._run, name=f"sink-{name}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def publish(
+        self,
+        source_tag: str,
+        sample_data: SampleData,
+        inverter_data: InverterData,
+    ) -> None:
+        if self._closed.is_set():
+            LOG.warning("Sink %s is closed, dropped a sample", self.name)
+            self._dropped.inc()
+            return
+
+        item = (source_tag, sample_data, inverter_data)
+        if self.backpressure == "block":
+            self._queue.put(item)
+            return
+
+        with self._put_lock:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+            if self.backpressure == "drop_newest":
+                dropped = True
+            else:
+                try:
+                    self._queue.get_nowait()
+                    dropped = True
+                except queue.Empty:
+                    # The worker emptied the queue in the meantime
+                    dropped = False
+                self._queue.put_nowait(item)
+
+        if dropped:
+            LOG.warning("Sink %s is falling behind, dropped a sample", self.name)
+            self._dropped.inc()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the worker after it has published everything left in the queue.
+
+        Waits at most timeout seconds in all, after which whatever is left in
+        the queue is abandoned along with the worker.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._closed.set()
+
+        try:
+            # The queue may be full, so waiting for room counts towards the timeout
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        else:
+            remaining = (
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+            self._thread.join(timeout=remaining)
+
+        if self._thread.is_alive():
+            LOG.warning(
+                "Sink %s did not finish in time, %d samples were not published",
+                self.name,
+                self._queue.qsize(),
+            )
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            try:
+                self.sink.publish(*item)
+            except Exception:
+                LOG.exception("Publishing to sink %s failed", self.name)
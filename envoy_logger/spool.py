@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote
+
+LOG = logging.getLogger("spool")
+
+SEGMENT_SUFFIX = ".lp"
+
+
+class Spool:
+    """
+    Durable on-disk buffer of InfluxDB line protocol, used while the database is
+    unreachable.
+
+    Lines are appended to segment files, one directory per bucket:
+        <path>/<bucket>/<sequence>.lp
+
+    A segment is rotated once it reaches segment_max_bytes. Appends are fsync'd
+    at most once every fsync_interval seconds, and whenever a segment is closed.
+    If the spool grows past max_bytes, the oldest segments are discarded so the
+    disk use stays bounded.
+
+    Segments are replayed oldest first. A segment is only deleted once all of
+    its lines have been written. Replaying part of a segment twice is harmless
+    because InfluxDB overwrites points with the same series and timestamp.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        segment_max_bytes: int = 4 * 1024 * 1024,
+        max_bytes: int = 512 * 1024 * 1024,
+        fsync_interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.RLock()
+
+        # Segment file handles currently being appended to, by bucket
+        self._active: Dict[str, Tuple[str, BinaryIO]] = {}
+        self._last_fsync = time.monotonic()
+
+        # Files in the spool that are not segments, only warned about once
+        self._ignored: Set[str] = set()
+
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+        segments = self._segments()
+        self._next_sequence = segments[-1][0] + 1 if segments else 0
+
+        # Tracked in memory so appends and pending checks do not scan the disk
+        self._pending = bool(segments)
+        self._total_bytes = sum(os.path.getsize(path) for _, _, path in segments)
+        if segments:
+            LOG.info("Found %d spooled segments in %s", len(segments), self.path)
+
+    def pending(self) -> bool:
+        return self._pending
+
+    def size(self) -> int:
+        return self._total_bytes
+
+    def append(self, bucket: str, lines: List[str]) -> None:
+        if not lines:
+            return
+
+        with self._lock:
+            self._pending = True
+            _, f = self._active_segment(bucket)
+            data = "".join(line + "\n" for line in lines).encode("utf-8")
+            f.write(data)
+            self._total_bytes += len(data)
+
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                self._fsync_active()
+                self._last_fsync = now
+
+            if f.tell() >= self.segment_max_bytes:
+                self._close_segment(bucket)
+
+            if self._total_bytes > self.max_bytes:
+                self._enforce_max_bytes()
+
+    def replay(
+        self,
+        write: Callable[[str, List[str]], None],
+        batch_size: int = 5000,
+        max_segments: Optional[int] = None,
+    ) -> int:
+        """
+        Write spooled lines oldest first, in batches of batch_size lines.
+
+        With max_segments, at most that many segments are replayed, so a large
+        backlog can be drained a bit at a time.
+
+        Stops at the first failed write, leaving the remaining segments in place,
+        and returns the number of lines that were written.
+        """
+        with self._lock:
+            # Everything appended so far becomes eligible for replay
+            for bucket in list(self._active.keys()):
+                self._close_segment(bucket)
+
+            written = 0
+            segments = self._segments()
+            if max_segments is not None:
+                segments = segments[:max_segments]
+
+            for _, bucket, path in segments:
+                with open(path, "rb") as f:
+                    batch: List[str] = []
+                    for line in f:
+                        batch.append(line.decode("utf-8").rstrip("\n"))
+                        if len(batch) >= batch_size:
+                            write(bucket, batch)
+                            written += len(batch)
+                            batch = []
+                    if batch:
+                        write(bucket, batch)
+                        written += len(batch)
+
+                self._total_bytes -= os.path.getsize(path)
+                os.remove(path)
+
+            self._pending = bool(self._segments())
+            if written:
+                LOG.info("Replayed %d spooled lines", written)
+
+            return written
+
+    def close(self) -> None:
+        with self._lock:
+            for bucket in list(self._active.keys()):
+                self._close_segment(bucket)
+
+    def _active_segment(self, bucket: str) -> Tuple[str, BinaryIO]:
+        if bucket not in self._active:
+            bucket_dir = os.path.join(self.path, quote(bucket, safe=""))
+            os.makedirs(bucket_dir, mode=0o700, exist_ok=True)
+
+            path = os.path.join(
+                bucket_dir, f"{self._next_sequence:012d}{SEGMENT_SUFFIX}"
+            )
+            self._next_sequence += 1
+            self._active[bucket] = (path, open(path, "ab"))
+
+        return self._active[bucket]
+
+    def _close_segment(self, bucket: str) -> None:
+        _, f = self._active.pop(bucket)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _fsync_active(self) -> None:
+        for _, f in self._active.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _enforce_max_bytes(self) -> None:
+        active_paths = {path for path, _ in self._active.values()}
+        for _, bucket, path in self._segments():
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path in active_paths:
+                continue
+
+            size = os.path.getsize(path)
+            LOG.warning(
+                "Spool is full. Discarding oldest segment for bucket %s", bucket
+            )
+            os.remove(path)
+            self._total_bytes -= size
+
+    def _segments(self) -> List[Tuple[int, str, str]]:
+        """
+        Return (sequence, bucket, path) of every segment, oldest first.
+        """
+        segments = []
+        for bucket_dir in os.listdir(self.path):
+            bucket_path = os.path.join(self.path, bucket_dir)
+            if not os.path.isdir(bucket_path):
+                continue
+
+            for name in os.listdir(bucket_path):
+                if not name.endswith(SEGMENT_SUFFIX):
+                    continue
+                path = os.path.join(bucket_path, name)
+                try:
+                    sequence = int(name[: -len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    if path not in self._ignored:
+                        LOG.warning("Ignoring %s, which is not a spool segment", path)
+                        self._ignored.add(path)
+                    continue
+                segments.append((sequence, unquote(bucket_dir), path))
+
+        segments.sort()
+        return segments
@@ -0,0 +1,65 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+LOG = logging.getLogger("startup")
+
+
+class Startup:
+    """
+    Runs the slow steps of starting up, such as logging in and connecting to
+    the databases, concurrently, and reports how long each of them took.
+
+    Steps run inline with timed() count towards the total as they happen.
+    Steps handed to submit() run in the background until finish().
+    """
+
+    def __init__(self, max_workers: int = 8) -> None:
+        self._start = time.monotonic()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="startup"
+        )
+        self._futures: List[Tuple[str, Future]] = []
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.monotonic() - start
+
+    def submit(self, name: str, func: Callable[..., Any], *args: Any) -> Future:
+        def step() -> Any:
+            with self.timed(name):
+                return func(*args)
+
+        future = self._executor.submit(step)
+        self._futures.append((name, future))
+        return future
+
+    def finish(self) -> float:
+        """
+        Wait for the background steps, log the startup time, and return it.
+
+        A background step that failed is only logged. Whatever it did not get
+        done, such as a login, is retried by the first sample.
+        """
+        for name, future in self._futures:
+            e = future.exception()
+            if e is not None:
+                LOG.warning("Startup step %s failed: %s", name, e)
+        self._executor.shutdown()
+
+        elapsed = time.monotonic() - self._start
+        LOG.info(
+            "Started in %.2fs (%s)",
+            elapsed,
+            ", ".join(
+                f"{name}: {seconds:.2f}s" for name, seconds in self.timings.items()
+            ),
+        )
+        return elapsed
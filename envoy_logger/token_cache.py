@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+LOG = logging.getLogger("token_cache")
+
+
+class TokenCache:
+    """
+    Persists the enphaseenergy.com access token and the envoy session of one
+    envoy, so a restart does not need to log in again.
+
+    The file contains credentials, so it is only readable by the owner.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Any] = self._load()
+
+    def get_token(self) -> Optional[str]:
+        return self._data.get("token")
+
+    def set_token(self, token: str) -> None:
+        with self._lock:
+            self._data["token"] = token
+            self._save()
+
+    def get_session(self) -> Optional[Tuple[str, datetime]]:
+        session_id = self._data.get("session_id")
+        last_update = self._data.get("session_id_last_update")
+        if not session_id or not last_update:
+            return None
+        return session_id, datetime.fromisoformat(last_update)
+
+    def set_session(self, session_id: str, last_update: datetime) -> None:
+        with self._lock:
+            self._data["session_id"] = session_id
+            self._data["session_id_last_update"] = last_update.isoformat()
+            self._save()
+
+    def clear_session(self) -> None:
+        with self._lock:
+            self._data.pop("session_id", None)
+            self._data.pop("session_id_last_update", None)
+            self._save()
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            LOG.warning("Ignoring unreadable token cache %s: %s", self.path, e)
+            return {}
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+
+            # Create the file with owner-only permissions before anything is written to it
+            tmp_path = f"{self.path}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Not being able to cache only costs a login on the next start
+            LOG.warning("Unable to write token cache %s: %s", self.path, e)
@@ -2,6 +2,6 @@
 set -eou pipefail
 cd "$(dirname "${0}")"
 
-poetry run black envoy_logger tests
-poetry run isort envoy_logger tests
+poetry run black envoy_logger tests benchmarks
+poetry run isort envoy_logger tests benchmarks
 poetry run mdformat .
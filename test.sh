@@ -2,9 +2,9 @@
 set -eou pipefail
 cd "$(dirname "${0}")"
 
-poetry run black --check envoy_logger tests
-poetry run isort --check envoy_logger tests
-poetry run flake8 envoy_logger tests
+poetry run black --check envoy_logger tests benchmarks
+poetry run isort --check envoy_logger tests benchmarks
+poetry run flake8 envoy_logger tests benchmarks
 poetry run yamllint -c .yamllint .
 poetry run mdformat --check .
 
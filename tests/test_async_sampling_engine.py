@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from requests import ConnectTimeout, HTTPError
+from tests.sample_data import create_inverter_data, create_sample_data
+
+from envoy_logger.async_sampling_engine import AsyncSamplingEngine
+from envoy_logger.envoy import Envoy
+from envoy_logger.model import SampleData, parse_inverter_data
+from envoy_logger.sink import Sink
+
+
+class TestAsyncSamplingEngine(unittest.TestCase):
+    def setUp(self):
+        self.mock_envoy_a = mock.Mock(Envoy)
+        self.mock_envoy_a.get_power_data.return_value = SampleData.create(
+            sample_data=create_sample_data()
+        )
+        self.mock_envoy_a.get_inverter_data.return_value = parse_inverter_data(
+            [create_inverter_data("foobarA")]
+        )
+
+        self.mock_envoy_b = mock.Mock(Envoy)
+        self.mock_envoy_b.get_power_data.return_value = SampleData.create(
+            sample_data=create_sample_data()
+        )
+        self.mock_envoy_b.get_inverter_data.return_value = parse_inverter_data(
+            [create_inverter_data("foobarB")]
+        )
+
+        self.mock_sink = mock.Mock(Sink)
+
+        self.sampling_engine = AsyncSamplingEngine(
+            envoys={"site-a": self.mock_envoy_a, "site-b": self.mock_envoy_b},
+            sinks=[self.mock_sink],
+        )
+
+    def test_poll_publishes_per_source(self):
+        async def poll_all():
+            await asyncio.gather(
+                *(
+                    self.sampling_engine._poll_once(poller)
+                    for poller in self.sampling_engine.pollers
+                )
+            )
+
+        asyncio.run(poll_all())
+
+        published_sources = sorted(
+            call.args[0] for call in self.mock_sink.publish.call_args_list
+        )
+        self.assertEqual(published_sources, ["site-a", "site-b"])
+
+        for poller in self.sampling_engine.pollers:
+            self.assertIsNotNone(poller.last_sample_timestamp)
+
+    def test_poll_timeout(self):
+        self.mock_envoy_a.get_power_data.side_effect = ConnectTimeout("foobar")
+        poller = self.sampling_engine.pollers[0]
+
+        with self.assertRaises(TimeoutError):
+            asyncio.run(
+                self.sampling_engine._collect_samples_with_retry(
+                    poller, retries=2, wait_seconds=0.1
+                )
+            )
+
+        self.mock_sink.publish.assert_not_called()
+
+    def test_failing_envoy_does_not_stop_others(self):
+        self.mock_envoy_a.get_power_data.side_effect = HTTPError("503")
+        waits = {"site-a": 0, "site-b": 0}
+        done = asyncio.Event()
+
+        async def wait_for_next_cycle(poller):
+            # Each poller is stopped once its third cycle is over
+            waits[poller.source_tag] += 1
+            if waits[poller.source_tag] > 3:
+                if all(count > 3 for count in waits.values()):
+                    done.set()
+                await asyncio.Event().wait()
+
+        async def run():
+            task = asyncio.create_task(self.sampling_engine._run())
+            await asyncio.wait_for(done.wait(), timeout=5)
+            task.cancel()
+
+        with mock.patch.object(
+            self.sampling_engine, "_wait_for_next_cycle", wait_for_next_cycle
+        ), self.assertLogs("async_sampling_engine", level="ERROR"):
+            asyncio.run(run())
+
+        # site-a failed every cycle, and site-b kept publishing
+        self.assertEqual(self.mock_envoy_a.get_power_data.call_count, 3)
+        published_sources = [
+            call.args[0] for call in self.mock_sink.publish.call_args_list
+        ]
+        self.assertEqual(published_sources, ["site-b"] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
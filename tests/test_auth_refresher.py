@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from requests import ConnectTimeout, Response
+
+from envoy_logger.auth_refresher import AuthRefresher
+from envoy_logger.enphase_energy import EnphaseEnergy
+from envoy_logger.envoy import Envoy
+
+
+@mock.patch("requests.Session.get")
+class TestAuthRefresher(unittest.TestCase):
+    def setUp(self):
+        self.mock_enphase_energy = mock.Mock(EnphaseEnergy)
+        self.mock_enphase_energy.get_token.return_value = "foobar"
+        self.mock_enphase_energy.token_expires_within.return_value = False
+
+        self.envoy = Envoy(
+            url="http://envoy.local", enphase_energy=self.mock_enphase_energy
+        )
+
+        self.auth_refresher = AuthRefresher(envoys=[self.envoy])
+
+    def test_refresh_session_ahead_of_expiry(self, mock_requests_get):
+        self.envoy.session_id = "old"
+        self.envoy.session_id_last_update = datetime.now() - timedelta(hours=11.5)
+
+        mock_login_response = mock.Mock(Response)
+        mock_login_response.cookies = {"sessionId": "new"}
+        mock_requests_get.return_value = mock_login_response
+
+        self.auth_refresher.refresh_due()
+
+        self.assertEqual(self.envoy.session_id, "new")
+        self.assertEqual(self.envoy.session.cookies.get("sessionId"), "new")
+
+        # The sampling path now finds a fresh session and does not log in
+        self.assertEqual(self.envoy.get_session_id(), "new")
+        self.assertEqual(mock_requests_get.call_count, 1)
+
+    def test_refresh_token_ahead_of_expiry(self, mock_requests_get):
+        self.envoy.session_id = "current"
+        self.envoy.session_id_last_update = datetime.now()
+        self.mock_enphase_energy.token_expires_within.return_value = True
+
+        self.auth_refresher.refresh_due()
+
+        self.mock_enphase_energy.refresh_token.assert_called_once()
+        mock_requests_get.assert_not_called()
+
+    def test_refresh_failure_keeps_current_session(self, mock_requests_get):
+        self.envoy.session_id = "old"
+        self.envoy.session_id_last_update = datetime.now() - timedelta(hours=11.5)
+        mock_requests_get.side_effect = ConnectTimeout("foobar")
+
+        self.auth_refresher.refresh_due()
+
+        self.assertEqual(self.envoy.session_id, "old")
+
+    def test_skip_before_first_login(self, mock_requests_get):
+        self.auth_refresher.refresh_due()
+
+        mock_requests_get.assert_not_called()
+        self.mock_enphase_energy.refresh_token.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
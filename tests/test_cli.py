@@ -1,16 +1,105 @@
+import json
+import tempfile
 import unittest
 from unittest import mock
 
+from tests.sample_data import create_sample_data
+
 from envoy_logger import cli
+from envoy_logger.recorder import PayloadRecorder
 
 
+@mock.patch("envoy_logger.cli.Envoy")
 @mock.patch("envoy_logger.enphase_energy.EnphaseEnergy")
-@mock.patch("envoy_logger.cli.InfluxdbSamplingEngine")
+@mock.patch("envoy_logger.influxdb_sampling_engine.InfluxdbSamplingEngine")
 class TestCli(unittest.TestCase):
-    def test_main_success(self, mock_sampling_loop, mock_enphase_energy):
+    def test_main_success(self, mock_sampling_loop, mock_enphase_energy, mock_envoy):
         mock_sampling_loop.run.return_value = None
         cli.main(argv=["--config", "./docs/config.yml", "--db", "influxdb"])
 
 
+@mock.patch("envoy_logger.cli.Envoy")
+@mock.patch("envoy_logger.enphase_energy.EnphaseEnergy")
+@mock.patch("envoy_logger.async_sampling_engine.AsyncSamplingEngine")
+@mock.patch("envoy_logger.prometheus_sampling_engine.PrometheusSink")
+@mock.patch("envoy_logger.influxdb_sampling_engine.InfluxdbSink")
+class TestCliMultipleDatabases(unittest.TestCase):
+    def test_parse_databases(
+        self,
+        mock_influxdb_sink,
+        mock_prometheus_sink,
+        mock_engine,
+        mock_enphase,
+        mock_envoy,
+    ):
+        args = cli.parse_args(
+            ["--config", "./docs/config.yml", "--db", "influxdb, prometheus"]
+        )
+        self.assertEqual(args.db, ["influxdb", "prometheus"])
+
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+            cli.parse_args(["--config", "./docs/config.yml", "--db", "influxdb,foobar"])
+
+    def test_main_fan_out(
+        self,
+        mock_influxdb_sink,
+        mock_prometheus_sink,
+        mock_engine,
+        mock_enphase,
+        mock_envoy,
+    ):
+        with mock.patch("envoy_logger.cli.atexit"):
+            cli.main(
+                argv=["--config", "./docs/config.yml", "--db", "influxdb,prometheus"]
+            )
+
+        # One sampling loop, publishing to a queue per sink
+        mock_engine.assert_called_once()
+        sinks = mock_engine.call_args.kwargs["sinks"]
+        self.assertEqual([sink.name for sink in sinks], ["influxdb", "prometheus"])
+        self.assertEqual(sinks[0].sink, mock_influxdb_sink.return_value)
+        self.assertEqual(sinks[1].sink, mock_prometheus_sink.return_value)
+        mock_engine.return_value.run.assert_called_once()
+
+        for sink in sinks:
+            sink.close(timeout=5)
+
+
+@mock.patch("envoy_logger.influxdb_writer.InfluxdbBatchWriter")
+@mock.patch("envoy_logger.influxdb_sampling_engine.InfluxdbSink")
+class TestCliReplay(unittest.TestCase):
+    def test_replay(self, mock_sink, mock_batch_writer):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            recorder = PayloadRecorder(tmpdir)
+            recorder.record(
+                "envoy", "production", json.dumps(create_sample_data()).encode()
+            )
+            recorder.close()
+
+            cli.main(
+                argv=[
+                    "--config",
+                    "./docs/config.yml",
+                    "--db",
+                    "influxdb",
+                    "replay",
+                    tmpdir,
+                ]
+            )
+
+        mock_sink.assert_called_once_with(
+            config=mock.ANY, persist_state=False, writer_factory=mock.ANY
+        )
+        mock_sink.return_value.publish.assert_called_once()
+        mock_sink.return_value.influxdb_writer.close.assert_called_once()
+
+        # The sink builds the replay writer in place of its configured one
+        writer_factory = mock_sink.call_args.kwargs["writer_factory"]
+        writer_factory(mock.sentinel.write_api)
+        mock_batch_writer.assert_called_once_with(
+            mock.sentinel.write_api, batch_size=mock.ANY, backpressure="block"
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
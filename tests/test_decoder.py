@@ -0,0 +1,104 @@
+import json
+import unittest
+
+from tests.sample_data import (
+    create_inverter_data,
+    create_production_only_sample_data,
+    create_sample_data,
+)
+
+from envoy_logger.decoder import JsonDecoder, MsgspecDecoder, get_decoder, msgspec
+from envoy_logger.model import SampleData, SerialIndex, parse_inverter_data
+
+
+class DecoderTests:
+    missing_field_error = Exception
+
+    def create_decoder(self):
+        raise NotImplementedError()
+
+    def test_decode_power_data(self):
+        power_data = create_sample_data()
+        # The totals are discarded, and must not get in the way
+        power_data["production"][0]["wNow"] = 1000
+        power_data["production"].append(
+            {"type": "inverters", "activeCount": 1, "readingTime": 1672574917}
+        )
+
+        sample_data = self.create_decoder().decode_power_data(
+            json.dumps(power_data).encode()
+        )
+
+        self.assertEqual(sample_data, SampleData.create(sample_data=power_data))
+
+    def test_decode_production_only_power_data(self):
+        power_data = create_production_only_sample_data()
+
+        sample_data = self.create_decoder().decode_power_data(
+            json.dumps(power_data).encode()
+        )
+
+        self.assertEqual(sample_data.net_consumption.eim_line_samples, [])
+        self.assertEqual(len(sample_data.total_production.eim_line_samples), 3)
+
+    def test_missing_reading_time(self):
+        power_data = create_sample_data()
+        del power_data["production"][0]["readingTime"]
+
+        with self.assertRaises(self.missing_field_error):
+            self.create_decoder().decode_power_data(json.dumps(power_data).encode())
+
+    def test_decode_inverter_data(self):
+        inverters = [create_inverter_data("a"), create_inverter_data("b")]
+        inverters[0]["devType"] = 1
+        index = SerialIndex()
+        index.slot("b")
+
+        inverter_data = self.create_decoder().decode_inverter_data(
+            json.dumps(inverters).encode(), index
+        )
+
+        self.assertEqual(index.serials, ["b", "a"])
+        self.assertEqual(inverter_data, parse_inverter_data(inverters))
+
+    def test_changed_slots(self):
+        inverters = [create_inverter_data("a"), create_inverter_data("b")]
+        index = SerialIndex()
+        decoder = self.create_decoder()
+
+        previous = decoder.decode_inverter_data(json.dumps(inverters).encode(), index)
+        self.assertIsNone(previous.changed)
+
+        inverters[1]["lastReportDate"] += 300
+        inverters.append(create_inverter_data("c"))
+        inverter_data = decoder.decode_inverter_data(
+            json.dumps(inverters).encode(), index, previous
+        )
+
+        # Only the inverter that reported again, and the new one
+        self.assertEqual(inverter_data.changed, [1, 2])
+
+
+class TestJsonDecoder(DecoderTests, unittest.TestCase):
+    missing_field_error = KeyError
+
+    def create_decoder(self):
+        return JsonDecoder(use_orjson=False)
+
+
+@unittest.skipIf(msgspec is None, "msgspec is not installed")
+class TestMsgspecDecoder(DecoderTests, unittest.TestCase):
+    missing_field_error = msgspec.ValidationError if msgspec else None
+
+    def create_decoder(self):
+        return MsgspecDecoder()
+
+
+class TestGetDecoder(unittest.TestCase):
+    def test_unknown_decoder(self):
+        with self.assertRaises(ValueError):
+            get_decoder("foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
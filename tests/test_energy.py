@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta, timezone
+
+from envoy_logger.energy import DailyEnergyIntegrator, EnergyAccumulator
+
+
+class TestEnergyAccumulator(unittest.TestCase):
+    def test_trapezoid(self):
+        accumulator = EnergyAccumulator()
+        accumulator.add(0, 100.0)
+        accumulator.add(300, 300.0)
+        accumulator.add(600, 300.0)
+
+        # 5 minutes ramping 100W -> 300W, then 5 minutes at 300W
+        self.assertAlmostEqual(accumulator.Wh, (200.0 + 300.0) / 12)
+
+    def test_ignores_repeated_samples(self):
+        accumulator = EnergyAccumulator()
+        accumulator.add(0, 120.0)
+        accumulator.add(600, 120.0)
+        accumulator.add(600, 120.0)
+        accumulator.add(300, 120.0)
+
+        self.assertAlmostEqual(accumulator.Wh, 20.0)
+
+    def test_does_not_interpolate_across_gaps(self):
+        accumulator = EnergyAccumulator(max_gap=900.0)
+        accumulator.add(0, 500.0)
+        accumulator.add(72 * 3600, 500.0)
+        self.assertEqual(accumulator.Wh, 0.0)
+
+        # Integration resumes from the sample after the gap
+        accumulator.add(72 * 3600 + 360, 500.0)
+        self.assertAlmostEqual(accumulator.Wh, 50.0)
+
+        # Carried over windows keep the limit
+        self.assertEqual(accumulator.carry_over().max_gap, 900.0)
+
+
+class TestDailyEnergyIntegrator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "energy", "envoy.json")
+
+    def _sample(self, integrator, ts, watts):
+        # Like the sinks, roll over on the first sample of each local day
+        day = ts.date()
+        if integrator.day != day:
+            totals = integrator.roll_over(day)
+        else:
+            totals = None
+        integrator.add("production", 0, ts.timestamp(), watts)
+        return totals
+
+    def test_roll_over(self):
+        integrator = DailyEnergyIntegrator(self.path)
+        day = date(2024, 6, 1)
+
+        # First day was only partly observed
+        ts = datetime(2024, 6, 1, 23)
+        self.assertIsNone(self._sample(integrator, ts, 1000.0))
+        integrator.add("inverter", "foobar", ts.timestamp(), 50.0)
+
+        # Second day followed straight on, so it is complete
+        returned = []
+        while ts < datetime(2024, 6, 3, 0, 5):
+            ts += timedelta(minutes=10)
+            totals = self._sample(integrator, ts, 1000.0)
+            if totals is not None:
+                returned.append((integrator.day, totals))
+
+        self.assertEqual(len(returned), 1)
+        self.assertEqual(returned[0][0], day + timedelta(days=2))
+        totals = returned[0][1]
+        self.assertAlmostEqual(totals[("production", "0")], 1000.0 * 24)
+        self.assertAlmostEqual(totals[("inverter", "foobar")], 0.0)
+
+    def test_outage_makes_day_incomplete(self):
+        integrator = DailyEnergyIntegrator(self.path)
+
+        ts = datetime(2024, 6, 1, 23, 50)
+        self._sample(integrator, ts, 500.0)
+        ts += timedelta(minutes=10)
+        self.assertIsNone(self._sample(integrator, ts, 500.0))
+
+        # Sampling stops in the afternoon, and resumes three days later
+        while ts < datetime(2024, 6, 2, 15):
+            ts += timedelta(minutes=10)
+            self._sample(integrator, ts, 500.0)
+        ts = datetime(2024, 6, 5, 15)
+        self.assertIsNone(self._sample(integrator, ts, 500.0))
+
+        # Nothing was interpolated across the outage either
+        self.assertEqual(integrator.accumulators[("production", "0")].Wh, 0.0)
+
+        # The day the samples resumed is missing its morning
+        while ts < datetime(2024, 6, 6, 0, 5):
+            ts += timedelta(minutes=10)
+            self.assertIsNone(self._sample(integrator, ts, 500.0))
+
+    def test_outage_within_day_makes_it_incomplete(self):
+        integrator = DailyEnergyIntegrator(self.path)
+        integrator.roll_over(date(2024, 6, 1))
+        integrator.complete = True
+
+        integrator.add("net", 1, datetime(2024, 6, 1, 23, 40).timestamp(), 100.0)
+        self.assertTrue(integrator.complete)
+        integrator.add("net", 1, datetime(2024, 6, 1, 23, 59).timestamp(), 100.0)
+        self.assertFalse(integrator.complete)
+
+        self.assertIsNone(integrator.roll_over(date(2024, 6, 2)))
+
+    def test_persistence(self):
+        integrator = DailyEnergyIntegrator(self.path)
+        ts = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+        integrator.roll_over(date(2024, 6, 1))
+        integrator.add("net", 1, ts.timestamp(), 120.0)
+        integrator.add("net", 1, (ts + timedelta(minutes=10)).timestamp(), 120.0)
+        integrator.save()
+
+        restored = DailyEnergyIntegrator(self.path)
+
+        self.assertEqual(restored.day, date(2024, 6, 1))
+        self.assertEqual(restored.last_ts, (ts + timedelta(minutes=10)).timestamp())
+        self.assertAlmostEqual(restored.accumulators[("net", "1")].Wh, 20.0)
+
+        # Integration continues across the restart
+        restored.add("net", 1, (ts + timedelta(minutes=20)).timestamp(), 120.0)
+        self.assertAlmostEqual(restored.accumulators[("net", "1")].Wh, 40.0)
+
+    def test_unwritable_state_dir(self):
+        blocker = os.path.join(self.tmp_dir.name, "blocker")
+        with open(blocker, "w") as f:
+            f.write("")
+        integrator = DailyEnergyIntegrator(os.path.join(blocker, "energy", "e.json"))
+        integrator.add("net", 1, 0.0, 100.0)
+
+        # Logged rather than stopping the sampling loop
+        with self.assertLogs("energy", level="WARNING"):
+            integrator.maybe_save()
+        with self.assertLogs("energy", level="WARNING"):
+            integrator.roll_over(date(2024, 6, 1))
+
+    def test_state_without_series(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"day": "2024-06-01", "complete": True}, f)
+
+        with self.assertLogs("energy", level="WARNING"):
+            integrator = DailyEnergyIntegrator(self.path)
+
+        self.assertIsNone(integrator.day)
+        self.assertFalse(integrator.complete)
+        self.assertEqual(integrator.accumulators, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,22 @@
 import base64
 import json
+import os
+import tempfile
+import time
 import unittest
 from unittest import mock
 
 from requests import Response
 
 from envoy_logger.enphase_energy import EnphaseEnergy
+from envoy_logger.token_cache import TokenCache
+
+
+def _create_token(exp: int) -> str:
+    token_segment = (base64.b64encode(bytes(json.dumps({"exp": exp}), "utf-8"))).decode(
+        "utf-8"
+    )
+    return f"{token_segment}.{token_segment}.{token_segment}"
 
 
 @mock.patch("requests.post")
@@ -38,6 +49,40 @@ class TestEnphaseEnergy(unittest.TestCase):
 
         self.assertEqual(returned_token, token)
 
+    def test_get_cached_token(self, mock_requests_post):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache_path = os.path.join(tmp_dir.name, "serial123.json")
+
+        token = _create_token(int(time.time()) + 30 * 24 * 3600)
+        TokenCache(cache_path).set_token(token)
+
+        enphase_energy = EnphaseEnergy(
+            email="foobar@test.com",
+            password="password123",
+            envoy_serial="serial123",
+            cache=TokenCache(cache_path),
+        )
+
+        self.assertEqual(enphase_energy.get_token(), token)
+        mock_requests_post.assert_not_called()
+
+    def test_ignore_expired_cached_token(self, mock_requests_post):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache_path = os.path.join(tmp_dir.name, "serial123.json")
+
+        TokenCache(cache_path).set_token(_create_token(int(time.time()) - 1))
+
+        enphase_energy = EnphaseEnergy(
+            email="foobar@test.com",
+            password="password123",
+            envoy_serial="serial123",
+            cache=TokenCache(cache_path),
+        )
+
+        self.assertIsNone(enphase_energy.token)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,15 +1,24 @@
+import json
+import os
+import tempfile
 import unittest
+from datetime import datetime
 from unittest import mock
 
+import requests
+from prometheus_client import REGISTRY
 from requests import Response
 from tests.sample_data import create_inverter_data, create_sample_data
 
 from envoy_logger.envoy import Envoy
 from envoy_logger.model import SampleData, parse_inverter_data
+from envoy_logger.payload_capture import PayloadCapture
+from envoy_logger.recorder import PayloadRecorder
+from envoy_logger.token_cache import TokenCache
 
 
 @mock.patch("envoy_logger.enphase_energy.EnphaseEnergy")
-@mock.patch("requests.get")
+@mock.patch("requests.Session.get")
 @mock.patch("requests.post")
 class TestEnvoy(unittest.TestCase):
     def test_get_session_id(
@@ -40,7 +49,8 @@ class TestEnvoy(unittest.TestCase):
 
         power_data = create_sample_data()
         mock_power_data_response = mock.Mock(Response)
-        mock_power_data_response.json.return_value = power_data
+        mock_power_data_response.status_code = 200
+        mock_power_data_response.content = json.dumps(power_data).encode()
 
         mock_requests_get.side_effect = [mock_login_response, mock_power_data_response]
 
@@ -75,7 +85,8 @@ class TestEnvoy(unittest.TestCase):
             create_inverter_data(),
         ]
         mock_inverter_data_response = mock.Mock(Response)
-        mock_inverter_data_response.json.return_value = test_inverter_data
+        mock_inverter_data_response.status_code = 200
+        mock_inverter_data_response.content = json.dumps(test_inverter_data).encode()
 
         mock_requests_get.side_effect = [
             mock_login_response,
@@ -94,6 +105,216 @@ class TestEnvoy(unittest.TestCase):
             expected_inverter_data["foobar"].watts,
         )
 
+    def test_unchanged_inverter_data(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        envoy = Envoy(url="http://envoy.local", enphase_energy=mock_enphase_energy)
+
+        mock_enphase_energy.get_token.return_value = "foobar"
+
+        mock_login_response = mock.Mock(Response)
+        mock_login_response.cookies = {"sessionId": "foobar"}
+
+        mock_inverter_data_response = mock.Mock(Response)
+        mock_inverter_data_response.status_code = 200
+        mock_inverter_data_response.content = json.dumps(
+            [create_inverter_data()]
+        ).encode()
+
+        mock_requests_get.side_effect = [
+            mock_login_response,
+            mock_inverter_data_response,
+            mock_inverter_data_response,
+            mock_inverter_data_response,
+        ]
+
+        self.assertEqual(list(envoy.get_inverter_data()), ["foobar"])
+
+        # The cycle failed, so its reports are decoded again
+        self.assertEqual(list(envoy.get_inverter_data()), ["foobar"])
+        envoy.commit_inverter_data()
+
+        # Once handled, the same payload again has no new reports
+        self.assertEqual(len(envoy.get_inverter_data()), 0)
+
+    def test_capture_payloads(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        mock_capture = mock.Mock(PayloadCapture)
+        envoy = Envoy(
+            url="http://envoy.local",
+            enphase_energy=mock_enphase_energy,
+            capture=mock_capture,
+        )
+
+        mock_enphase_energy.get_token.return_value = "foobar"
+
+        mock_login_response = mock.Mock(Response)
+        mock_login_response.cookies = {"sessionId": "foobar"}
+
+        test_inverter_data = [create_inverter_data()]
+        mock_inverter_data_response = mock.Mock(Response)
+        mock_inverter_data_response.status_code = 200
+        mock_inverter_data_response.content = json.dumps(test_inverter_data).encode()
+
+        mock_requests_get.side_effect = [
+            mock_login_response,
+            mock_inverter_data_response,
+        ]
+
+        envoy.get_inverter_data()
+
+        mock_capture.record.assert_called_once_with(
+            "http://envoy.local", "inverters", json.dumps(test_inverter_data).encode()
+        )
+
+    def test_record_changed_payloads(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        mock_recorder = mock.Mock(PayloadRecorder)
+        envoy = Envoy(
+            url="http://envoy.local",
+            enphase_energy=mock_enphase_energy,
+            recorder=mock_recorder,
+            tag="garage",
+        )
+
+        mock_enphase_energy.get_token.return_value = "foobar"
+
+        mock_login_response = mock.Mock(Response)
+        mock_login_response.cookies = {"sessionId": "foobar"}
+
+        test_inverter_data = json.dumps([create_inverter_data()]).encode()
+        mock_inverter_data_response = mock.Mock(Response)
+        mock_inverter_data_response.status_code = 200
+        mock_inverter_data_response.content = test_inverter_data
+
+        mock_requests_get.side_effect = [
+            mock_login_response,
+            mock_inverter_data_response,
+            mock_inverter_data_response,
+        ]
+
+        envoy.get_inverter_data()
+        envoy.get_inverter_data()
+
+        # The unchanged payload is not recorded again
+        mock_recorder.record.assert_called_once_with(
+            "garage", "inverters", test_inverter_data
+        )
+
+    def test_timeouts_are_counted(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        envoy = Envoy(
+            url="http://envoy.local",
+            enphase_energy=mock_enphase_energy,
+            session_id="foobar",
+            session_id_last_update=datetime.now(),
+        )
+
+        mock_requests_get.side_effect = requests.ReadTimeout()
+
+        labels = {"endpoint": "production"}
+        before = REGISTRY.get_sample_value("envoy_logger_envoy_timeouts_total", labels)
+        with self.assertRaises(requests.ReadTimeout):
+            envoy.get_power_data()
+
+        self.assertEqual(
+            REGISTRY.get_sample_value("envoy_logger_envoy_timeouts_total", labels),
+            (before or 0) + 1,
+        )
+
+    def test_session_reused_with_cookie_and_timeouts(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        envoy = Envoy(
+            url="http://envoy.local",
+            enphase_energy=mock_enphase_energy,
+            pool_size=4,
+            timeouts={"production": 5},
+        )
+
+        mock_enphase_energy.get_token.return_value = "foobar"
+
+        mock_login_response = mock.Mock(Response)
+        mock_login_response.cookies = {"sessionId": "foobar"}
+
+        mock_power_data_response = mock.Mock(Response)
+        mock_power_data_response.status_code = 200
+        mock_power_data_response.content = json.dumps(create_sample_data()).encode()
+
+        mock_requests_get.side_effect = [
+            mock_login_response,
+            mock_power_data_response,
+            mock_power_data_response,
+        ]
+
+        envoy.get_power_data()
+        envoy.get_power_data()
+
+        # Logged in only once, subsequent requests reuse the session cookie
+        self.assertEqual(mock_requests_get.call_count, 3)
+        self.assertEqual(envoy.session.cookies.get("sessionId"), "foobar")
+        self.assertEqual(mock_requests_get.call_args.kwargs["timeout"], 5)
+        self.assertEqual(
+            envoy.session.get_adapter("https://envoy.local")._pool_maxsize, 4
+        )
+
+    def test_cached_token_and_session(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache_path = os.path.join(tmp_dir.name, "auth", "serial123.json")
+
+        cache = TokenCache(cache_path)
+        cache.set_session("foobar", datetime.now())
+
+        envoy = Envoy(
+            url="http://envoy.local",
+            enphase_energy=mock_enphase_energy,
+            cache=TokenCache(cache_path),
+        )
+
+        # Warm start goes straight to sampling without logging in
+        self.assertEqual(envoy.get_session_id(), "foobar")
+        mock_enphase_energy.get_token.assert_not_called()
+        mock_requests_get.assert_not_called()
+        self.assertEqual(os.stat(cache_path).st_mode & 0o777, 0o600)
+
+    def test_rejected_session_logs_in_again(
+        self, mock_requests_post, mock_requests_get, mock_enphase_energy
+    ):
+        envoy = Envoy(url="http://envoy.local", enphase_energy=mock_enphase_energy)
+        envoy.session_id = "stale"
+        envoy.session_id_last_update = datetime.now()
+
+        mock_enphase_energy.get_token.return_value = "foobar"
+
+        mock_rejected_response = mock.Mock(Response)
+        mock_rejected_response.status_code = 401
+
+        mock_login_response = mock.Mock(Response)
+        mock_login_response.cookies = {"sessionId": "foobar"}
+
+        mock_inverter_data_response = mock.Mock(Response)
+        mock_inverter_data_response.status_code = 200
+        mock_inverter_data_response.content = json.dumps(
+            [create_inverter_data()]
+        ).encode()
+
+        mock_requests_get.side_effect = [
+            mock_rejected_response,
+            mock_login_response,
+            mock_inverter_data_response,
+        ]
+
+        inverter_data = envoy.get_inverter_data()
+
+        self.assertEqual(envoy.session_id, "foobar")
+        self.assertEqual(list(inverter_data.keys()), ["foobar"])
+
 
 if __name__ == "__main__":
     unittest.main()
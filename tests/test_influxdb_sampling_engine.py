@@ -1,5 +1,6 @@
+import tempfile
 import unittest
-from datetime import date
+from datetime import date, datetime, time, timedelta
 from unittest import mock
 
 from influxdb_client.client.flux_table import FluxTable, TableList
@@ -10,7 +11,7 @@ from tests.sample_data import (
     create_sample_data,
 )
 
-from envoy_logger.influxdb_sampling_engine import InfluxdbSamplingEngine
+from envoy_logger.influxdb_sampling_engine import InfluxdbSamplingEngine, InfluxdbSink
 from envoy_logger.model import SampleData, parse_inverter_data
 
 
@@ -19,6 +20,10 @@ from envoy_logger.model import SampleData, parse_inverter_data
 @mock.patch("envoy_logger.envoy.Envoy")
 @mock.patch("envoy_logger.config.Config")
 class TestInfluxdbSamplingEngine(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.state_dir.cleanup)
+
     def test_collect_samples(
         self,
         mock_config,
@@ -35,6 +40,12 @@ class TestInfluxdbSamplingEngine(unittest.TestCase):
         mock_config.influxdb_bucket_hr = "foobar_hr"
         mock_config.influxdb_bucket_lr = "foobar_lr"
         mock_config.source_tag = "envoy"
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = None
+        mock_config.influxdb_daily_energy = "incremental"
+        mock_config.influxdb_rollups = []
+        mock_config.state_dir = self.state_dir.name
         mock_config.inverters = {"foo": {}, "bar": {}}
 
         test_sample_data = SampleData.create(sample_data=create_sample_data())
@@ -46,10 +57,10 @@ class TestInfluxdbSamplingEngine(unittest.TestCase):
         sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
         sampling_engine.influxdb_query_api = mock_query_api
 
-        # Collect first (missing inverter data)
+        # Collect first
         sampling_engine._collect_samples()
 
-        # Collect again (now has new inverter data)
+        # Collect again (with a different inverter)
         test_inverter_data = parse_inverter_data([create_inverter_data("foobarB")])
         mock_envoy.get_inverter_data.return_value = test_inverter_data
 
@@ -75,6 +86,12 @@ class TestInfluxdbSamplingEngine(unittest.TestCase):
         mock_config.influxdb_bucket_hr = "foobar_hr"
         mock_config.influxdb_bucket_lr = "foobar_lr"
         mock_config.source_tag = "envoy"
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = None
+        mock_config.influxdb_daily_energy = "incremental"
+        mock_config.influxdb_rollups = []
+        mock_config.state_dir = self.state_dir.name
         mock_config.inverters = {"foo": {}, "bar": {}}
 
         test_sample_data = SampleData.create(
@@ -88,10 +105,10 @@ class TestInfluxdbSamplingEngine(unittest.TestCase):
         sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
         sampling_engine.influxdb_query_api = mock_query_api
 
-        # Collect first (missing inverter data)
+        # Collect first
         sampling_engine._collect_samples()
 
-        # Collect again (now has new inverter data)
+        # Collect again (with a different inverter)
         test_inverter_data = parse_inverter_data([create_inverter_data("foobarB")])
         mock_envoy.get_inverter_data.return_value = test_inverter_data
 
@@ -101,6 +118,213 @@ class TestInfluxdbSamplingEngine(unittest.TestCase):
         # from hitting it indirectly
         sampling_engine._compute_daily_Wh_points(date.today())
 
+    def test_inverter_power_written_as_integer(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_influxdb_client,
+        mock_query_api,
+    ):
+        mock_config.source_tag = "envoy"
+        mock_config.inverters = {}
+        mock_config.inverter_tags.return_value = {}
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = None
+        mock_config.influxdb_daily_energy = "incremental"
+        mock_config.influxdb_rollups = []
+        mock_config.state_dir = self.state_dir.name
+
+        sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
+        inverter = create_inverter_data("foobar")
+        inverter["lastReportWatts"] = 123.7
+
+        lines = sampling_engine._get_high_rate_points(
+            SampleData.create(sample_data=create_sample_data()),
+            parse_inverter_data([inverter]),
+        ).splitlines()
+
+        # Existing inverter series have an integer field, which a float would conflict with
+        inverter_lines = [line for line in lines if line.startswith(b"inverter-")]
+        self.assertEqual(len(inverter_lines), 1)
+        self.assertIn(b" P=123i ", inverter_lines[0])
+
+    def test_daily_summary_from_energy_totals(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_influxdb_client,
+        mock_query_api,
+    ):
+        mock_config.influxdb_bucket_hr = "foobar_hr"
+        mock_config.influxdb_bucket_lr = "foobar_lr"
+        mock_config.source_tag = "envoy"
+        mock_config.inverters = {"foo": {}}
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = None
+        mock_config.influxdb_daily_energy = "incremental"
+        mock_config.influxdb_rollups = []
+        mock_config.state_dir = self.state_dir.name
+
+        sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
+        sampling_engine.influxdb_query_api = mock_query_api
+
+        # Pretend the integrator has been running since yesterday
+        yesterday = date.today() - timedelta(days=1)
+        integrator = sampling_engine._get_energy_integrator("envoy")
+        integrator.roll_over(yesterday - timedelta(days=1))
+        integrator.roll_over(yesterday)
+        # ... and sampling until shortly before midnight
+        ts = datetime.combine(yesterday, time(23, 0))
+        for minutes in range(0, 60, 10):
+            integrator.add(
+                "production", 0, (ts + timedelta(minutes=minutes)).timestamp(), 1200.0
+            )
+
+        points = sampling_engine._low_rate_points(
+            SampleData.create(sample_data=create_sample_data()),
+            parse_inverter_data([]),
+            "envoy",
+        )
+
+        mock_query_api.query.assert_not_called()
+        lines = sorted(p.to_line_protocol() for p in points)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("inverter-daily-summary-foo,"))
+        self.assertIn("Wh=0", lines[0])
+        self.assertTrue(lines[1].startswith("production-daily-summary-line0,"))
+        self.assertIn("Wh=1000", lines[1])
+
+    def test_replay_never_queries_daily_totals(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_influxdb_client,
+        mock_query_api,
+    ):
+        mock_config.source_tag = "envoy"
+        mock_config.inverters = {}
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = None
+        mock_config.influxdb_rollups = []
+        mock_config.state_dir = self.state_dir.name
+
+        sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
+        sampling_engine.influxdb_query_api = mock_query_api
+        sampling_engine.persist_state = False
+        yesterday = date.today() - timedelta(days=1)
+
+        # The replayed day was not fully recorded
+        mock_config.influxdb_daily_energy = "incremental"
+        sampling_engine._get_energy_integrator("envoy").roll_over(yesterday)
+        points = sampling_engine._low_rate_points(
+            SampleData.create(sample_data=create_sample_data()),
+            parse_inverter_data([]),
+            "envoy",
+        )
+        self.assertEqual(points, [])
+
+        # Flux is only integrated over the time before now, rather than the replayed day
+        mock_config.influxdb_daily_energy = "flux"
+        sampling_engine.todays_date["envoy"] = yesterday
+        sampling_engine._low_rate_points(
+            SampleData.create(sample_data=create_sample_data()),
+            parse_inverter_data([]),
+            "envoy",
+        )
+
+        mock_query_api.query.assert_not_called()
+
+    @mock.patch("envoy_logger.influxdb_sampling_engine.InfluxdbBatchWriter")
+    @mock.patch("envoy_logger.influxdb_sampling_engine.Spool")
+    def test_writer_factory(
+        self,
+        mock_spool,
+        mock_batch_writer,
+        mock_config,
+        mock_envoy,
+        mock_influxdb_client,
+        mock_query_api,
+    ):
+        mock_config.envoys = []
+        mock_config.influxdb_batching = mock.Mock()
+        mock_config.influxdb_spool = mock.Mock()
+        mock_config.internal_metrics_influxdb_interval = None
+        writer_factory = mock.Mock()
+
+        sink = InfluxdbSink(
+            config=mock_config, persist_state=False, writer_factory=writer_factory
+        )
+
+        # The configured spool and batch writer are never started
+        writer_factory.assert_called_once_with(sink.influxdb_write_api)
+        self.assertEqual(sink.influxdb_writer, writer_factory.return_value)
+        mock_spool.assert_not_called()
+        mock_batch_writer.assert_not_called()
+
+    def test_internal_metrics_points(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_influxdb_client,
+        mock_query_api,
+    ):
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = 60
+
+        sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
+
+        # Not due until the interval has passed
+        self.assertEqual(sampling_engine._internal_metrics_points(), [])
+
+        sampling_engine._internal_metrics_last_write -= 60
+        points = sampling_engine._internal_metrics_points()
+
+        self.assertEqual(len(points), 1)
+        self.assertTrue(
+            points[0].to_line_protocol().startswith("envoy_logger_internal ")
+        )
+        self.assertEqual(sampling_engine._internal_metrics_points(), [])
+
+    def test_rollup_points(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_influxdb_client,
+        mock_query_api,
+    ):
+        mock_config.source_tag = "envoy"
+        mock_config.influxdb_batching = None
+        mock_config.influxdb_spool = None
+        mock_config.internal_metrics_influxdb_interval = None
+        mock_config.influxdb_rollups = [mock.Mock(resolution_seconds=60, bucket="1m")]
+
+        sampling_engine = InfluxdbSamplingEngine(envoy=mock_envoy, config=mock_config)
+
+        inverter_sample = create_inverter_data("foobarA")
+        inverter_sample["lastReportDate"] = 0
+        sampling_engine._rollup_points(
+            SampleData.create(sample_data=create_sample_data()),
+            parse_inverter_data([inverter_sample]),
+            "envoy",
+        )
+
+        inverter_sample["lastReportDate"] = 60
+        points = sampling_engine._rollup_points(
+            SampleData.create(sample_data=create_sample_data()),
+            parse_inverter_data([inverter_sample]),
+            "envoy",
+        )
+
+        self.assertEqual(list(points.keys()), ["1m"])
+        line = points["1m"][0].to_line_protocol()
+        self.assertTrue(line.startswith("inverter-production-foobarA,interval=1m,"))
+        self.assertIn("P_mean=123", line)
+        self.assertTrue(line.endswith(" 0"))
+
 
 if __name__ == "__main__":
     unittest.main()
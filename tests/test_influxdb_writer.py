@@ -0,0 +1,272 @@
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from influxdb_client import Point, WritePrecision
+from influxdb_client.client.write_api import WriteApi
+from prometheus_client import REGISTRY
+
+from envoy_logger.influxdb_writer import (
+    InfluxdbBatchWriter,
+    InfluxdbSpoolingWriter,
+    spool_points,
+)
+from envoy_logger.spool import Spool
+
+
+def _create_points(count: int):
+    return [Point("foobar").field("P", float(i)) for i in range(count)]
+
+
+class TestInfluxdbBatchWriter(unittest.TestCase):
+    def test_write_batches(self):
+        mock_write_api = mock.Mock(WriteApi)
+
+        writer = InfluxdbBatchWriter(mock_write_api, batch_size=4, flush_interval=0.05)
+        writer.write(bucket="foobar_hr", record=_create_points(10))
+        writer.close(timeout=5)
+
+        batch_sizes = [
+            len(call.kwargs["record"]) for call in mock_write_api.write.call_args_list
+        ]
+        self.assertEqual(sum(batch_sizes), 10)
+        self.assertTrue(all(size <= 4 for size in batch_sizes))
+
+        stats = writer.stats()
+        self.assertEqual(stats.points_written, 10)
+        self.assertEqual(stats.points_dropped, 0)
+        self.assertEqual(stats.queue_depth, 0)
+
+    def test_write_retry(self):
+        mock_write_api = mock.Mock(WriteApi)
+        mock_write_api.write.side_effect = [Exception("foobar"), None]
+
+        writer = InfluxdbBatchWriter(
+            mock_write_api, flush_interval=0.05, retry_interval=0.01
+        )
+        writer.write(bucket="foobar_hr", record=_create_points(2))
+        writer.close(timeout=5)
+
+        stats = writer.stats()
+        self.assertEqual(mock_write_api.write.call_count, 2)
+        self.assertEqual(stats.write_retries, 1)
+        self.assertEqual(stats.points_written, 2)
+
+    def test_write_drop_after_retries(self):
+        mock_write_api = mock.Mock(WriteApi)
+        mock_write_api.write.side_effect = Exception("foobar")
+
+        writer = InfluxdbBatchWriter(
+            mock_write_api, flush_interval=0.05, max_retries=2, retry_interval=0.01
+        )
+        writer.write(bucket="foobar_hr", record=_create_points(3))
+        writer.close(timeout=5)
+
+        self.assertEqual(mock_write_api.write.call_count, 3)
+        self.assertEqual(writer.stats().points_dropped, 3)
+
+    def test_backpressure_drop_oldest(self):
+        mock_write_api = mock.Mock(WriteApi)
+        write_blocked = threading.Event()
+        mock_write_api.write.side_effect = lambda **kwargs: write_blocked.wait(5)
+
+        writer = InfluxdbBatchWriter(
+            mock_write_api,
+            batch_size=1,
+            flush_interval=0.01,
+            max_queue_depth=2,
+            backpressure="drop_oldest",
+        )
+        writer.write(bucket="foobar_hr", record=_create_points(10))
+        self.assertLessEqual(writer.queue_depth, 2)
+
+        write_blocked.set()
+        writer.close(timeout=5)
+
+        self.assertGreater(writer.stats().points_dropped, 0)
+
+    def test_write_encoded_lines(self):
+        mock_write_api = mock.Mock(WriteApi)
+
+        writer = InfluxdbBatchWriter(mock_write_api, batch_size=2, flush_interval=0.05)
+        writer.write(
+            bucket="foobar_hr", record=b"foobar P=1 1\nfoobar P=2 2\nfoobar P=3 3\n"
+        )
+        writer.close(timeout=5)
+
+        records = [
+            line
+            for call in mock_write_api.write.call_args_list
+            for line in call.kwargs["record"]
+        ]
+        self.assertEqual(records, [b"foobar P=1 1", b"foobar P=2 2", b"foobar P=3 3"])
+        self.assertEqual(writer.stats().points_written, 3)
+
+    def test_drop_oldest_race(self):
+        writer = InfluxdbBatchWriter(mock.Mock(WriteApi), backpressure="drop_oldest")
+        writer.close(timeout=5)
+
+        # The queue was full, but the writer emptied it before the oldest was dropped
+        with mock.patch.object(
+            writer._queue, "put_nowait", side_effect=[queue.Full, None]
+        ), mock.patch.object(writer._queue, "get_nowait", side_effect=queue.Empty):
+            writer.write(bucket="foobar_hr", record=_create_points(1))
+
+        self.assertEqual(writer.stats().points_dropped, 0)
+
+    def test_stats_exported(self):
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0.0
+
+        written = sample("envoy_logger_influxdb_points_total", outcome="written")
+        writes = sample("envoy_logger_sink_write_seconds_count", sink="influxdb")
+
+        mock_write_api = mock.Mock(WriteApi)
+        writer = InfluxdbBatchWriter(mock_write_api, flush_interval=0.05)
+        writer.write(bucket="foobar_hr", record=_create_points(3))
+        writer.close(timeout=5)
+
+        self.assertEqual(
+            sample("envoy_logger_influxdb_points_total", outcome="written"),
+            written + 3,
+        )
+        self.assertEqual(
+            sample("envoy_logger_sink_write_seconds_count", sink="influxdb"),
+            writes + 1,
+        )
+        self.assertEqual(sample("envoy_logger_influxdb_queue_depth"), 0)
+
+    def test_on_written(self):
+        mock_write_api = mock.Mock(WriteApi)
+        written = threading.Event()
+        mock_write_api.write.side_effect = lambda **kwargs: written.wait(5)
+        callback = mock.Mock()
+
+        writer = InfluxdbBatchWriter(mock_write_api, flush_interval=0.05)
+        writer.write(bucket="foobar_hr", record=_create_points(2))
+        writer.on_written(callback)
+
+        # Not before InfluxDB accepted the points
+        time.sleep(0.1)
+        callback.assert_not_called()
+
+        written.set()
+        writer.close(timeout=5)
+        callback.assert_called_once_with()
+        self.assertEqual(writer.stats().points_written, 2)
+
+    def test_on_written_not_called_for_dropped_points(self):
+        mock_write_api = mock.Mock(WriteApi)
+        mock_write_api.write.side_effect = Exception("foobar")
+        callback = mock.Mock()
+
+        writer = InfluxdbBatchWriter(mock_write_api, flush_interval=0.05, max_retries=0)
+        writer.write(bucket="foobar_hr", record=_create_points(2))
+        writer.on_written(callback)
+        writer.close(timeout=5)
+
+        callback.assert_not_called()
+
+    def test_invalid_backpressure(self):
+        with self.assertRaises(ValueError):
+            InfluxdbBatchWriter(mock.Mock(WriteApi), backpressure="foobar")
+
+    def test_write_spool_after_retries(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        spool = Spool(tmp_dir.name)
+
+        mock_write_api = mock.Mock(WriteApi)
+        mock_write_api.write.side_effect = Exception("foobar")
+
+        writer = InfluxdbBatchWriter(
+            mock_write_api,
+            flush_interval=0.05,
+            max_retries=1,
+            retry_interval=0.01,
+            spool=spool,
+        )
+        writer.write(bucket="foobar_hr", record=_create_points(3))
+        writer.close(timeout=5)
+
+        self.assertTrue(spool.pending())
+        self.assertEqual(writer.stats().points_dropped, 0)
+
+
+class TestInfluxdbSpoolingWriter(unittest.TestCase):
+    def test_spool_and_replay(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        spool = Spool(tmp_dir.name)
+
+        mock_write_api = mock.Mock(WriteApi)
+        writer = InfluxdbSpoolingWriter(mock_write_api, spool)
+
+        # Database is down, so points are spooled instead of raising
+        mock_write_api.write.side_effect = Exception("foobar")
+        writer.write(bucket="foobar_hr", record=_create_points(2))
+        self.assertTrue(spool.pending())
+
+        # Database is back, so the spooled points are replayed after the write
+        mock_write_api.write.side_effect = None
+        writer.write(bucket="foobar_hr", record=_create_points(1))
+        self.assertFalse(spool.pending())
+
+        replay_call = mock_write_api.write.call_args_list[-1]
+        self.assertEqual(replay_call.kwargs["bucket"], "foobar_hr")
+        self.assertEqual(len(replay_call.kwargs["record"]), 2)
+
+    def test_spool_encoded_lines(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        spool = Spool(tmp_dir.name)
+
+        mock_write_api = mock.Mock(WriteApi)
+        mock_write_api.write.side_effect = Exception("foobar")
+        writer = InfluxdbSpoolingWriter(mock_write_api, spool)
+        writer.write(bucket="foobar_hr", record=b"foobar P=1 1\nfoobar P=2 2\n")
+
+        mock_write_api.write.side_effect = None
+        writer.write(bucket="foobar_hr", record=_create_points(1))
+
+        replay_call = mock_write_api.write.call_args_list[-1]
+        self.assertEqual(replay_call.kwargs["record"], ["foobar P=1 1", "foobar P=2 2"])
+
+    def test_replay_one_segment_per_write(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        spool = Spool(tmp_dir.name, segment_max_bytes=1)
+
+        mock_write_api = mock.Mock(WriteApi)
+        writer = InfluxdbSpoolingWriter(mock_write_api, spool)
+
+        mock_write_api.write.side_effect = Exception("foobar")
+        writer.write(bucket="foobar_hr", record=b"foobar P=1 1\n")
+        writer.write(bucket="foobar_hr", record=b"foobar P=2 2\n")
+
+        # Each write replays one segment, so the backlog never stalls a cycle for long
+        mock_write_api.write.side_effect = None
+        writer.write(bucket="foobar_hr", record=_create_points(1))
+        self.assertTrue(spool.pending())
+        writer.write(bucket="foobar_hr", record=_create_points(1))
+        self.assertFalse(spool.pending())
+
+    def test_spool_scales_times_to_ns(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        spool = Spool(tmp_dir.name)
+
+        # Such as a rollup point, with its window start given in seconds
+        point = Point("foobar").field("P", 1.5).time(1699999980, WritePrecision.S)
+        spool_points(spool, "foobar_1m", [point, Point("barfoo").field("P", 2)])
+
+        lines = []
+        spool.replay(lambda bucket, batch: lines.extend(batch))
+        self.assertEqual(lines, ["foobar P=1.5 1699999980000000000", "barfoo P=2i"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import time
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+from tests.sample_data import create_sample_data
+
+from envoy_logger.internal_metrics import (
+    DECODE_SECONDS,
+    SAMPLE_RETRIES,
+    internal_metrics_fields,
+    observe_freshness,
+    timed,
+)
+from envoy_logger.model import SampleData
+
+
+def get_sample_value(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+class TestInternalMetrics(unittest.TestCase):
+    def test_timed(self):
+        labels = {"endpoint": "test_timed"}
+        with timed(DECODE_SECONDS.labels(**labels)):
+            pass
+
+        self.assertEqual(
+            get_sample_value("envoy_logger_decode_seconds_count", labels), 1
+        )
+
+    def test_timed_observes_failures(self):
+        labels = {"endpoint": "test_timed_observes_failures"}
+        with self.assertRaises(ValueError):
+            with timed(DECODE_SECONDS.labels(**labels)):
+                raise ValueError()
+
+        self.assertEqual(
+            get_sample_value("envoy_logger_decode_seconds_count", labels), 1
+        )
+
+    @mock.patch("envoy_logger.internal_metrics.time.time")
+    def test_observe_freshness(self, mock_time):
+        sample_data = SampleData.create(sample_data=create_sample_data())
+        reading_time = sample_data.total_production.eim_line_samples[0].ts
+        mock_time.return_value = reading_time.timestamp() + 2
+
+        observe_freshness("test_observe_freshness", sample_data)
+
+        self.assertAlmostEqual(
+            get_sample_value(
+                "envoy_logger_freshness_lag_seconds_sum",
+                {"sink": "test_observe_freshness"},
+            ),
+            2,
+        )
+
+    def test_internal_metrics_fields(self):
+        SAMPLE_RETRIES.inc()
+        with timed(DECODE_SECONDS.labels(endpoint="production")):
+            time.sleep(0)
+
+        fields = internal_metrics_fields()
+
+        self.assertEqual(
+            fields["sample_retries_total"],
+            get_sample_value("envoy_logger_sample_retries_total"),
+        )
+        self.assertIn("decode_seconds_count_production", fields)
+        self.assertIn("decode_seconds_sum_production", fields)
+        self.assertFalse(any("bucket" in name for name in fields))
+
+
+if __name__ == "__main__":
+    unittest.main()
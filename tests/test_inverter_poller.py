@@ -0,0 +1,83 @@
+import unittest
+from unittest import mock
+
+from tests.sample_data import create_inverter_data
+
+from envoy_logger.inverter_poller import InverterPoller
+from envoy_logger.model import SerialIndex, parse_inverter_data
+
+
+@mock.patch("envoy_logger.inverter_poller.time.monotonic")
+class TestInverterPoller(unittest.TestCase):
+    def setUp(self):
+        self.index = SerialIndex()
+        self.poller = InverterPoller(min_interval=5, max_interval=300)
+
+    def _poll(self, mock_monotonic, now, reports):
+        mock_monotonic.return_value = now
+        due = self.poller.due()
+        if due:
+            inverters = []
+            for serial, last_report in reports.items():
+                inverter = create_inverter_data(serial)
+                inverter["lastReportDate"] = last_report
+                inverters.append(inverter)
+            self.poller.update(parse_inverter_data(inverters, self.index))
+        return due
+
+    def test_learn_cadence(self, mock_monotonic):
+        # Polled every cycle until the cadence is known
+        self.assertTrue(self._poll(mock_monotonic, 0, {"a": 1000}))
+        self.assertTrue(self._poll(mock_monotonic, 5, {"a": 1000}))
+        self.assertTrue(self._poll(mock_monotonic, 300, {"a": 1300}))
+
+        # Next report is expected 300s later, minus one cycle of slack
+        self.assertFalse(self._poll(mock_monotonic, 305, {"a": 1300}))
+        self.assertFalse(self._poll(mock_monotonic, 590, {"a": 1300}))
+        self.assertTrue(self._poll(mock_monotonic, 595, {"a": 1595}))
+
+        self.assertEqual(self.poller.polls, 4)
+        self.assertEqual(self.poller.skipped, 2)
+
+    def test_overdue_backs_off(self, mock_monotonic):
+        self._poll(mock_monotonic, 0, {"a": 1000})
+        self._poll(mock_monotonic, 60, {"a": 1060})
+
+        # The report expected at 115 is late
+        self.assertTrue(self._poll(mock_monotonic, 115, {"a": 1060}))
+        self.assertFalse(self._poll(mock_monotonic, 120, {"a": 1060}))
+        self.assertTrue(self._poll(mock_monotonic, 125, {"a": 1060}))
+        self.assertFalse(self._poll(mock_monotonic, 140, {"a": 1060}))
+        self.assertTrue(self._poll(mock_monotonic, 145, {"a": 1060}))
+
+        # Never backs off beyond the cadence
+        self.assertTrue(self._poll(mock_monotonic, 185, {"a": 1060}))
+        self.assertFalse(self._poll(mock_monotonic, 244, {"a": 1060}))
+        self.assertTrue(self._poll(mock_monotonic, 245, {"a": 1060}))
+
+    def test_stops_learning_silent_inverters(self, mock_monotonic):
+        # "b" reported once, and never again, so the endpoint is polled every cycle
+        for now in range(0, 300, 60):
+            self.assertTrue(
+                self._poll(mock_monotonic, now, {"a": 1000 + now, "b": 500})
+            )
+
+        # After max_interval, only the cadence of "a" drives the schedule
+        self.assertTrue(self._poll(mock_monotonic, 300, {"a": 1300, "b": 500}))
+        self.assertFalse(self._poll(mock_monotonic, 305, {"a": 1300, "b": 500}))
+        self.assertTrue(self._poll(mock_monotonic, 355, {"a": 1360, "b": 500}))
+
+    def test_no_learned_cadence(self, mock_monotonic):
+        self.assertTrue(self._poll(mock_monotonic, 0, {"a": 1000}))
+        self.assertTrue(self._poll(mock_monotonic, 295, {"a": 1000}))
+
+        # Backs off rather than polling every cycle forever
+        self.assertTrue(self._poll(mock_monotonic, 300, {"a": 1000}))
+        self.assertFalse(self._poll(mock_monotonic, 305, {"a": 1000}))
+        self.assertTrue(self._poll(mock_monotonic, 310, {"a": 1000}))
+        self.assertFalse(self._poll(mock_monotonic, 325, {"a": 1000}))
+        self.assertTrue(self._poll(mock_monotonic, 330, {"a": 1000}))
+
+
+if __name__ == "__main__":
+    unittest.main()
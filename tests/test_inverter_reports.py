@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from tests.sample_data import create_inverter_data
+
+from envoy_logger.inverter_reports import InverterReportIndex
+from envoy_logger.model import parse_inverter_data
+
+
+class TestInverterReportIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "inverter_reports", "envoy.json")
+
+    def test_persistence(self):
+        inverter = create_inverter_data("foobar")
+        inverter["lastReportDate"] = 1000
+        inverter_data = parse_inverter_data([inverter])
+
+        inverter_reports = InverterReportIndex(self.path)
+        self.assertEqual(list(inverter_reports.filter_new(inverter_data)), ["foobar"])
+        inverter_reports.save()
+
+        # Already emitted before the restart
+        restored = InverterReportIndex(self.path)
+        self.assertEqual(len(restored.filter_new(inverter_data)), 0)
+
+        inverter["lastReportDate"] = 1300
+        self.assertEqual(
+            list(restored.filter_new(parse_inverter_data([inverter]))), ["foobar"]
+        )
+
+    def test_unreadable_state(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("[")
+
+        inverter_reports = InverterReportIndex(self.path)
+
+        self.assertEqual(inverter_reports.last_reports, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
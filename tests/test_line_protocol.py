@@ -0,0 +1,104 @@
+import unittest
+from unittest import mock
+
+from influxdb_client import Point, WritePrecision
+from tests.sample_data import create_inverter_data, create_sample_data
+
+from envoy_logger.config import InverterConfig
+from envoy_logger.line_protocol import LineProtocolEncoder, format_float, series_key
+from envoy_logger.model import SampleData, parse_inverter_data
+
+
+@mock.patch("envoy_logger.config.Config")
+class TestLineProtocolEncoder(unittest.TestCase):
+    def test_encode_matches_points(self, mock_config):
+        inverter = InverterConfig({"tags": {"row": 1, "array": "south roof"}}, "foobar")
+        mock_config.inverters = {"foobar": inverter}
+        mock_config.inverter_tags.side_effect = lambda serial: inverter.tags
+
+        sample_data = SampleData.create(sample_data=create_sample_data())
+        inverter_data = parse_inverter_data([create_inverter_data("foobar")])
+
+        encoder = LineProtocolEncoder(mock_config)
+        encoder.warm(["envoy"])
+        lines = encoder.encode(sample_data, inverter_data, "envoy").splitlines()
+
+        expected = []
+        for measurement_type, eim_sample in (
+            ("consumption", sample_data.total_consumption),
+            ("production", sample_data.total_production),
+            ("net", sample_data.net_consumption),
+        ):
+            for idx, line_sample in enumerate(eim_sample.eim_line_samples):
+                p = Point(f"{measurement_type}-line{idx}")
+                p.time(line_sample.ts, WritePrecision.S)
+                p.tag("source", "envoy")
+                p.tag("measurement-type", measurement_type)
+                p.tag("line-idx", idx)
+                p.field("P", line_sample.wNow)
+                p.field("Q", line_sample.reactPwr)
+                p.field("S", line_sample.apprntPwr)
+                p.field("I_rms", line_sample.rmsCurrent)
+                p.field("V_rms", line_sample.rmsVoltage)
+                expected.append(p)
+
+        for serial, ts, watts in inverter_data.rows():
+            p = Point(f"inverter-production-{serial}")
+            p.time(int(ts), WritePrecision.S)
+            p.tag("source", "envoy")
+            p.tag("measurement-type", "inverter")
+            p.tag("serial", serial)
+            inverter.apply_tags_to_point(p)
+            p.field("P", int(watts))
+            expected.append(p)
+
+        # The points are written at second precision, the encoded lines at nanosecond
+        self.assertEqual(
+            [line.decode() for line in lines],
+            [p.to_line_protocol() + "000000000" for p in expected],
+        )
+
+    def test_buffer_reuse(self, mock_config):
+        mock_config.inverters = {}
+        mock_config.inverter_tags.return_value = {}
+
+        encoder = LineProtocolEncoder(mock_config)
+        sample_data = SampleData.create(sample_data=create_sample_data())
+
+        first = encoder.encode(
+            sample_data, parse_inverter_data([create_inverter_data("foo")]), "envoy"
+        )
+        second = encoder.encode(
+            sample_data, parse_inverter_data([create_inverter_data("bar")]), "envoy"
+        )
+
+        # Returned buffers are not changed by later cycles
+        self.assertIn(b"inverter-production-foo,", first)
+        self.assertNotIn(b"inverter-production-foo,", second)
+        self.assertEqual(len(first), len(second))
+
+    def test_warm(self, mock_config):
+        mock_config.inverters = {"foo": None, "bar": None}
+        mock_config.inverter_tags.return_value = {}
+
+        encoder = LineProtocolEncoder(mock_config)
+        encoder.warm(["envoy", "garage"])
+
+        self.assertEqual(len(encoder._inverter_keys), 4)
+
+
+class TestLineProtocol(unittest.TestCase):
+    def test_series_key_escaping(self):
+        self.assertEqual(
+            series_key("my measurement,1", {"b": "x=y z", "a": 1, "c": None}),
+            b"my\\ measurement\\,1,a=1,b=x\\=y\\ z ",
+        )
+
+    def test_format_float(self):
+        self.assertEqual(format_float(1.0), b"1")
+        self.assertEqual(format_float(1.25), b"1.25")
+        self.assertIsNone(format_float(float("nan")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime, timezone
+
+from tests.sample_data import create_inverter_data, create_sample_data
+
+from envoy_logger.model import (
+    SampleData,
+    SerialIndex,
+    filter_new_inverter_data,
+    parse_inverter_data,
+)
+
+
+class TestPowerSample(unittest.TestCase):
+    def test_fields(self):
+        sample_data = SampleData.create(sample_data=create_sample_data())
+        line_sample = sample_data.total_production.eim_line_samples[0]
+
+        self.assertEqual(line_sample.wNow, 1.23)
+        self.assertEqual(line_sample.whLastSevenDays, 1.23)
+        self.assertEqual(len(line_sample.values), 14)
+        self.assertEqual(line_sample.asdict()["ts"], line_sample.ts)
+        self.assertEqual(dict(line_sample.items())["rmsVoltage"], 1.23)
+
+
+class TestInverterData(unittest.TestCase):
+    def test_serials_keep_their_slot(self):
+        index = SerialIndex()
+        parse_inverter_data(
+            [create_inverter_data("a"), create_inverter_data("b")], index
+        )
+
+        inverter_data = parse_inverter_data([create_inverter_data("b")], index)
+
+        self.assertEqual(index.serials, ["a", "b"])
+        self.assertEqual(list(inverter_data), ["b"])
+        self.assertNotIn("a", inverter_data)
+        self.assertEqual(
+            [(serial, watts) for serial, _, watts in inverter_data.rows()],
+            [("b", 123)],
+        )
+
+    def test_filter_new_inverter_data(self):
+        old = create_inverter_data("old")
+        old["lastReportDate"] = 100
+        new = create_inverter_data("new")
+        new["lastReportDate"] = 200
+        unseen = create_inverter_data("unseen")
+        unseen["lastReportDate"] = 50
+        inverter_data = parse_inverter_data([old, new, unseen])
+
+        last_reports = {"old": 100.0, "new": 150.0}
+        filtered = filter_new_inverter_data(inverter_data, last_reports)
+
+        self.assertEqual(list(filtered), ["new", "unseen"])
+        self.assertEqual(
+            filtered["new"].ts, datetime.fromtimestamp(200, tz=timezone.utc)
+        )
+        self.assertNotIn("old", filtered)
+        self.assertEqual(last_reports, {"old": 100.0, "new": 200.0, "unseen": 50.0})
+
+        # Every report is only kept once
+        self.assertEqual(len(filter_new_inverter_data(inverter_data, last_reports)), 0)
+
+    def test_filter_changed_slots(self):
+        index = SerialIndex()
+        inverters = [create_inverter_data("a"), create_inverter_data("b")]
+        previous = parse_inverter_data(inverters, index)
+        last_reports = {}
+        filter_new_inverter_data(previous, last_reports)
+
+        inverters[1]["lastReportDate"] += 300
+        inverter_data = parse_inverter_data(inverters, index, previous)
+        self.assertEqual(inverter_data.changed, [1])
+
+        # Only the changed slots are checked
+        del last_reports["a"]
+        filtered = filter_new_inverter_data(inverter_data, last_reports)
+        self.assertEqual(list(filtered), ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
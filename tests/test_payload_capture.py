@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from envoy_logger.payload_capture import PayloadCapture
+
+
+class TestPayloadCapture(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "capture", "payloads.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _read_lines(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_capture_every_nth_payload(self):
+        capture = PayloadCapture(self.path, every=3)
+        for i in range(7):
+            capture.record(
+                "http://envoy.local", "production", json.dumps({"i": i}).encode()
+            )
+        capture.close()
+
+        lines = self._read_lines()
+        self.assertEqual([line["payload"]["i"] for line in lines], [0, 3, 6])
+        self.assertEqual(lines[0]["source"], "http://envoy.local")
+        self.assertEqual(lines[0]["endpoint"], "production")
+
+    def test_endpoints_counted_separately(self):
+        capture = PayloadCapture(self.path, every=2)
+        capture.record(
+            "http://envoy.local", "production", json.dumps({"i": 0}).encode()
+        )
+        capture.record("http://envoy.local", "inverters", json.dumps([]).encode())
+        capture.record(
+            "http://envoy.local", "production", json.dumps({"i": 1}).encode()
+        )
+        capture.close()
+
+        lines = self._read_lines()
+        self.assertEqual(
+            [line["endpoint"] for line in lines], ["production", "inverters"]
+        )
+
+    def test_rotate(self):
+        capture = PayloadCapture(self.path, every=1, max_bytes=100, backup_count=1)
+        for i in range(5):
+            capture.record(
+                "http://envoy.local",
+                "production",
+                json.dumps({"data": "x" * 50}).encode(),
+            )
+        capture.close()
+
+        self.assertTrue(os.path.exists(f"{self.path}.1"))
+        self.assertFalse(os.path.exists(f"{self.path}.2"))
+
+    def test_concurrent_records(self):
+        capture = PayloadCapture(self.path, every=1, max_bytes=2000, backup_count=50)
+
+        def record(source):
+            for i in range(50):
+                capture.record(source, "production", json.dumps({"i": i}).encode())
+
+        threads = [
+            threading.Thread(target=record, args=(f"envoy-{n}",)) for n in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        capture.close()
+
+        # Every line is whole, and none were lost across rollovers
+        lines = []
+        for name in os.listdir(os.path.dirname(self.path)):
+            with open(os.path.join(os.path.dirname(self.path), name), "r") as f:
+                lines.extend(json.loads(line) for line in f)
+        self.assertEqual(len(lines), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
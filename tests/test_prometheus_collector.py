@@ -0,0 +1,176 @@
+import unittest
+from unittest import mock
+
+from tests.sample_data import create_inverter_data, create_sample_data
+
+from envoy_logger.config import InverterConfig
+from envoy_logger.model import SampleData, parse_inverter_data
+from envoy_logger.prometheus_collector import SnapshotCollector, label_name
+
+
+def get_sample_value(metrics, name, labels):
+    for metric in metrics:
+        for sample in metric.samples:
+            if sample.name == name and sample.labels == labels:
+                return sample.value
+    return None
+
+
+@mock.patch("envoy_logger.config.Config")
+class TestSnapshotCollector(unittest.TestCase):
+    def setUp(self):
+        self.sample_data = SampleData.create(sample_data=create_sample_data())
+
+    def test_collect(self, mock_config):
+        mock_config.inverters = {
+            "foobar": InverterConfig({"tags": {"row": 1}}, "foobar")
+        }
+        mock_config.inverter_tag_names.return_value = ["row"]
+
+        collector = SnapshotCollector(mock_config)
+        collector.update(
+            "envoy",
+            self.sample_data,
+            parse_inverter_data([create_inverter_data("foobar")]),
+        )
+
+        metrics = list(collector.collect())
+        self.assertEqual(
+            get_sample_value(
+                metrics,
+                "envoy_line_power_watts",
+                {"type": "total_production", "line": "2", "source": "envoy"},
+            ),
+            1.23,
+        )
+        self.assertEqual(
+            get_sample_value(
+                metrics,
+                "envoy_inverter_power_watts",
+                {"serial": "foobar", "source": "envoy", "row": "1"},
+            ),
+            123,
+        )
+
+    def test_inverter_reports_are_merged(self, mock_config):
+        mock_config.inverters = {}
+        mock_config.inverter_tag_names.return_value = []
+
+        collector = SnapshotCollector(mock_config, cache_seconds=0)
+        collector.update(
+            "envoy", self.sample_data, parse_inverter_data([create_inverter_data("a")])
+        )
+        # The second cycle only has the report of another inverter
+        collector.update(
+            "envoy", self.sample_data, parse_inverter_data([create_inverter_data("b")])
+        )
+
+        metrics = list(collector.collect())
+        for serial in ("a", "b"):
+            self.assertEqual(
+                get_sample_value(
+                    metrics,
+                    "envoy_inverter_power_watts",
+                    {"serial": serial, "source": "envoy"},
+                ),
+                123,
+            )
+
+    def test_render_cache(self, mock_config):
+        mock_config.inverters = {}
+        mock_config.inverter_tag_names.return_value = []
+
+        collector = SnapshotCollector(mock_config, cache_seconds=60)
+        collector.update("envoy", self.sample_data, parse_inverter_data([]))
+
+        with mock.patch.object(
+            collector, "_render", wraps=collector._render
+        ) as mock_render:
+            first = list(collector.collect())
+            second = list(collector.collect())
+
+        mock_render.assert_called_once()
+        self.assertEqual(first, second)
+
+    def test_sample_timestamps(self, mock_config):
+        mock_config.inverters = {}
+        mock_config.inverter_tag_names.return_value = []
+
+        inverter_data = create_inverter_data("foobar")
+        collector = SnapshotCollector(mock_config, timestamps=True)
+        collector.update(
+            "envoy", self.sample_data, parse_inverter_data([inverter_data])
+        )
+
+        samples = {metric.name: metric.samples[0] for metric in collector.collect()}
+        self.assertEqual(
+            samples["envoy_line_power_watts"].timestamp,
+            self.sample_data.net_consumption.eim_line_samples[0].ts.timestamp(),
+        )
+        self.assertEqual(
+            samples["envoy_inverter_power_watts"].timestamp,
+            inverter_data["lastReportDate"],
+        )
+
+    def test_stale_inverters_are_dropped(self, mock_config):
+        mock_config.inverters = {}
+        mock_config.inverter_tag_names.return_value = []
+
+        stale_inverter_data = create_inverter_data("stale")
+        stale_inverter_data["lastReportDate"] -= 3600
+
+        collector = SnapshotCollector(mock_config, inverter_stale_seconds=600)
+        collector.update(
+            "envoy",
+            self.sample_data,
+            parse_inverter_data([create_inverter_data("fresh"), stale_inverter_data]),
+        )
+
+        metrics = list(collector.collect())
+        self.assertEqual(
+            get_sample_value(
+                metrics,
+                "envoy_inverter_power_watts",
+                {"serial": "fresh", "source": "envoy"},
+            ),
+            123,
+        )
+        self.assertIsNone(
+            get_sample_value(
+                metrics,
+                "envoy_inverter_power_watts",
+                {"serial": "stale", "source": "envoy"},
+            )
+        )
+
+    @mock.patch("envoy_logger.prometheus_collector.time.time")
+    def test_last_successful_sample(self, mock_time, mock_config):
+        mock_config.inverter_tag_names.return_value = []
+        mock_time.return_value = 1234.5
+
+        collector = SnapshotCollector(mock_config)
+        collector.update("envoy", self.sample_data, parse_inverter_data([]))
+
+        self.assertEqual(
+            get_sample_value(
+                list(collector.collect()),
+                "envoy_last_successful_sample_timestamp_seconds",
+                {"source": "envoy"},
+            ),
+            1234.5,
+        )
+
+    def test_nothing_to_describe(self, mock_config):
+        mock_config.inverter_tag_names.return_value = []
+
+        collector = SnapshotCollector(mock_config)
+
+        self.assertEqual(collector.describe(), [])
+
+    def test_label_name(self, mock_config):
+        self.assertEqual(label_name("roof-east"), "roof_east")
+        self.assertEqual(label_name("1st"), "_1st")
+
+
+if __name__ == "__main__":
+    unittest.main()
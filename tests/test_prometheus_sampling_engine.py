@@ -1,8 +1,10 @@
 import unittest
 from unittest import mock
 
+from prometheus_client import REGISTRY
 from tests.sample_data import create_inverter_data, create_sample_data
 
+from envoy_logger.config import InverterConfig
 from envoy_logger.model import SampleData, parse_inverter_data
 from envoy_logger.prometheus_sampling_engine import PrometheusSamplingEngine
 
@@ -17,6 +19,7 @@ class TestPrometheusSamplingEngine(unittest.TestCase):
         mock_envoy,
         mock_start_http_server,
     ):
+        mock_config.envoys = [mock.Mock()]
         test_sample_data = SampleData.create(sample_data=create_sample_data())
         test_inverter_data = parse_inverter_data([create_inverter_data("foobar")])
 
@@ -29,6 +32,128 @@ class TestPrometheusSamplingEngine(unittest.TestCase):
             inverter_data=test_inverter_data
         )
 
+    def test_legacy_metrics_single_envoy(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_start_http_server,
+    ):
+        mock_config.envoys = [mock.Mock()]
+        mock_config.prometheus_metrics = "legacy"
+
+        prometheus_sampling_engine = PrometheusSamplingEngine(
+            envoy=mock_envoy, config=mock_config
+        )
+        prometheus_sampling_engine._update_prometheus_inverter_gauge(
+            measurement_name="power", serial="single", source_tag="envoy", value=12
+        )
+
+        # The series keep the names and labels they had before multiple envoys
+        self.assertEqual(REGISTRY.get_sample_value("envoy_inverter_power_single"), 12)
+
+    def test_legacy_metrics_multiple_envoys(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_start_http_server,
+    ):
+        mock_config.envoys = [mock.Mock(), mock.Mock()]
+        mock_config.prometheus_metrics = "legacy"
+
+        prometheus_sampling_engine = PrometheusSamplingEngine(
+            envoy=mock_envoy, config=mock_config
+        )
+        prometheus_sampling_engine._update_prometheus_inverter_gauge(
+            measurement_name="power", serial="multiple", source_tag="west", value=34
+        )
+
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                "envoy_inverter_power_multiple", {"source": "west"}
+            ),
+            34,
+        )
+
+    def test_labeled_metrics(
+        self,
+        mock_config,
+        mock_envoy,
+        mock_start_http_server,
+    ):
+        mock_config.source_tag = "envoy"
+        mock_config.envoys = [mock.Mock()]
+        mock_config.prometheus_metrics = "labeled"
+        mock_config.inverters = {
+            "foobar": InverterConfig({"tags": {"row": 1, "col": 2}}, "foobar")
+        }
+        mock_config.inverter_tag_names.return_value = ["col", "row"]
+
+        test_sample_data = SampleData.create(sample_data=create_sample_data())
+        test_inverter_data = parse_inverter_data([create_inverter_data("foobar")])
+
+        prometheus_sampling_engine = PrometheusSamplingEngine(
+            envoy=mock_envoy, config=mock_config
+        )
+
+        prometheus_sampling_engine.publish(
+            "envoy", test_sample_data, test_inverter_data
+        )
+
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                "envoy_line_power_watts",
+                {"type": "total_production", "line": "2", "source": "envoy"},
+            ),
+            1.23,
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                "envoy_inverter_power_watts",
+                {"serial": "foobar", "source": "envoy", "col": "2", "row": "1"},
+            ),
+            123,
+        )
+        self.assertIsNotNone(
+            REGISTRY.get_sample_value(
+                "envoy_last_successful_sample_timestamp_seconds", {"source": "envoy"}
+            )
+        )
+
+    @mock.patch("envoy_logger.prometheus_sampling_engine.REGISTRY")
+    def test_snapshot_metrics(
+        self,
+        mock_registry,
+        mock_config,
+        mock_envoy,
+        mock_start_http_server,
+    ):
+        mock_config.envoys = [mock.Mock()]
+        mock_config.prometheus_metrics = "snapshot"
+        mock_config.prometheus_render_cache_seconds = 1.0
+        mock_config.prometheus_sample_timestamps = False
+        mock_config.prometheus_inverter_stale_seconds = None
+        mock_config.inverter_tag_names.return_value = []
+
+        test_sample_data = SampleData.create(sample_data=create_sample_data())
+        test_inverter_data = parse_inverter_data([create_inverter_data("foobar")])
+
+        try:
+            prometheus_sampling_engine = PrometheusSamplingEngine(
+                envoy=mock_envoy, config=mock_config
+            )
+            collector = prometheus_sampling_engine.collector
+            mock_registry.register.assert_called_once_with(collector)
+
+            with mock.patch.object(collector, "update") as mock_update:
+                prometheus_sampling_engine.publish(
+                    "envoy", test_sample_data, test_inverter_data
+                )
+            mock_update.assert_called_once_with(
+                "envoy", test_sample_data, test_inverter_data
+            )
+        finally:
+            PrometheusSamplingEngine.prometheus_collector = None
+
 
 if __name__ == "__main__":
     unittest.main()
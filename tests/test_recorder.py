@@ -0,0 +1,122 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from envoy_logger.recorder import PayloadRecorder, find_recordings, read_recordings
+
+
+class TestPayloadRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "recordings")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @mock.patch("envoy_logger.recorder.time.time")
+    def test_record_and_read(self, mock_time):
+        mock_time.return_value = 1700000000.5
+
+        recorder = PayloadRecorder(self.path)
+        # Pretty-printed payloads still take a single line
+        recorder.record("envoy", "production", b'{\n  "i": 0\n}')
+        recorder.record("envoy", "inverters", b"[]")
+        recorder.close()
+
+        files = find_recordings([self.path])
+        self.assertEqual(files, [os.path.join(self.path, "2023-11-14", "22.jsonl.gz")])
+
+        recordings = list(read_recordings(files))
+        self.assertEqual(
+            [(r.ts, r.source, r.endpoint) for r in recordings],
+            [
+                (1700000000.5, "envoy", "production"),
+                (1700000000.5, "envoy", "inverters"),
+            ],
+        )
+        self.assertEqual(json.loads(recordings[0].payload), {"i": 0})
+
+    @mock.patch("envoy_logger.recorder.time.time")
+    def test_partitions(self, mock_time):
+        recorder = PayloadRecorder(self.path, partition="day")
+        for ts in (1700000000, 1700100000, 1700000001):
+            mock_time.return_value = ts
+            recorder.record("envoy", "production", json.dumps({"ts": ts}).encode())
+        recorder.close()
+
+        files = find_recordings([self.path])
+        self.assertEqual(
+            [os.path.basename(file) for file in files],
+            ["2023-11-14.jsonl.gz", "2023-11-14.1.jsonl.gz", "2023-11-16.jsonl.gz"],
+        )
+
+        # Reopening a partition starts a new file, which is read after the first
+        recordings = list(read_recordings(files))
+        self.assertEqual(
+            [json.loads(r.payload)["ts"] for r in recordings],
+            [1700000000, 1700000001, 1700100000],
+        )
+
+    def test_unknown_partition(self):
+        with self.assertRaises(ValueError):
+            PayloadRecorder(self.path, partition="minute")
+
+    def test_truncated_and_malformed_recordings(self):
+        file = os.path.join(self.tmpdir.name, "recording.jsonl.gz")
+        data = gzip.compress(
+            b'{"ts":1,"source":"envoy","endpoint":"production"}\t{}\n'
+            b"not a recording\n"
+            b'{"ts":2,"source":"envoy","endpoint":"production"}\t{}\n'
+        )
+        with open(file, "wb") as f:
+            f.write(data[:-4])
+
+        recordings = list(read_recordings(find_recordings([file])))
+
+        self.assertEqual([r.ts for r in recordings], [1, 2])
+
+    @mock.patch("envoy_logger.recorder.time.time", return_value=1700000000)
+    def test_restart_after_unclean_stop(self, _):
+        recorder = PayloadRecorder(self.path)
+        recorder.record("envoy", "production", b'{"i": 0}')
+
+        # The process is killed, so the file is never closed
+        recorder._file.fileobj.close()
+
+        recorder = PayloadRecorder(self.path)
+        for i in range(1, 11):
+            recorder.record("envoy", "production", b'{"i": %d}' % i)
+        recorder.close()
+
+        files = find_recordings([self.path])
+        self.assertEqual(
+            [os.path.basename(file) for file in files], ["22.jsonl.gz", "22.1.jsonl.gz"]
+        )
+        with self.assertLogs("recorder", level="WARNING"):
+            recordings = list(read_recordings(files))
+        self.assertEqual(
+            [json.loads(r.payload)["i"] for r in recordings], list(range(11))
+        )
+
+    def test_corrupt_recording(self):
+        line = b'{"ts":1,"source":"envoy","endpoint":"production"}\t{}\n'
+        corrupt = os.path.join(self.tmpdir.name, "a.jsonl.gz")
+        data = bytearray(gzip.compress(line * 200))
+        data[20:30] = b"\xff" * 10
+        with open(corrupt, "wb") as f:
+            f.write(data)
+        valid = os.path.join(self.tmpdir.name, "b.jsonl.gz")
+        with open(valid, "wb") as f:
+            f.write(gzip.compress(line))
+
+        # The replay carries on with the next file
+        with self.assertLogs("recorder", level="WARNING"):
+            recordings = list(read_recordings([corrupt, valid]))
+        self.assertEqual(len(recordings), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import unittest
+from unittest import mock
+
+from tests.sample_data import create_inverter_data, create_sample_data
+
+from envoy_logger.decoder import JsonDecoder
+from envoy_logger.recorder import Recording
+from envoy_logger.replay import Replayer
+from envoy_logger.sink import Sink
+
+
+def production(source: str = "envoy") -> Recording:
+    return Recording(
+        ts=0,
+        source=source,
+        endpoint="production",
+        payload=json.dumps(create_sample_data()).encode(),
+    )
+
+
+def inverters(*reports, source: str = "envoy") -> Recording:
+    return Recording(
+        ts=0,
+        source=source,
+        endpoint="inverters",
+        payload=json.dumps(list(reports)).encode(),
+    )
+
+
+class TestReplayer(unittest.TestCase):
+    def setUp(self):
+        self.sink = mock.Mock(Sink)
+        self.replayer = Replayer(sinks=[self.sink], decoder=JsonDecoder())
+
+    def published(self):
+        return [
+            (source_tag, list(inverter_data))
+            for (source_tag, _, inverter_data), _ in self.sink.publish.call_args_list
+        ]
+
+    def test_inverter_reports_published_with_previous_sample(self):
+        report = create_inverter_data("foobar")
+
+        stats = self.replayer.replay(
+            [
+                production(),
+                inverters(report),
+                production(),
+                # The same report again is not published twice
+                inverters(report),
+                production(),
+            ]
+        )
+
+        self.assertEqual(
+            self.published(),
+            [("envoy", ["foobar"]), ("envoy", []), ("envoy", [])],
+        )
+        self.assertEqual(stats.payloads, 5)
+        self.assertEqual(stats.samples, 3)
+
+    def test_trailing_inverter_reports_are_published(self):
+        self.replayer.replay([production(), inverters(create_inverter_data("a"))])
+
+        self.assertEqual(self.published(), [("envoy", ["a"])])
+
+    def test_consecutive_inverter_reports_are_merged(self):
+        a = create_inverter_data("a")
+        b = create_inverter_data("b")
+        a_again = dict(a, lastReportDate=a["lastReportDate"] + 300)
+
+        stats = self.replayer.replay(
+            [
+                production(),
+                inverters(a),
+                inverters(a_again, b),
+                production(),
+            ]
+        )
+
+        # Each production sample is published once, so rollups do not count it twice
+        self.assertEqual(self.published(), [("envoy", ["a", "b"]), ("envoy", [])])
+        self.assertEqual(stats.samples, 2)
+        (_, _, inverter_data), _ = self.sink.publish.call_args_list[0]
+        self.assertEqual(inverter_data["a"].ts.timestamp(), a_again["lastReportDate"])
+
+    def test_inverter_reports_before_first_sample_are_merged(self):
+        a = create_inverter_data("a")
+        b = create_inverter_data("b")
+        a_again = dict(a, lastReportDate=a["lastReportDate"] + 300)
+
+        self.replayer.replay(
+            [inverters(a), inverters(b), inverters(a_again, b), production()]
+        )
+
+        self.assertEqual(self.published(), [("envoy", ["a", "b"])])
+        (_, _, inverter_data), _ = self.sink.publish.call_args
+        self.assertEqual(inverter_data["a"].ts.timestamp(), a_again["lastReportDate"])
+
+    def test_sources(self):
+        replayer = Replayer(
+            sinks=[self.sink], decoder=JsonDecoder(), sources=["garage"]
+        )
+
+        replayer.replay([production("house"), production("garage")])
+
+        self.assertEqual(self.published(), [("garage", [])])
+
+    def test_malformed_payload_is_skipped(self):
+        stats = self.replayer.replay(
+            [
+                Recording(ts=0, source="envoy", endpoint="production", payload=b"{"),
+                production(),
+            ]
+        )
+
+        self.assertEqual(stats.skipped, 1)
+        self.assertEqual(self.published(), [("envoy", [])])
+
+
+if __name__ == "__main__":
+    unittest.main()
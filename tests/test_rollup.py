@@ -0,0 +1,76 @@
+import unittest
+
+from envoy_logger.rollup import RollupStage, format_duration, parse_duration
+
+
+class TestRollupStage(unittest.TestCase):
+    def test_window_aggregates(self):
+        stage = RollupStage(resolution_seconds=60, bucket="foobar_1m")
+
+        self.assertIsNone(stage.add("production", 0, 0, {"P": 100.0, "V_rms": 240.0}))
+        self.assertIsNone(stage.add("production", 0, 30, {"P": 300.0, "V_rms": 230.0}))
+        self.assertIsNone(stage.add("inverter", "foobar", 30, {"P": 10.0}))
+
+        # First sample of the next window completes the previous one
+        result = stage.add("production", 0, 60, {"P": 300.0, "V_rms": 235.0})
+
+        self.assertEqual(result.measurement_type, "production")
+        self.assertEqual(result.id, "0")
+        self.assertEqual(result.window.start, 0)
+
+        power = result.window.fields["P"]
+        self.assertEqual(power.min, 100.0)
+        self.assertEqual(power.max, 300.0)
+        self.assertEqual(power.mean, 200.0)
+        self.assertEqual(power.last, 300.0)
+        self.assertEqual(result.window.fields["V_rms"].min, 230.0)
+        self.assertAlmostEqual(result.window.energy.Wh, 200.0 * 30 / 3600)
+
+        # The interval spanning the window boundary is counted in the next window
+        result = stage.add("production", 0, 120, {"P": 300.0})
+        self.assertAlmostEqual(result.window.energy.Wh, 300.0 * 30 / 3600)
+
+    def test_late_sample_ignored(self):
+        stage = RollupStage(resolution_seconds=60, bucket="foobar_1m")
+        stage.add("net", 0, 0, {"P": 1.0})
+        stage.add("net", 0, 61, {"P": 1.0})
+
+        self.assertIsNone(stage.add("net", 0, 30, {"P": 1.0}))
+        self.assertEqual(
+            stage.add("net", 0, 121, {"P": 1.0}).window.fields["P"].count, 1
+        )
+
+    def test_no_energy_across_gaps(self):
+        stage = RollupStage(resolution_seconds=60, bucket="foobar_1m", max_gap=300)
+        stage.add("production", 0, 50, {"P": 500.0})
+
+        # The samples stop for an hour
+        result = stage.add("production", 0, 3650, {"P": 500.0})
+        self.assertEqual(result.window.energy.Wh, 0.0)
+
+        # Integration resumes after the gap
+        result = stage.add("production", 0, 3720, {"P": 500.0})
+        self.assertIsNone(stage.add("production", 0, 3730, {"P": 500.0}))
+        result = stage.add("production", 0, 3780, {"P": 500.0})
+        self.assertAlmostEqual(result.window.energy.Wh, 500.0 * 80 / 3600)
+
+
+class TestDuration(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("30s"), 30)
+        self.assertEqual(parse_duration("15m"), 900)
+        self.assertEqual(parse_duration("1h"), 3600)
+        self.assertEqual(parse_duration(60), 60)
+
+        with self.assertRaises(ValueError):
+            parse_duration("foobar")
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(60), "1m")
+        self.assertEqual(format_duration(900), "15m")
+        self.assertEqual(format_duration(3600), "1h")
+        self.assertEqual(format_duration(90), "90s")
+
+
+if __name__ == "__main__":
+    unittest.main()
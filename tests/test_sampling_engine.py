@@ -3,8 +3,9 @@ from datetime import datetime, timezone
 from unittest import mock
 
 from requests import ConnectTimeout
+from tests.sample_data import create_inverter_data
 
-from envoy_logger.model import InverterSample, SampleData
+from envoy_logger.model import SampleData, parse_inverter_data
 from envoy_logger.sampling_engine import SamplingEngine
 
 
@@ -17,16 +18,16 @@ class SamplingEngineChildClass(SamplingEngine):
 class TestSamplingEngine(unittest.TestCase):
     def test_collect_samples_with_retry(self, mock_envoy):
         mock_sample_data = mock.Mock(SampleData)
-        mock_inverter_sample = mock.Mock(InverterSample)
-
-        mock_inverter_data = {"foobar": mock_inverter_sample}
 
+        test_inverter_data = create_inverter_data("foobar")
         mock_envoy.get_power_data.return_value = mock_sample_data
-        mock_envoy.get_inverter_data.return_value = mock_inverter_data
+        mock_envoy.get_inverter_data.return_value = parse_inverter_data(
+            [test_inverter_data]
+        )
 
         sampling_engine = SamplingEngineChildClass(envoy=mock_envoy)
 
-        # Call the first time, but the inverter data will be empty because it is skipped
+        # The first cycle already has the inverter data
         sample_data, inverter_data = sampling_engine.collect_samples_with_retry()
 
         self.assertEqual(
@@ -34,14 +35,22 @@ class TestSamplingEngine(unittest.TestCase):
             mock_sample_data,
         )
 
-        # Call a second time to get the inverter data
-        mock_inverter_sample.ts = datetime.now(tz=timezone.utc)
+        self.assertEqual(list(inverter_data), ["foobar"])
+        self.assertEqual(inverter_data["foobar"].watts, 123)
+
+        # The same report is only emitted once
         sample_data, inverter_data = sampling_engine.collect_samples_with_retry()
 
-        self.assertEqual(
-            inverter_data,
-            mock_inverter_data,
+        self.assertEqual(len(inverter_data), 0)
+
+        # Until the inverter reports again
+        test_inverter_data["lastReportDate"] += 300
+        mock_envoy.get_inverter_data.return_value = parse_inverter_data(
+            [test_inverter_data]
         )
+        sample_data, inverter_data = sampling_engine.collect_samples_with_retry()
+
+        self.assertEqual(list(inverter_data), ["foobar"])
 
     def test_collect_samples_with_retry_timeout(self, mock_envoy):
         mock_envoy.get_power_data.side_effect = mock.Mock(
@@ -55,6 +64,54 @@ class TestSamplingEngine(unittest.TestCase):
 
         self.assertEqual(str(ex.exception), "Sample collection timed out.")
 
+    def test_collect_samples_with_retry_concurrent(self, mock_envoy):
+        mock_sample_data = mock.Mock(SampleData)
+        test_inverter_data = parse_inverter_data([create_inverter_data("foobar")])
+
+        mock_envoy.get_power_data.return_value = mock_sample_data
+        mock_envoy.get_inverter_data.return_value = test_inverter_data
+
+        sampling_engine = SamplingEngineChildClass(envoy=mock_envoy, concurrent=True)
+        sampling_engine.last_sample_timestamp = datetime.fromtimestamp(
+            0, tz=timezone.utc
+        )
+
+        sample_data, inverter_data = sampling_engine.collect_samples_with_retry()
+
+        self.assertEqual(sample_data, mock_sample_data)
+        self.assertEqual(inverter_data, test_inverter_data)
+
+    def test_collect_samples_with_retry_concurrent_timeout(self, mock_envoy):
+        mock_envoy.get_power_data.return_value = mock.Mock(SampleData)
+        mock_envoy.get_inverter_data.side_effect = ConnectTimeout("foobar")
+
+        sampling_engine = SamplingEngineChildClass(envoy=mock_envoy, concurrent=True)
+
+        with self.assertRaises(TimeoutError):
+            sampling_engine.collect_samples_with_retry(retries=2, wait_seconds=0.1)
+
+        self.assertEqual(mock_envoy.get_inverter_data.call_count, 2)
+
+    def test_failed_cycle_polls_inverters_again(self, mock_envoy):
+        mock_envoy.get_power_data.side_effect = [
+            ConnectTimeout("foobar"),
+            mock.Mock(SampleData),
+        ]
+        mock_envoy.get_inverter_data.return_value = parse_inverter_data(
+            [create_inverter_data("foobar")]
+        )
+
+        sampling_engine = SamplingEngineChildClass(
+            envoy=mock_envoy, concurrent=True, adaptive_inverter_polling=True
+        )
+
+        _, inverter_data = sampling_engine.collect_samples_with_retry(wait_seconds=0)
+
+        # The inverters were fetched on the failed attempt, and again on the retry
+        self.assertEqual(mock_envoy.get_inverter_data.call_count, 2)
+        self.assertEqual(list(inverter_data), ["foobar"])
+        mock_envoy.commit_inverter_data.assert_called_once()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from envoy_logger.internal_metrics import internal_metrics_fields
+from envoy_logger.scheduler import Scheduler
+
+
+def get_counter(name, source):
+    return (
+        REGISTRY.get_sample_value(f"envoy_logger_{name}_total", {"source": source})
+        or 0.0
+    )
+
+
+@mock.patch("envoy_logger.scheduler.time.time", return_value=1002.0)
+@mock.patch("envoy_logger.scheduler.time.monotonic")
+class TestScheduler(unittest.TestCase):
+    def _start(self, scheduler, mock_monotonic):
+        # Wall clock is 2s into a 5s interval, so the first tick is 3s away
+        mock_monotonic.return_value = 100.0
+        self.assertEqual(scheduler.next_delay(), 3.0)
+        mock_monotonic.return_value = 103.0
+        scheduler.tick_started()
+
+    def test_on_schedule(self, mock_monotonic, _):
+        scheduler = Scheduler(5)
+        self._start(scheduler, mock_monotonic)
+
+        # The cycle took 1s, so the next tick is 4s away
+        mock_monotonic.return_value = 104.0
+        self.assertEqual(scheduler.next_delay(), 4.0)
+
+        # Delays are relative to the schedule, so sleeping too long does not drift
+        mock_monotonic.return_value = 108.2
+        scheduler.tick_started()
+        mock_monotonic.return_value = 109.0
+        self.assertEqual(scheduler.next_delay(), 4.0)
+
+        self.assertEqual(scheduler.stats.ticks, 3)
+        self.assertEqual(scheduler.stats.late, 0)
+        self.assertEqual(scheduler.stats.overruns, 0)
+
+    def test_late(self, mock_monotonic, _):
+        scheduler = Scheduler(5)
+        self._start(scheduler, mock_monotonic)
+
+        scheduler.next_delay()
+        mock_monotonic.return_value = 109.0
+        scheduler.tick_started()
+
+        self.assertEqual(scheduler.stats.late, 1)
+
+    def test_skip(self, mock_monotonic, _):
+        scheduler = Scheduler(5, overrun_policy="skip")
+        self._start(scheduler, mock_monotonic)
+
+        # The cycle ran through the ticks at 108 and 113
+        mock_monotonic.return_value = 114.0
+        self.assertEqual(scheduler.next_delay(), 4.0)
+
+        self.assertEqual(scheduler.stats.overruns, 1)
+        self.assertEqual(scheduler.stats.skipped, 2)
+
+    def test_counters(self, mock_monotonic, _):
+        late = get_counter("scheduler_late_ticks", "counted")
+        skipped = get_counter("scheduler_skipped_ticks", "counted")
+        overruns = get_counter("scheduler_overruns", "counted")
+
+        scheduler = Scheduler(5, overrun_policy="skip", source="counted")
+        self._start(scheduler, mock_monotonic)
+
+        # The cycle started late, then ran through the ticks at 113 and 118
+        scheduler.next_delay()
+        mock_monotonic.return_value = 109.0
+        scheduler.tick_started()
+        mock_monotonic.return_value = 119.0
+        scheduler.next_delay()
+
+        self.assertEqual(get_counter("scheduler_late_ticks", "counted"), late + 1)
+        self.assertEqual(get_counter("scheduler_skipped_ticks", "counted"), skipped + 2)
+        self.assertEqual(get_counter("scheduler_overruns", "counted"), overruns + 1)
+
+        fields = internal_metrics_fields()
+        self.assertEqual(fields["scheduler_late_ticks_total_counted"], late + 1)
+        self.assertEqual(fields["scheduler_skipped_ticks_total_counted"], skipped + 2)
+        self.assertEqual(fields["scheduler_overruns_total_counted"], overruns + 1)
+
+    def test_catch_up(self, mock_monotonic, _):
+        scheduler = Scheduler(5, overrun_policy="catch_up")
+        self._start(scheduler, mock_monotonic)
+
+        mock_monotonic.return_value = 114.0
+        with self.assertLogs("scheduler", level="WARNING") as logs:
+            self.assertEqual(scheduler.next_delay(), 0.0)
+            scheduler.tick_started()
+            self.assertEqual(scheduler.next_delay(), 0.0)
+            scheduler.tick_started()
+        self.assertEqual(scheduler.next_delay(), 4.0)
+
+        # The backlog is one overrun, and its ticks are not late
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(scheduler.stats.overruns, 1)
+        self.assertEqual(scheduler.stats.late, 0)
+        self.assertEqual(scheduler.stats.skipped, 0)
+        self.assertEqual(scheduler.stats.ticks, 4)
+
+        # Overrunning again once caught up counts as a new overrun
+        mock_monotonic.return_value = 124.0
+        self.assertEqual(scheduler.next_delay(), 0.0)
+        self.assertEqual(scheduler.stats.overruns, 2)
+
+    def test_catch_up_backlog_limit(self, mock_monotonic, _):
+        scheduler = Scheduler(5, overrun_policy="catch_up", max_backlog=1)
+        self._start(scheduler, mock_monotonic)
+
+        mock_monotonic.return_value = 114.0
+        self.assertEqual(scheduler.next_delay(), 0.0)
+        self.assertEqual(scheduler.next_delay(), 4.0)
+
+        self.assertEqual(scheduler.stats.skipped, 1)
+
+    def test_coalesce(self, mock_monotonic, _):
+        scheduler = Scheduler(5, overrun_policy="coalesce")
+        self._start(scheduler, mock_monotonic)
+
+        mock_monotonic.return_value = 114.0
+        self.assertEqual(scheduler.next_delay(), 0.0)
+        self.assertEqual(scheduler.next_delay(), 4.0)
+
+        self.assertEqual(scheduler.stats.overruns, 1)
+        self.assertEqual(scheduler.stats.skipped, 1)
+
+    def test_unknown_policy(self, *_):
+        with self.assertRaises(ValueError):
+            Scheduler(5, overrun_policy="foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import unittest
+
+import requests
+
+from envoy_logger.enphase_energy import EnphaseEnergy
+from envoy_logger.envoy import Envoy
+from envoy_logger.simulator import EnvoySimulator, start_simulator
+
+
+class TestEnvoySimulator(unittest.TestCase):
+    def setUp(self):
+        self.simulator = EnvoySimulator(inverters=10, lines=3, seed=0)
+        self.server = start_simulator(self.simulator)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _create_envoy(self):
+        enphase_energy = EnphaseEnergy(
+            email="name@example.com",
+            password="mypassword123",
+            envoy_serial=self.simulator.serial,
+            enlighten_url=self.server.url,
+            entrez_url=self.server.url,
+        )
+        return Envoy(url=self.server.url, enphase_energy=enphase_energy)
+
+    def test_sample_envoy(self):
+        envoy = self._create_envoy()
+
+        sample_data = envoy.get_power_data()
+        inverter_data = envoy.get_inverter_data()
+        inventory = envoy.get_inventory()
+
+        self.assertEqual(len(sample_data.total_production.eim_line_samples), 3)
+        self.assertEqual(len(sample_data.net_consumption.eim_line_samples), 3)
+        self.assertEqual(len(inverter_data), 10)
+        self.assertEqual(len(inventory[0]["devices"]), 10)
+
+        # Logged in once, then reused the session
+        self.assertEqual(self.simulator.requests["/auth/check_jwt"], 1)
+        self.assertEqual(self.simulator.requests["/tokens"], 1)
+
+    def test_inverter_reports_are_staggered(self):
+        reports = self.simulator.inverters(now=1000.0)
+
+        self.assertEqual(
+            sorted(report["lastReportDate"] for report in reports),
+            [720 + 30 * i for i in range(10)],
+        )
+        # Nothing changes until the next report
+        self.assertEqual(
+            json.dumps(self.simulator.inverters(now=1000.0)),
+            json.dumps(self.simulator.inverters(now=1009.0)),
+        )
+
+    def test_session_required(self):
+        response = requests.get(f"{self.server.url}/production.json", timeout=5)
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_errors(self):
+        self.simulator.error_rate = 1.0
+
+        response = requests.get(f"{self.server.url}/production.json", timeout=5)
+
+        self.assertEqual(response.status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests.sample_data import create_sample_data
+
+from envoy_logger.model import SampleData, parse_inverter_data
+from envoy_logger.sink import QueuedSink, Sink
+
+
+class TestQueuedSink(unittest.TestCase):
+    def setUp(self):
+        self.sample_data = SampleData.create(sample_data=create_sample_data())
+        self.inverter_data = parse_inverter_data([])
+
+    def test_publish(self):
+        mock_sink = mock.Mock(Sink)
+
+        sink = QueuedSink(mock_sink, name="foobar")
+        sink.publish("envoy", self.sample_data, self.inverter_data)
+        sink.close(timeout=5)
+
+        mock_sink.publish.assert_called_once_with(
+            "envoy", self.sample_data, self.inverter_data
+        )
+
+    def test_failure_does_not_stop_worker(self):
+        mock_sink = mock.Mock(Sink)
+        mock_sink.publish.side_effect = [Exception("foobar"), None]
+
+        sink = QueuedSink(mock_sink, name="foobar")
+        sink.publish("envoy", self.sample_data, self.inverter_data)
+        sink.publish("barn", self.sample_data, self.inverter_data)
+        sink.close(timeout=5)
+
+        self.assertEqual(mock_sink.publish.call_count, 2)
+
+    def test_slow_sink_drop_oldest(self):
+        mock_sink = mock.Mock(Sink)
+        publish_blocked = threading.Event()
+        publish_started = threading.Event()
+
+        def publish(*args):
+            publish_started.set()
+            publish_blocked.wait(5)
+
+        mock_sink.publish.side_effect = publish
+
+        sink = QueuedSink(
+            mock_sink, name="foobar", max_queue_depth=2, backpressure="drop_oldest"
+        )
+        sink.publish("first", self.sample_data, self.inverter_data)
+        publish_started.wait(5)
+
+        # The worker is stuck on the first sample, but publishing does not block
+        for source_tag in ("a", "b", "c", "d"):
+            sink.publish(source_tag, self.sample_data, self.inverter_data)
+        self.assertEqual(sink.queue_depth, 2)
+
+        publish_blocked.set()
+        sink.close(timeout=5)
+
+        published = [call.args[0] for call in mock_sink.publish.call_args_list]
+        self.assertEqual(published, ["first", "c", "d"])
+
+    def test_close_timeout(self):
+        mock_sink = mock.Mock(Sink)
+        publish_blocked = threading.Event()
+        mock_sink.publish.side_effect = lambda *args: publish_blocked.wait(5)
+        self.addCleanup(publish_blocked.set)
+
+        sink = QueuedSink(
+            mock_sink, name="foobar", max_queue_depth=1, backpressure="block"
+        )
+        sink.publish("first", self.sample_data, self.inverter_data)
+        sink.publish("second", self.sample_data, self.inverter_data)
+
+        # The worker is stuck and the queue is full, so there is no room to stop it
+        start = time.monotonic()
+        with self.assertLogs("sink", level="WARNING"):
+            sink.close(timeout=0.2)
+        self.assertLess(time.monotonic() - start, 2)
+
+        # Samples published after closing are dropped rather than queued
+        with self.assertLogs("sink", level="WARNING"):
+            sink.publish("third", self.sample_data, self.inverter_data)
+
+    def test_drop_oldest_race(self):
+        sink = QueuedSink(
+            mock.Mock(Sink),
+            name="foobar",
+            max_queue_depth=1,
+            backpressure="drop_oldest",
+        )
+        self.addCleanup(sink.close, timeout=5)
+
+        # The worker takes the queued sample between the full queue and the drop
+        worker_queue = sink._queue
+        self.addCleanup(setattr, sink, "_queue", worker_queue)
+        sink._queue = mock.Mock(queue.Queue)
+        sink._queue.put_nowait.side_effect = [queue.Full(), None]
+        sink._queue.get_nowait.side_effect = queue.Empty()
+        dropped = sink._dropped._value.get()
+
+        sink.publish("envoy", self.sample_data, self.inverter_data)
+
+        self.assertEqual(sink._dropped._value.get(), dropped)
+        self.assertEqual(sink._queue.put_nowait.call_count, 2)
+
+    def test_invalid_backpressure(self):
+        with self.assertRaises(ValueError):
+            QueuedSink(mock.Mock(Sink), name="foobar", backpressure="foobar")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+from envoy_logger.spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_replay_oldest_first(self):
+        spool = Spool(self.tmp_dir.name, segment_max_bytes=16)
+        spool.append("foobar_hr", ["line0 P=0", "line1 P=1"])
+        spool.append("foobar_lr", ["line2 P=2"])
+        spool.append("foobar_hr", ["line3 P=3"])
+
+        self.assertTrue(spool.pending())
+
+        written = []
+        count = spool.replay(lambda bucket, lines: written.append((bucket, lines)))
+
+        self.assertEqual(count, 4)
+        self.assertEqual(
+            written,
+            [
+                ("foobar_hr", ["line0 P=0", "line1 P=1"]),
+                ("foobar_lr", ["line2 P=2"]),
+                ("foobar_hr", ["line3 P=3"]),
+            ],
+        )
+        self.assertFalse(spool.pending())
+        self.assertEqual(spool.size(), 0)
+
+    def test_stray_files_are_ignored(self):
+        os.makedirs(os.path.join(self.tmp_dir.name, "foobar_hr"))
+        stray_path = os.path.join(self.tmp_dir.name, "foobar_hr", "foo.lp")
+        with open(stray_path, "w") as f:
+            f.write("not a segment")
+
+        with self.assertLogs("spool", level="WARNING"):
+            spool = Spool(self.tmp_dir.name)
+        spool.append("foobar_hr", ["line0 P=0"])
+
+        written = []
+        count = spool.replay(lambda bucket, lines: written.append((bucket, lines)))
+
+        self.assertEqual(count, 1)
+        self.assertEqual(written, [("foobar_hr", ["line0 P=0"])])
+        self.assertTrue(os.path.exists(stray_path))
+
+    def test_replay_max_segments(self):
+        spool = Spool(self.tmp_dir.name, segment_max_bytes=16)
+        spool.append("foobar_hr", ["line0 P=0", "line1 P=1"])
+        spool.append("foobar_hr", ["line2 P=2", "line3 P=3"])
+
+        written = []
+        spool.replay(lambda bucket, lines: written.extend(lines), max_segments=1)
+        self.assertEqual(written, ["line0 P=0", "line1 P=1"])
+        self.assertTrue(spool.pending())
+
+        spool.replay(lambda bucket, lines: written.extend(lines), max_segments=1)
+        self.assertEqual(len(written), 4)
+        self.assertFalse(spool.pending())
+
+    def test_replay_failure_keeps_segments(self):
+        spool = Spool(self.tmp_dir.name)
+        spool.append("foobar_hr", ["line0 P=0"])
+
+        def failing_write(bucket, lines):
+            raise ConnectionError("foobar")
+
+        with self.assertRaises(ConnectionError):
+            spool.replay(failing_write)
+
+        self.assertTrue(spool.pending())
+
+        # Segments survive a restart
+        spool.close()
+        spool = Spool(self.tmp_dir.name)
+        self.assertTrue(spool.pending())
+
+        written = []
+        spool.replay(lambda bucket, lines: written.extend(lines))
+        self.assertEqual(written, ["line0 P=0"])
+
+    def test_max_bytes(self):
+        spool = Spool(self.tmp_dir.name, segment_max_bytes=10, max_bytes=30)
+        for i in range(10):
+            spool.append("foobar_hr", [f"line{i} P={i}"])
+
+        self.assertLessEqual(spool.size(), 30)
+
+        written = []
+        spool.replay(lambda bucket, lines: written.extend(lines))
+        self.assertEqual(written[-1], "line9 P=9")
+        self.assertLess(len(written), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import threading
+import unittest
+
+from envoy_logger.startup import Startup
+
+
+class TestStartup(unittest.TestCase):
+    def test_steps_run_concurrently(self):
+        startup = Startup()
+        barrier = threading.Barrier(2, timeout=5)
+
+        # Each step waits for the other, so this only finishes if both run at once
+        first = startup.submit("first", barrier.wait)
+        second = startup.submit("second", barrier.wait)
+        with startup.timed("inline"):
+            pass
+
+        with self.assertLogs("startup", level="INFO") as logs:
+            elapsed = startup.finish()
+
+        self.assertIsNone(first.exception())
+        self.assertIsNone(second.exception())
+        self.assertEqual(set(startup.timings), {"first", "second", "inline"})
+        self.assertGreaterEqual(elapsed, 0)
+        self.assertIn("Started in", logs.output[-1])
+
+    def test_failed_step_is_logged(self):
+        startup = Startup()
+
+        def login():
+            raise ConnectionError("foobar")
+
+        future = startup.submit("login", login)
+
+        with self.assertLogs("startup", level="WARNING") as logs:
+            startup.finish()
+
+        self.assertIsInstance(future.exception(), ConnectionError)
+        self.assertIn("Startup step login failed: foobar", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()